@@ -0,0 +1,25 @@
+from typing import Callable, Optional
+import random
+
+# Jittered exponential backoff for reconnecting and retrying.
+#
+# Each failure doubles the delay, up to a cap. The delay is jittered between half and all of it so
+# that clients that lost their connection at the same time don't all come back at the same moment,
+# while never retrying much sooner than the backoff asks for. The delay goes back to the start once
+# reset is called after a success.
+
+class Backoff():
+    def __init__(self, base: float = 1.0, cap: float = 60.0, rng: Optional[Callable[[], float]] = None):
+        self.base = base
+        self.cap = cap
+        self.rng = rng or random.random
+        self.failures = 0
+
+    # Delay before the next attempt, counting a failure
+    def next(self) -> float:
+        delay = min(self.cap, self.base * 2 ** self.failures)
+        self.failures = min(self.failures + 1, 32) # stop growing long after the cap is reached
+        return delay / 2 + delay / 2 * self.rng()
+
+    def reset(self):
+        self.failures = 0
@@ -0,0 +1,96 @@
+# Benchmark of queue reads and writes under contention: two threads run a mix of reads and writes
+# against one queue while an asyncio loop on the main thread reads from it on a timer, as the Discord
+# bot would. Reads are run as they are now, reading the published snapshot without the lock, and
+# with the lock held around them, as every read used to be. Reports read and write latency on the
+# threads, and read latency and event loop lag on the loop.
+# Run from the repository root with: python -m benchmarks.contention
+from contextlib import nullcontext
+import asyncio
+import random
+import threading
+import time
+
+from game_queue import GameQueue
+
+PLAYERS = 10_000
+DURATION = 3.0
+WRITE_SHARE = 0.2
+LOOP_INTERVAL = 0.001
+
+def percentiles(values) -> str:
+    values = sorted(values)
+    if not values:
+        return 'no samples'
+    def at(p):
+        return values[min(len(values) - 1, int(len(values) * p))] * 1e6
+    return f"p50 {at(0.5):8.1f}us  p99 {at(0.99):8.1f}us  max {at(1):8.1f}us"
+
+def read(queue, name, rng):
+    r = rng.random()
+    if r < 0.6:
+        queue.user_pos(name)
+    elif r < 0.8:
+        queue.page(rng.randint(1, 50))
+    else:
+        queue.next()
+
+def worker(queue, locked, seed, stop, reads, writes):
+    rng = random.Random(seed)
+    guard = queue.lock if locked else nullcontext()
+    while not stop.is_set():
+        name = f"player{rng.randrange(PLAYERS)}"
+        start = time.perf_counter()
+        if rng.random() < WRITE_SHARE:
+            if not queue.remove(name):
+                queue.push(name, '')
+            writes.append(time.perf_counter() - start)
+        else:
+            with guard:
+                read(queue, name, rng)
+            reads.append(time.perf_counter() - start)
+
+async def loop_reader(queue, locked, stop, reads, lags):
+    rng = random.Random(2)
+    guard = queue.lock if locked else nullcontext()
+    due = time.perf_counter()
+    while not stop.is_set():
+        due += LOOP_INTERVAL
+        await asyncio.sleep(max(0, due - time.perf_counter()))
+        lags.append(max(0, time.perf_counter() - due))
+
+        start = time.perf_counter()
+        with guard:
+            read(queue, f"player{rng.randrange(PLAYERS)}", rng)
+        reads.append(time.perf_counter() - start)
+
+async def run(locked: bool):
+    queue = GameQueue(False)
+    for i in range(0, PLAYERS, 2):
+        queue.push(f"player{i}", '')
+
+    stop = threading.Event()
+    thread_reads, thread_writes = [], []
+    threads = [threading.Thread(target=worker, args=(queue, locked, seed, stop, thread_reads, thread_writes))
+            for seed in range(2)]
+    for thread in threads:
+        thread.start()
+
+    loop_reads, lags = [], []
+    reader = asyncio.ensure_future(loop_reader(queue, locked, stop, loop_reads, lags))
+    await asyncio.sleep(DURATION)
+    stop.set()
+    await reader
+    for thread in threads:
+        thread.join()
+
+    print(f"\n{'reads holding the lock' if locked else 'lock-free reads'}")
+    print(f"  thread reads:  {len(thread_reads) / DURATION:8.0f}/s  {percentiles(thread_reads)}")
+    print(f"  thread writes: {len(thread_writes) / DURATION:8.0f}/s  {percentiles(thread_writes)}")
+    print(f"  loop reads:    {len(loop_reads) / DURATION:8.0f}/s  {percentiles(loop_reads)}")
+    print(f"  loop lag:      {'':10}  {percentiles(lags)}")
+
+if __name__ == '__main__':
+    print(f"{PLAYERS // 2} players, 2 threads with {WRITE_SHARE:.0%} writes, and an event loop reading "
+            f"every {LOOP_INTERVAL * 1000:.0f}ms, for {DURATION:.0f}s each")
+    asyncio.run(run(locked=True))
+    asyncio.run(run(locked=False))
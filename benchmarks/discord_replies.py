@@ -0,0 +1,49 @@
+# Benchmark counting Discord API calls for a rush of joins, with and without reply batching
+# Run from the repository root with: python -m benchmarks.discord_replies
+import asyncio
+import time
+
+from benchmarks.fake_discord import FakeChannel, FakeContext, FakeMember
+from game_queue import GameQueue
+from reply_batcher import ReplyBatcher
+
+JOINS = 1000
+JOINS_PER_SECOND = 400
+CHANNELS = 3
+
+async def join(ctx, queue, send):
+    pos = queue.push(ctx.message.author.name, '')
+    await send(ctx, f"{ctx.message.author.mention} has been added to the queue at position {pos}")
+
+async def run(batcher):
+    queue = GameQueue(False)
+    channels = [FakeChannel(i) for i in range(CHANNELS)]
+
+    if batcher is None:
+        async def send(ctx, message):
+            await ctx.send(message)
+    else:
+        async def send(ctx, message):
+            await batcher.send(ctx.channel, message)
+
+    start = time.perf_counter()
+    tasks = []
+    for i in range(JOINS):
+        ctx = FakeContext(channels[i % CHANNELS], FakeMember(i))
+        tasks.append(asyncio.ensure_future(join(ctx, queue, send)))
+        await asyncio.sleep(1 / JOINS_PER_SECOND)
+    await asyncio.gather(*tasks)
+    if batcher is not None:
+        await batcher.flush()
+    elapsed = time.perf_counter() - start
+
+    assert sum(c.delivered for c in channels) == JOINS, 'Replies were lost'
+    return sum(c.api_calls for c in channels), elapsed
+
+if __name__ == '__main__':
+    direct_calls, direct_time = asyncio.run(run(None))
+    batched_calls, batched_time = asyncio.run(run(ReplyBatcher()))
+
+    print(f"{JOINS} joins at {JOINS_PER_SECOND}/s over {CHANNELS} channels")
+    print(f"direct:  {direct_calls} API calls in {direct_time:.2f}s")
+    print(f"batched: {batched_calls} API calls in {batched_time:.2f}s")
@@ -0,0 +1,57 @@
+# Stand-ins for the parts of discord.py's Context that the bot's commands use, for benchmarks
+import asyncio
+import time
+
+class FakeRole():
+    def __init__(self, role_id: int, name: str):
+        self.id = role_id
+        self.name = name
+
+class FakeGuild():
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+class FakeMember():
+    def __init__(self, member_id: int, name: str = None, roles=(), guild=None):
+        self.id = member_id
+        self.name = name or f"player{member_id}"
+        self.mention = f"<@{member_id}>"
+        self.roles = list(roles)
+        self.guild = guild
+
+class FakeChannel():
+    def __init__(self, channel_id: int, name: str = None, api_delay: float = 0.005):
+        self.id = channel_id
+        self.name = name or f"channel-{channel_id}"
+        self.api_delay = api_delay # round trip to the API
+
+        self.api_calls = 0
+        self.delivered = 0
+        self.received = [] # (time sent, line) for every line of every message
+        self.error = None # exception every send raises, such as while Discord is unreachable
+
+    async def send(self, message: str):
+        self.api_calls += 1
+        await asyncio.sleep(self.api_delay)
+        if self.error is not None:
+            raise self.error
+        now = time.perf_counter()
+        for line in message.split('\n'):
+            self.delivered += 1
+            self.received.append((now, line))
+
+class FakeMessage():
+    def __init__(self, author, content: str = ''):
+        self.author = author
+        self.content = content
+
+class FakeContext():
+    def __init__(self, channel, author, content: str = '', guild=None, bot=None):
+        self.channel = channel
+        self.author = author
+        self.message = FakeMessage(author, content)
+        self.guild = guild
+        self.bot = bot
+
+    async def send(self, message: str):
+        await self.channel.send(message)
@@ -0,0 +1,100 @@
+# Local stand-in for the Twitch IRC server, for benchmarks
+import asyncio
+import time
+import zlib
+
+SERVER_NAME = 'tmi.twitch.tv'
+
+class FakeTwitchServer():
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host = host
+        self.port = port
+
+        self._server = None
+        self._clients = [] # (writer, nickname)
+        self.joined = asyncio.Event()
+
+        # Messages sent by the bot as (time received, channel, text)
+        self.received = []
+        self._waiters = []
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for writer, _ in self._clients:
+            writer.close()
+        self._clients.clear()
+        self._server.close()
+        await self._server.wait_closed()
+
+    # Drop every connection without closing it properly and stop listening, as if the server went
+    # down. Call start to bring it back on the same port
+    async def kill(self):
+        for writer, _ in self._clients:
+            writer.transport.abort()
+        self._clients.clear()
+        self.joined.clear()
+        self._server.close()
+        await self._server.wait_closed()
+
+    # Settings for a TwitchBot that connects to this server
+    def bot_settings(self, channel: str = 'ogc') -> dict:
+        return {'bot_name': 'queuebot', 'token': 'oauth:test', 'channel': channel,
+                'server': self.host, 'port': self.port,
+                'admin_badges': {'broadcaster', 'moderator'},
+                'supporter_badges': {'broadcaster', 'moderator', 'subscriber'},
+                'can_join': True,
+                'message_rate': [1_000_000, 1]}
+
+    # Send a chat message from a user to every connected client
+    def say(self, channel: str, user: str, text: str, badges: str = ''):
+        tags = f"@badge-info=;badges={badges};color=;display-name={user};emotes=;mod=0;" \
+                f"room-id=1;subscriber=0;tmi-sent-ts={int(time.time() * 1000)};turbo=0;" \
+                f"user-id={zlib.crc32(user.lower().encode())};user-type="
+        line = f"{tags} :{user.lower()}!{user.lower()}@{user.lower()}.{SERVER_NAME} PRIVMSG #{channel} :{text}\r\n"
+        data = line.encode('utf-8')
+        for writer, _ in self._clients:
+            writer.write(data)
+
+    # Wait for the bot to send a message
+    async def wait_for_message(self) -> tuple:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        return await future
+
+    async def _handle(self, reader, writer):
+        nickname = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8').rstrip('\r\n')
+                command, _, rest = line.partition(' ')
+
+                if command == 'NICK':
+                    nickname = rest
+                    self._clients.append((writer, nickname))
+                    writer.write(f":{SERVER_NAME} 001 {nickname} :Welcome, GLHF!\r\n".encode())
+                elif command == 'CAP':
+                    writer.write(f":{SERVER_NAME} CAP * ACK {rest[4:]}\r\n".encode())
+                elif command == 'JOIN':
+                    writer.write(f":{nickname}!{nickname}@{nickname}.{SERVER_NAME} JOIN {rest}\r\n".encode())
+                    self.joined.set()
+                elif command == 'PING':
+                    writer.write(f":{SERVER_NAME} PONG {SERVER_NAME} {rest}\r\n".encode())
+                elif command == 'PRIVMSG':
+                    channel, _, text = rest.partition(' :')
+                    message = (time.perf_counter(), channel, text)
+                    self.received.append(message)
+                    waiters, self._waiters = self._waiters, []
+                    for future in waiters:
+                        if not future.done():
+                            future.set_result(message)
+        except ConnectionError:
+            pass # the bot disconnected without quitting
+        finally:
+            self._clients = [client for client in self._clients if client[0] is not writer]
+            writer.close()
@@ -0,0 +1,249 @@
+# Benchmark of the change feed. Hundreds of clients, run in another process, follow one queue's
+# feed over loopback while a writer on the server's event loop joins, leaves, promotes, renames
+# and takes players off the queue at a steady rate. A few of the clients stop reading until the
+# writer is done, so they fall behind and have to be sent a snapshot. Every client applies the
+# deltas to its own copy of the queue, which is checked against the queue at the end. Reports the
+# writer's time per change with and without the feed, event loop lag, and how long changes take
+# to reach the clients that keep up.
+# Exits with status 1 if any client ends up with the wrong queue.
+# Run from the repository root with: python -m benchmarks.feed_fanout [options]
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import sys
+import time
+
+from change_feed import FeedServer
+from game_queue import GameQueue
+from queue_manager import QueueManager
+
+PLAYERS = 1000
+TIERS = ['', '1', '2', '3']
+TICK = 0.001
+
+# Clients that record when each change reached them
+TIMED_CLIENTS = 10
+
+def percentiles(values) -> str:
+    values = sorted(values)
+    if not values:
+        return 'no samples'
+    def at(p):
+        return values[min(len(values) - 1, int(len(values) * p))] * 1e6
+    return f"p50 {at(0.5):8.1f}us  p99 {at(0.99):8.1f}us  max {at(1):8.1f}us"
+
+# Make one random change to the queue, keeping it at around PLAYERS players
+def change(queue: GameQueue, rng: random.Random):
+    r = rng.random()
+    if len(queue) < PLAYERS and r < 0.5:
+        number = rng.randrange(1_000_000)
+        queue.push(f"viewer{number}", rng.choice(TIERS), f"id{number}")
+    elif r < 0.6:
+        queue.pop()
+    elif r < 0.8 and len(queue) > 0:
+        name, _ = queue.slice(rng.randrange(len(queue)), 1)[0]
+        queue.remove(name)
+    elif r < 0.95 and len(queue) > 1:
+        name, _ = queue.slice(rng.randrange(len(queue)), 1)[0]
+        queue.promote(name, rng.randint(1, len(queue)))
+    elif len(queue) > 0:
+        # Renames happen when a player who changed their name uses a command
+        name, _ = queue.slice(rng.randrange(len(queue)), 1)[0]
+        number = name[len('viewer'):].split('_')[0]
+        queue.push(f"viewer{number}_{rng.randrange(100)}", '', f"id{number}")
+
+# Make rate changes a second for duration seconds, timing each one and the event loop's lag.
+# Returns the times, the lags, and the time each version was made at
+async def write(queue: GameQueue, duration: float, rate: int):
+    rng = random.Random(1)
+    times, lags = [], []
+    made_at = {}
+    start = time.perf_counter()
+    made = 0
+    due = start
+    while due - start < duration:
+        due += TICK
+        await asyncio.sleep(max(0, due - time.perf_counter()))
+        lags.append(max(0, time.perf_counter() - due))
+        while made < (time.perf_counter() - start) * rate:
+            before = time.perf_counter()
+            change(queue, rng)
+            now = time.perf_counter()
+            times.append(now - before)
+            made_at[queue.version] = now
+            made += 1
+    return times, lags, made_at
+
+# --------------- Clients ---------------
+
+class Client():
+    def __init__(self, slow: bool, timed: bool):
+        self.slow = slow
+        self.timed = timed
+        self.stream = bytearray()
+        self.chunks = [] # (end of the chunk in the stream, time received) if timed
+        self.players = []
+        self.last = 0
+        self.snapshots = 0
+
+    # Read the feed until the final version has been received, not reading until reading is set
+    # if the client is slow. The stream is only parsed at the end, so the clients cost as little
+    # as possible next to the server
+    async def follow(self, port: int, reading, final):
+        sock = socket.socket()
+        if self.slow:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+        writer.write(b'GET /queues/bench/events HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        while (await reader.readline()).strip():
+            pass # response headers
+
+        while not self.caught_up(final.value):
+            while self.slow and not reading.is_set():
+                await asyncio.sleep(0.01)
+            chunk = await reader.read(1 << 16)
+            if not chunk:
+                break
+            self.stream += chunk
+            if self.timed:
+                self.chunks.append((len(self.stream), time.perf_counter()))
+        writer.close()
+
+    def caught_up(self, final: int) -> bool:
+        if final == 0 or not self.stream.endswith(b'\n\n'):
+            return False
+        i = self.stream.rfind(b'id: ')
+        return i >= 0 and int(self.stream[i + 4:self.stream.index(b'\n', i)].split(b':')[1]) >= final
+
+    # Apply every event in the stream, returning (version, time received) for each delta if timed
+    def parse(self) -> list:
+        received = []
+        chunk = 0
+        offset = 0
+        for frame in bytes(self.stream).split(b'\n\n'):
+            offset += len(frame) + 2
+            event, seq, data = None, None, None
+            for line in frame.decode('utf-8').split('\n'):
+                if line.startswith('event: '):
+                    event = line[len('event: '):]
+                elif line.startswith('id: '):
+                    seq = int(line[len('id: '):].split(':')[1])
+                elif line.startswith('data: '):
+                    data = json.loads(line[len('data: '):])
+            if data is None:
+                continue
+            self.apply(event, seq, data)
+            if self.timed and event is None:
+                while self.chunks[chunk][0] < offset - 2:
+                    chunk += 1
+                received.append((seq, self.chunks[chunk][1]))
+        return received
+
+    def apply(self, event, seq: int, data):
+        if event == 'snapshot':
+            self.players = [list(player) for player in data]
+            self.snapshots += 1
+        elif seq != self.last + 1:
+            raise AssertionError(f"expected change {self.last + 1}, got {seq}")
+        elif data[0] == 'push':
+            self.players.insert(data[1], [data[2], data[3]])
+        elif data[0] == 'pop':
+            del self.players[0]
+        elif data[0] == 'remove':
+            del self.players[data[1]]
+        elif data[0] == 'promote':
+            self.players.insert(data[2], self.players.pop(data[1]))
+        elif data[0] == 'rename':
+            self.players[data[1]][0] = data[2]
+        elif data[0] == 'clear':
+            self.players.clear()
+        self.last = seq
+
+async def follow_all(port: int, count: int, slow: int, reading, final, results):
+    clients = [Client(i < slow, slow <= i < slow + TIMED_CLIENTS) for i in range(count)]
+    await asyncio.gather(*(client.follow(port, reading, final) for client in clients))
+    summaries = []
+    for client in clients:
+        received = client.parse()
+        summaries.append((client.slow, client.players, client.last, client.snapshots, received))
+    results.put(summaries)
+
+def run_clients(port: int, count: int, slow: int, reading, final, results):
+    asyncio.run(follow_all(port, count, slow, reading, final, results))
+
+# --------------- Server ---------------
+
+def make_queue() -> QueueManager:
+    queues = QueueManager(threadsafe=False)
+    queue = queues.add('bench', twitch_channel='bench', priority=True)
+    rng = random.Random(0)
+    for _ in range(PLAYERS):
+        change(queue, rng)
+    return queues
+
+async def main(args) -> bool:
+    baseline, baseline_lags, _ = await write(make_queue().get('bench'), args.duration, args.rate)
+
+    queues = make_queue()
+    queue = queues.get('bench')
+    server = FeedServer(queues, args.history)
+    serving = asyncio.ensure_future(server.serve('127.0.0.1', args.port))
+    await asyncio.sleep(0.2)
+
+    reading = multiprocessing.Event()
+    final = multiprocessing.Value('q', 0)
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_clients,
+            args=(args.port, args.clients, args.slow, reading, final, results))
+    process.start()
+    while server.clients < args.clients:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.2)
+
+    times, lags, made_at = await write(queue, args.duration, args.rate)
+
+    # The slow clients start reading again, and everyone follows the feed until one last change
+    final.value = queue.version + 1
+    queue.push('done', '')
+    reading.set()
+    loop = asyncio.get_running_loop()
+    clients = await loop.run_in_executor(None, results.get)
+    process.join()
+    serving.cancel()
+
+    expected = [list(player) for player in queue.slice(0, len(queue))]
+    correct = sum(players == expected and last == queue.version for _, players, last, _, _ in clients)
+    fast = [client for client in clients if not client[0]]
+    slow = [client for client in clients if client[0]]
+    latencies = [at - made_at[seq] for client in fast for seq, at in client[4] if seq in made_at]
+
+    print(f"{args.clients} clients ({args.slow} not reading until the end) following a queue of "
+            f"{PLAYERS} players, {args.rate} changes a second for {args.duration:.0f}s")
+    print(f"\n  changes without feed: {len(baseline) / args.duration:6.0f}/s  {percentiles(baseline)}")
+    print(f"  changes with feed:    {len(times) / args.duration:6.0f}/s  {percentiles(times)}")
+    print(f"  loop lag without feed:         {percentiles(baseline_lags)}")
+    print(f"  loop lag with feed:            {percentiles(lags)}")
+    print(f"  delivery to clients keeping up: {percentiles(latencies)}")
+    print(f"  snapshots: {sum(c[3] for c in fast) / max(1, len(fast)):.1f} per client keeping up, "
+            f"{sum(c[3] for c in slow) / max(1, len(slow)):.1f} per slow client")
+    print(f"  clients with the right queue: {correct}/{args.clients}")
+    return correct == args.clients
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Follow the change feed with many clients')
+    parser.add_argument('--clients', type=int, default=300, help='clients following the feed')
+    parser.add_argument('--slow', type=int, default=20, help='clients that stop reading until the end')
+    parser.add_argument('--rate', type=int, default=1000, help='changes made a second')
+    parser.add_argument('--duration', type=float, default=3, help='seconds the writer runs for')
+    parser.add_argument('--history', type=int, default=1024, help='changes kept for clients that fall behind')
+    parser.add_argument('--port', type=int, default=9299, help='port to serve the feed on')
+    args = parser.parse_args()
+
+    if not asyncio.run(main(args)):
+        print('\nFAILED')
+        sys.exit(1)
@@ -0,0 +1,84 @@
+# Benchmark flooding a queue with 100k join and position commands from a raid, with and without
+# the queue's flood limits, to show memory use and command latency as the flood goes on
+# Run from the repository root with: python -m benchmarks.join_flood
+from functools import cached_property
+import random
+import time
+import tracemalloc
+
+from command_registry import Caller
+from game_queue import GameQueue
+from queue_commands import registry
+
+MESSAGES = 100_000
+RAIDERS = 50_000
+CHUNK = 10_000
+
+SETTINGS = {'can_join': True}
+
+class FloodCaller(Caller):
+    platform = 'benchmark'
+
+    def __init__(self, queue, name):
+        Caller.__init__(self, queue, SETTINGS)
+        self._name = name
+        self.replies = 0
+
+    @cached_property
+    def name(self) -> str:
+        return self._name
+
+    @cached_property
+    def is_admin(self) -> bool:
+        return False
+
+    @cached_property
+    def is_supporter(self) -> bool:
+        return False
+
+    def reply(self, message: str):
+        self.replies += 1
+
+def flood():
+    rng = random.Random(0)
+    # Every raider spams, and a few spam a lot
+    return [(f"raider{int(rng.paretovariate(1.2)) % RAIDERS if rng.random() < 0.3 else rng.randrange(RAIDERS)}",
+            'join' if rng.random() < 0.7 else 'pos') for _ in range(MESSAGES)]
+
+# Run the flood, returning (queue length, memory in KB, mean and p99 latency in microseconds)
+# after each chunk of messages
+def run(make_queue, messages, measure_memory):
+    queue = make_queue()
+    results = []
+    if measure_memory:
+        tracemalloc.start()
+
+    for start in range(0, len(messages), CHUNK):
+        latencies = []
+        for name, command in messages[start:start + CHUNK]:
+            begin = time.perf_counter()
+            registry.dispatch(command, FloodCaller(queue, name), [])
+            latencies.append(time.perf_counter() - begin)
+
+        latencies.sort()
+        memory = tracemalloc.get_traced_memory()[0] / 1024 if measure_memory else 0
+        results.append((len(queue), memory, sum(latencies) / len(latencies) * 1e6,
+                latencies[int(len(latencies) * 0.99)] * 1e6))
+
+    if measure_memory:
+        tracemalloc.stop()
+    return results
+
+if __name__ == '__main__':
+    messages = flood()
+    configs = (('no limits', lambda: GameQueue(False)),
+            ('max 500, 60s cooldown', lambda: GameQueue(False, max_length=500, join_cooldown=60)))
+
+    for name, make_queue in configs:
+        memory = run(make_queue, messages, True)
+        latency = run(make_queue, messages, False)
+
+        print(f"\n{name}")
+        print(f"{'messages':>10}{'queue':>10}{'memory KB':>12}{'mean us':>10}{'p99 us':>10}")
+        for i, ((length, kb, _, _), (_, _, mean, p99)) in enumerate(zip(memory, latency)):
+            print(f"{(i + 1) * CHUNK:>10}{length:>10}{kb:>12.0f}{mean:>10.2f}{p99:>10.2f}")
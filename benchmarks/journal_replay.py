@@ -0,0 +1,50 @@
+# Benchmark for recovering the GameQueue from its journal
+# Run from the repository root with: python -m benchmarks.journal_replay
+import random
+import shutil
+import tempfile
+import time
+
+from game_queue import GameQueue
+from journal import Journal
+
+OPERATIONS = 1_000_000
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp()
+    try:
+        # Generate a journal of random queue operations. Compaction is disabled so that
+        # recovery has to replay every record
+        journal = Journal(directory, compact_every=OPERATIONS * 2)
+        queue = GameQueue(False, journal)
+        journal.start()
+
+        rng = random.Random(0)
+        for i in range(OPERATIONS):
+            r = rng.random()
+            name = f"player{rng.randrange(5000)}"
+            if r < 0.5:
+                queue.push(name, str(rng.randint(0, 3)))
+            elif r < 0.7:
+                queue.pop()
+            elif r < 0.85:
+                queue.remove(name)
+            elif r < 0.999:
+                queue.promote(name, rng.randint(1, max(len(queue), 1)))
+            else:
+                queue.clear()
+        journal.close()
+        expected = queue.listing(full=True)
+
+        start = time.perf_counter()
+        journal = Journal(directory)
+        replayed = time.perf_counter()
+        restored = GameQueue(False, journal)
+        end = time.perf_counter()
+
+        assert restored.listing(full=True) == expected, 'Recovered queue does not match'
+        print(f"Replayed {OPERATIONS} operations in {replayed - start:.3f}s")
+        print(f"Rebuilt queue of {len(restored)} players in {end - replayed:.3f}s")
+        print(f"Total recovery time {end - start:.3f}s")
+    finally:
+        shutil.rmtree(directory)
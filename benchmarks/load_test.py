@@ -0,0 +1,275 @@
+# Load test replaying chat traffic against both bots on one event loop: the Twitch bot connected to
+# a local fake IRC server, and the Discord bot's commands driven with fake contexts. Reports the
+# command throughput, reply latency, and whether each queue ended up where a simple list model of
+# the same traffic says it should. Exits with status 1 if anything was wrong.
+# Run from the repository root with: python -m benchmarks.load_test [options]
+#
+# Traffic is randomized unless --script is given, with one message per line as
+# "<twitch|discord> <user> <text>". Messages from the user "mod" are sent as an admin.
+# With --queue-server, the queues are held by a queue server in another process, as when the bots
+# run as workers.
+from collections import defaultdict, deque
+import argparse
+import asyncio
+import multiprocessing
+import random
+import sys
+import time
+
+from benchmarks.fake_discord import FakeChannel, FakeContext, FakeGuild, FakeMember, FakeRole
+from benchmarks.fake_irc import FakeTwitchServer
+from queue_manager import QueueManager
+from queue_server import QueueClient, QueueServer, RemoteQueueManager
+from twitch_bot import TwitchBot
+
+ADMIN = 'mod'
+ADMIN_REPLIES = ('Up next: ', 'The queue is empty')
+
+# Share of each kind of message in randomized traffic. Chat isn't a command, so gets no reply
+MIX = (('chat', 0.35), ('!join', 0.3), ('!pos', 0.2), ('!leave', 0.1), ('!next', 0.05))
+
+def generate(platform: str, viewers: int, count: int, rng: random.Random) -> list:
+    kinds = [kind for kind, _ in MIX]
+    weights = [weight for _, weight in MIX]
+    prefix = 'viewer' if platform == 'twitch' else 'member'
+
+    messages = []
+    for kind in rng.choices(kinds, weights, k=count):
+        if kind == '!next':
+            messages.append((ADMIN, kind))
+        elif kind == 'chat':
+            # Discord never sees chat without the command prefix
+            if platform == 'twitch':
+                messages.append((f"{prefix}{rng.randrange(viewers)}", 'hello chat, great game'))
+        else:
+            messages.append((f"{prefix}{rng.randrange(viewers)}", kind))
+    return messages
+
+def load_script(path: str) -> dict:
+    traffic = {'twitch': [], 'discord': []}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                platform, user, text = line.split(' ', 2)
+                traffic[platform].append((user, text))
+    return traffic
+
+# The queue the bot should end up with, as a plain list
+class Model():
+    def __init__(self):
+        self.players = []
+
+    def apply(self, user: str, text: str):
+        if text[:1] != '!':
+            return
+        command = text.split()[0][1:].lower()
+        if command == 'join' and user not in self.players:
+            self.players.append(user)
+        elif command == 'leave' and user in self.players:
+            self.players.remove(user)
+        elif command == 'next' and user == ADMIN and self.players:
+            self.players.pop(0)
+
+# Commands waiting for their reply, matched to replies by who the reply is addressed to
+class Pending():
+    def __init__(self):
+        self.sent = defaultdict(deque) # reply key -> times commands were sent
+        self.expected = 0
+        self.latencies = []
+        self.unmatched = 0
+
+    def command_sent(self, key: str):
+        self.sent[key].append(time.perf_counter())
+        self.expected += 1
+
+    def reply_received(self, received: float, text: str):
+        key = ADMIN if text.startswith(ADMIN_REPLIES) else text.split(' ', 1)[0]
+        if self.sent[key]:
+            self.latencies.append(received - self.sent[key].popleft())
+        else:
+            self.unmatched += 1
+
+    # Wait until replies() returns as many replies as there were commands, or the timeout passes
+    async def wait(self, replies, timeout: float):
+        deadline = time.perf_counter() + timeout
+        while len(replies()) < self.expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+
+# Send messages at a steady rate, calling send for each one
+async def paced(messages: list, rate: float, send):
+    start = time.perf_counter()
+    for i, (user, text) in enumerate(messages):
+        send(user, text)
+        delay = start + (i + 1) / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif i % 100 == 0:
+            await asyncio.sleep(0) # let the bots catch up even when we're behind
+
+# --------------- Twitch ---------------
+
+async def run_twitch(queues, messages, rate, model, pending):
+    server = FakeTwitchServer()
+    await server.start()
+    bot = TwitchBot(queues, server.bot_settings('loadtwitch'))
+    task = asyncio.ensure_future(bot.run())
+    await server.joined.wait()
+    first_reply = len(server.received)
+
+    def send(user, text):
+        model.apply(user, text)
+        if text[:1] == '!':
+            pending.command_sent(ADMIN if user == ADMIN else '@' + user)
+        server.say('loadtwitch', user, text, 'moderator/1' if user == ADMIN else '')
+
+    start = time.perf_counter()
+    await paced(messages, rate, send)
+    sent_time = time.perf_counter() - start
+    await pending.wait(lambda: server.received[first_reply:], 10)
+
+    for received, _, text in server.received[first_reply:]:
+        pending.reply_received(received, text)
+
+    bot.close()
+    await task
+    await server.stop()
+    return sent_time
+
+# --------------- Discord ---------------
+
+async def run_discord(queues, messages, rate, model, pending):
+    import discord_bot
+
+    discord_bot.setup(queues, {'token': '', 'admin_roles': {'Admin'}, 'supporter_roles': {'Admin'},
+            'tier_map': {}, 'join_channels': [], 'can_join': True})
+
+    guild = FakeGuild(1)
+    channel = FakeChannel(1, 'queue')
+    admin_role = FakeRole(1, 'Admin')
+    members = {}
+    tasks = []
+
+    def member(user):
+        if user not in members:
+            roles = [admin_role] if user == ADMIN else []
+            members[user] = FakeMember(len(members) + 1, user, roles, guild)
+        return members[user]
+
+    def send(user, text):
+        model.apply(user, text)
+        author = member(user)
+        pending.command_sent(ADMIN if user == ADMIN else author.mention)
+
+        # Like discord.py, each command runs in its own task
+        name, *words = text[1:].split()
+        ctx = FakeContext(channel, author, text, guild, discord_bot.bot)
+        tasks.append(asyncio.ensure_future(discord_bot.bot.get_command(name).callback(ctx, *words)))
+
+    start = time.perf_counter()
+    await paced(messages, rate, send)
+    sent_time = time.perf_counter() - start
+    await asyncio.gather(*tasks)
+    await discord_bot.batcher.flush()
+    await pending.wait(lambda: channel.received, 10)
+
+    for received, text in channel.received:
+        pending.reply_received(received, text)
+    print(f"  discord api calls: {channel.api_calls}")
+    return sent_time
+
+# --------------- Report ---------------
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+# Print the results for one platform, returning whether they were correct
+def report(platform, queue, model, pending, sent_time) -> bool:
+    expected = ', '.join(model.players)
+    actual = queue.listing(full=True)
+    correct = actual == expected and len(pending.latencies) == pending.expected and pending.unmatched == 0
+
+    print(f"\n{platform}")
+    print(f"  commands: {pending.expected} sent in {sent_time:.2f}s ({pending.expected / sent_time:.0f}/s)")
+    print(f"  replies: {len(pending.latencies)}/{pending.expected}, {pending.unmatched} unexpected")
+    print(f"  reply latency: p50 {percentile(pending.latencies, 0.5):.2f}ms "
+            f"p99 {percentile(pending.latencies, 0.99):.2f}ms max {percentile(pending.latencies, 1):.2f}ms")
+    print(f"  final queue: {len(queue)} players, {'matches' if actual == expected else 'DOES NOT MATCH'} the model")
+    return correct
+
+# Each platform gets its own queue, so the order commands reach each queue is known
+def add_queues(queues: QueueManager):
+    queues.add('twitch', twitch_channel='loadtwitch')
+    queues.add('discord', discord_default=True)
+
+def serve_queues(port: int, ready):
+    queues = QueueManager(threadsafe=False)
+    add_queues(queues)
+    async def serve():
+        serving = asyncio.ensure_future(QueueServer(queues).serve('127.0.0.1', port))
+        await asyncio.sleep(0.2)
+        ready.set()
+        await serving
+    asyncio.run(serve())
+
+async def main(args):
+    rng = random.Random(args.seed)
+    if args.script:
+        traffic = load_script(args.script)
+    else:
+        traffic = {'twitch': generate('twitch', args.viewers, int(args.twitch_rate * args.duration), rng),
+                'discord': generate('discord', args.viewers, int(args.discord_rate * args.duration), rng)}
+
+    try:
+        import discord_bot
+    except ImportError:
+        print('discord.py is not installed, so only the Twitch bot is tested')
+        traffic['discord'] = []
+
+    server = None
+    if args.queue_server is not None:
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=serve_queues, args=(args.queue_server, ready), daemon=True)
+        server.start()
+        await asyncio.get_running_loop().run_in_executor(None, ready.wait)
+        queues = RemoteQueueManager(QueueClient('127.0.0.1', args.queue_server))
+    else:
+        queues = QueueManager(threadsafe=False)
+    add_queues(queues)
+    twitch_queue = queues.get('twitch')
+    discord_queue = queues.get('discord')
+    models = {'twitch': Model(), 'discord': Model()}
+    pendings = {'twitch': Pending(), 'discord': Pending()}
+
+    runs = [run_twitch(queues, traffic['twitch'], args.twitch_rate, models['twitch'], pendings['twitch'])]
+    if traffic['discord']:
+        runs.append(run_discord(queues, traffic['discord'], args.discord_rate, models['discord'], pendings['discord']))
+    times = await asyncio.gather(*runs)
+
+    correct = report('twitch', twitch_queue, models['twitch'], pendings['twitch'], times[0])
+    if traffic['discord']:
+        correct &= report('discord', discord_queue, models['discord'], pendings['discord'], times[1])
+
+    if server is not None:
+        queues.close()
+        server.terminate()
+    return correct
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the bots with simulated chat traffic')
+    parser.add_argument('--viewers', type=int, default=5000, help='number of distinct users on each platform')
+    parser.add_argument('--twitch-rate', type=float, default=500, help='Twitch chat messages per second')
+    parser.add_argument('--discord-rate', type=float, default=100, help='Discord commands per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of randomized traffic')
+    parser.add_argument('--seed', type=int, default=0, help='seed for randomized traffic')
+    parser.add_argument('--script', help='file of scripted traffic to replay instead')
+    parser.add_argument('--queue-server', type=int, metavar='PORT',
+            help='hold the queues in a queue server on this port, with the bots as its workers')
+    args = parser.parse_args()
+
+    if not asyncio.run(main(args)):
+        print('\nFAILED')
+        sys.exit(1)
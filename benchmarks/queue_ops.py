@@ -0,0 +1,98 @@
+# Benchmark comparing the indexed GameQueue against the original list based queue, along with
+# the indexed queue in tier priority mode
+# Run from the repository root with: python -m benchmarks.queue_ops
+from threading import Lock
+import random
+import time
+
+from game_queue import GameQueue
+
+# The list based queue that GameQueue used to be, kept here for comparison
+class ListGameQueue():
+    def __init__(self):
+        self.queue = []
+        self.lock = Lock()
+
+    def user_pos(self, user):
+        with self.lock:
+            for i, (name, _) in enumerate(self.queue):
+                if name == user:
+                    return i
+            return -1
+
+    def push(self, name, tier):
+        with self.lock:
+            if name in self.queue:
+                return -1
+            self.queue.append((name, tier))
+            return len(self.queue)
+
+    def pop(self):
+        with self.lock:
+            if len(self.queue) == 0:
+                return (None, None)
+            return self.queue.pop(0)
+
+    def remove(self, name):
+        with self.lock:
+            for i, (n, _) in enumerate(self.queue):
+                if n == name:
+                    self.queue.pop(i)
+                    return True
+            return False
+
+    def promote(self, name, pos=1):
+        with self.lock:
+            if pos > len(self.queue):
+                return False
+            for i, user in enumerate(self.queue):
+                if user[0] == name:
+                    self.queue.pop(i)
+                    self.queue.insert(pos - 1, user)
+                    return True
+            return False
+
+def timed(fn, count):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) / count * 1e6
+
+def run(queue, size, ops):
+    rng = random.Random(0)
+    names = [f"player{i}" for i in range(size)]
+    tiers = {name: rng.choice(('', '', '1', '2', '3')) for name in names}
+    for name in names:
+        queue.push(name, tiers[name])
+
+    targets = [rng.choice(names) for _ in range(ops)]
+    positions = [rng.randint(1, size) for _ in range(ops)]
+
+    results = {}
+    results['push (dup)'] = timed(lambda: [queue.push(n, '') for n in targets], ops)
+    results['user_pos'] = timed(lambda: [queue.user_pos(n) for n in targets], ops)
+    results['promote'] = timed(lambda: [queue.promote(n, p) for n, p in zip(targets, positions)], ops)
+
+    def remove_and_rejoin():
+        for n in targets:
+            queue.remove(n)
+            queue.push(n, tiers[n])
+    results['remove+push'] = timed(remove_and_rejoin, ops * 2)
+
+    def pop_and_rejoin():
+        for _ in range(ops):
+            name, tier = queue.pop()
+            queue.push(name, tier)
+    results['pop+push'] = timed(pop_and_rejoin, ops * 2)
+    return results
+
+if __name__ == '__main__':
+    for size in (10_000, 100_000):
+        ops = 200 if size > 10_000 else 1000
+        old = run(ListGameQueue(), size, ops)
+        new = run(GameQueue(False), size, ops)
+        tiered = run(GameQueue(False, priority=True, aging=600), size, ops)
+
+        print(f"\n{size} entries ({ops} ops each), microseconds per op")
+        print(f"{'operation':<14}{'list':>12}{'indexed':>12}{'speedup':>10}{'priority':>12}")
+        for op in old:
+            print(f"{op:<14}{old[op]:>12.2f}{new[op]:>12.2f}{old[op] / new[op]:>9.1f}x{tiered[op]:>12.2f}")
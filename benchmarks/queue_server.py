@@ -0,0 +1,132 @@
+# Benchmark of the queue server. Runs the same mix of queue operations on a GameQueue in this
+# process, then through a RemoteQueue on a queue server in another process over loopback, one call
+# at a time, and then from several threads that each pipeline batches of calls. Checks that the
+# remote queue ends up the same as the local one, and that the threads' calls all succeed.
+# Exits with status 1 if they don't.
+# Run from the repository root with: python -m benchmarks.queue_server [options]
+import argparse
+import asyncio
+import multiprocessing
+import random
+import sys
+import threading
+import time
+
+from queue_manager import QueueManager
+from queue_server import QueueClient, QueueServer, RemoteQueue
+
+TIERS = ['', '1', '2', '3']
+
+def percentiles(values) -> str:
+    values = sorted(values)
+    def at(p):
+        return values[min(len(values) - 1, int(len(values) * p))] * 1e6
+    return f"p50 {at(0.5):8.1f}us  p99 {at(0.99):8.1f}us  max {at(1):8.1f}us"
+
+# The operations of a run of chat commands: mostly players checking their position, joining and
+# leaving, with the odd player taken off the queue
+def operations(count: int, players: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    ops = []
+    for _ in range(count):
+        r = rng.random()
+        name = f"viewer{rng.randrange(players)}"
+        if r < 0.4:
+            ops.append(('user_pos', name))
+        elif r < 0.7:
+            ops.append(('push', name, rng.choice(TIERS)))
+        elif r < 0.9:
+            ops.append(('remove', name))
+        elif r < 0.95:
+            ops.append(('pop',))
+        else:
+            ops.append(('page', 1))
+    return ops
+
+def run(queue, ops: list) -> list:
+    times = []
+    for method, *args in ops:
+        before = time.perf_counter()
+        getattr(queue, method)(*args)
+        times.append(time.perf_counter() - before)
+    return times
+
+def serve(port: int, ready):
+    queues = QueueManager(threadsafe=False)
+    queues.add('bench', priority=True)
+    async def main():
+        serving = asyncio.ensure_future(QueueServer(queues).serve('127.0.0.1', port))
+        await asyncio.sleep(0.2)
+        ready.set()
+        await serving
+    asyncio.run(main())
+
+# Each thread joins its own players and then removes them, sending batch calls at a time before
+# waiting for their responses. Returns whether every call did what it should
+def pipelined(client: QueueClient, thread: int, players: int, batch: int) -> bool:
+    ok = True
+    names = [f"thread{thread}_{i}" for i in range(players)]
+    for method in ('push', 'user_pos', 'remove'):
+        for start in range(0, players, batch):
+            futures = [client.submit('bench', method, name, '') if method == 'push'
+                    else client.submit('bench', method, name) for name in names[start:start + batch]]
+            for future in futures:
+                result = future.result()
+                ok = ok and (result is True if method == 'remove' else result >= 1)
+    return ok
+
+def main(args) -> bool:
+    ops = operations(args.ops, args.players)
+
+    local = QueueManager(threadsafe=False).add('bench', priority=True)
+    local_times = run(local, ops)
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(args.port, ready), daemon=True)
+    server.start()
+    ready.wait()
+
+    client = QueueClient('127.0.0.1', args.port, args.connections)
+    remote = RemoteQueue(client, 'bench')
+    remote_times = run(remote, ops)
+    same = remote.slice(0, len(remote)) == local.slice(0, len(local))
+
+    results = [None] * args.threads
+    def work(i):
+        results[i] = pipelined(client, i, args.thread_players, args.batch)
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    calls = args.threads * args.thread_players * 3
+    same = same and len(remote) == len(local)
+
+    client.close()
+    server.terminate()
+
+    print(f"{args.ops} operations on a queue of up to {args.players} players")
+    print(f"\n  in process:           {len(local_times) / sum(local_times):8.0f}/s  {percentiles(local_times)}")
+    print(f"  queue server:         {len(remote_times) / sum(remote_times):8.0f}/s  {percentiles(remote_times)}")
+    print(f"  queue server, {args.threads} threads pipelining {args.batch} calls over {args.connections} connections: "
+            f"{calls / elapsed:8.0f}/s")
+    print(f"\n  remote queue matches the local one: {same}")
+    print(f"  pipelined calls all succeeded: {all(results)}")
+    return same and all(results)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare queue operations in process and through a queue server')
+    parser.add_argument('--ops', type=int, default=20000, help='operations run one at a time')
+    parser.add_argument('--players', type=int, default=2000, help='different players in those operations')
+    parser.add_argument('--threads', type=int, default=4, help='threads pipelining calls')
+    parser.add_argument('--thread-players', type=int, default=5000, help='players each thread joins and removes')
+    parser.add_argument('--batch', type=int, default=100, help='calls each thread sends before waiting')
+    parser.add_argument('--connections', type=int, default=2, help='connections to the queue server')
+    parser.add_argument('--port', type=int, default=9300, help='port to serve the queues on')
+    args = parser.parse_args()
+
+    if not main(args):
+        print('\nFAILED')
+        sys.exit(1)
@@ -0,0 +1,148 @@
+# Benchmark of recovering from a lost connection. The Twitch bot is connected to a local fake IRC
+# server that is killed while replies are still waiting to be sent, then brought back. The Discord
+# reply batcher sends to a fake channel that fails every send for a while. Each part checks that
+# every reply is delivered after recovering, and reports how long recovery took.
+# Exits with status 1 if any reply went missing.
+# Run from the repository root with: python -m benchmarks.reconnect [options]
+import argparse
+import asyncio
+import re
+import sys
+import time
+
+from backoff import Backoff
+from benchmarks.fake_discord import FakeChannel
+from benchmarks.fake_irc import FakeTwitchServer
+from queue_manager import QueueManager
+from reply_batcher import ReplyBatcher
+from twitch_bot import TwitchBot
+
+MENTION = re.compile(r'@(\w+)')
+
+# Wait until done() is true or the timeout passes
+async def wait_until(done, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while not done() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+# --------------- Twitch ---------------
+
+async def run_twitch(args) -> bool:
+    server = FakeTwitchServer()
+    await server.start()
+    settings = server.bot_settings('reconnect')
+    settings['message_rate'] = [args.twitch_rate, 1]
+
+    queues = QueueManager(threadsafe=False)
+    queues.add('reconnect', twitch_channel='reconnect')
+    bot = TwitchBot(queues, settings)
+    bot.backoff = Backoff(0.05, 1.0)
+    downtimes = []
+    on_reconnected = bot.on_reconnected
+    def reconnected(downtime):
+        downtimes.append(downtime)
+        on_reconnected(downtime)
+    bot.on_reconnected = reconnected
+
+    task = asyncio.ensure_future(bot.run())
+    await server.joined.wait()
+
+    # Every command's reply mentions the user who sent it once
+    users = [f"viewer{i}" for i in range(args.commands // 4)]
+    expected = 0
+    for user in users:
+        server.say('reconnect', user, '!join')
+        expected += 1
+    for i in range(args.commands - len(users)):
+        server.say('reconnect', users[i % len(users)], '!pos')
+        expected += 1
+
+    def mentions():
+        return sum(len(MENTION.findall(text)) for _, _, text in server.received)
+
+    # Kill the server while most of the replies are still waiting for the rate limit
+    await asyncio.sleep(0.5)
+    before = mentions()
+    waiting = bot.scheduler.depth()
+    await server.kill()
+    killed = time.perf_counter()
+    await asyncio.sleep(args.down)
+    await server.start()
+    await server.joined.wait()
+    rejoined = time.perf_counter() - killed
+
+    await wait_until(lambda: mentions() >= expected, args.commands / args.twitch_rate + 10)
+    delivered = time.perf_counter() - killed
+
+    bot.close()
+    await task
+    await server.stop()
+
+    received = mentions()
+    print('\ntwitch')
+    print(f"  {expected} replies, {expected - before} still waiting in {waiting} messages when the server was killed")
+    print(f"  server down for {args.down:.2f}s, rejoined {rejoined:.2f}s after being killed "
+            f"(bot saw {downtimes[0] if downtimes else float('nan'):.2f}s of downtime)")
+    print(f"  all waiting replies sent {delivered:.2f}s after being killed")
+    print(f"  replies: {received}/{expected} delivered, {bot.scheduler.dropped} dropped")
+    return received == expected
+
+# --------------- Discord ---------------
+
+async def run_discord(args) -> bool:
+    channel = FakeChannel(1, api_delay=0.001)
+    batcher = ReplyBatcher(window=0.05, flush_interval=0.01)
+    batcher.backoff = Backoff(0.05, 0.5)
+
+    async def send_replies(start, count):
+        for i in range(start, start + count):
+            if i % 10 == 0:
+                await batcher.send_now(channel, f"reply {i}")
+            else:
+                await batcher.send(channel, f"reply {i}")
+            await asyncio.sleep(0.001)
+
+    half = args.commands // 2
+    await send_replies(0, half)
+    await batcher.flush()
+
+    # Every send fails while the rest of the replies are made
+    channel.error = ConnectionResetError('Connection reset by peer')
+    failed = time.perf_counter()
+    outage = asyncio.ensure_future(send_replies(half, args.commands - half))
+    await asyncio.sleep(args.down)
+    channel.error = None
+    restored = time.perf_counter()
+    await outage
+    await batcher.flush()
+    await wait_until(lambda: batcher.depth() == 0, 30)
+    delivered = time.perf_counter()
+
+    lines = [line for _, line in channel.received]
+    # Replies sent straight away overtake batched ones, so each kind is checked for order on its own
+    numbers = [int(line.split()[1]) for line in lines]
+    direct = [n for n in numbers if n % 10 == 0]
+    batched = [n for n in numbers if n % 10 != 0]
+    in_order = direct == sorted(direct) and batched == sorted(batched)
+    print('\ndiscord')
+    print(f"  sends failed for {restored - failed:.2f}s")
+    print(f"  all waiting replies sent {delivered - restored:.2f}s after sends worked again")
+    print(f"  replies: {len(lines)}/{args.commands} delivered {'in order' if in_order else 'OUT OF ORDER'}, "
+            f"{batcher.dropped} dropped, {channel.api_calls} API calls")
+    return len(lines) == args.commands and in_order
+
+async def main(args):
+    correct = await run_twitch(args)
+    correct &= await run_discord(args)
+    return correct
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check replies survive losing the connection')
+    parser.add_argument('--commands', type=int, default=400, help='commands sent on each platform')
+    parser.add_argument('--down', type=float, default=2, help='seconds the connection is down for')
+    parser.add_argument('--twitch-rate', type=int, default=20, help='Twitch messages allowed per second')
+    args = parser.parse_args()
+
+    if not asyncio.run(main(args)):
+        print('\nFAILED')
+        sys.exit(1)
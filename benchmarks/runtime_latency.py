@@ -0,0 +1,141 @@
+# Benchmark replaying scripted chat against the old runtime (Twitch bot on its own thread, sharing
+# the queue through a lock) and the new one (both bots on one event loop)
+# Run from the repository root with: python -m benchmarks.runtime_latency
+from collections import defaultdict, deque
+import asyncio
+import random
+import statistics
+import threading
+import time
+
+from benchmarks.fake_irc import FakeTwitchServer
+from queue_manager import QueueManager
+from twitch_bot import TwitchBot
+
+CHAT_MESSAGES = 4000
+CHAT_PER_SECOND = 1000
+DISCORD_PER_SECOND = 500
+
+def script(count):
+    rng = random.Random(0)
+    lines = []
+    for i in range(count):
+        user = f"viewer{rng.randrange(count // 2)}"
+        r = rng.random()
+        if r < 0.4:
+            lines.append((user, 'hello chat, great game'))
+        elif r < 0.7:
+            lines.append((user, '!join'))
+        elif r < 0.9:
+            lines.append((user, '!pos'))
+        else:
+            lines.append((user, '!leave'))
+    return lines
+
+# Stand-in for the Discord bot's commands, running on the main event loop. Returns how late each
+# command finished compared to when it was due
+async def discord_load(queue, duration):
+    lags = []
+    interval = 1 / DISCORD_PER_SECOND
+    start = time.perf_counter()
+    i = 0
+    while time.perf_counter() - start < duration:
+        due = start + i * interval
+        name = f"member{i % 2000}"
+        if queue.push(name, '1') == -1:
+            queue.remove(name)
+        queue.user_pos(name)
+        str(queue)
+        lags.append(time.perf_counter() - due)
+
+        i += 1
+        delay = start + i * interval - time.perf_counter()
+        await asyncio.sleep(max(delay, 0))
+    return lags
+
+async def replay(server, queue):
+    sent = defaultdict(deque)
+    first_reply = len(server.received)
+    lines = script(CHAT_MESSAGES)
+
+    discord = asyncio.ensure_future(discord_load(queue, CHAT_MESSAGES / CHAT_PER_SECOND))
+
+    start = time.perf_counter()
+    expected = 0
+    for i, (user, text) in enumerate(lines):
+        if text[0] == '!':
+            sent[user].append(time.perf_counter())
+            expected += 1
+        server.say('ogc', user, text)
+
+        delay = start + (i + 1) / CHAT_PER_SECOND - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    lags = await discord
+    deadline = time.perf_counter() + 10
+    while len(server.received) - first_reply < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+    latencies = []
+    for received, _, text in server.received[first_reply:]:
+        user = text[1:].split(' ', 1)[0]
+        if sent[user]:
+            latencies.append(received - sent[user].popleft())
+    return latencies, lags, expected
+
+async def run_new(server):
+    queues = QueueManager(threadsafe=False)
+    queue = queues.add('ogc', twitch_channel='ogc')
+    bot = TwitchBot(queues, server.bot_settings())
+    task = asyncio.ensure_future(bot.run())
+    await server.joined.wait()
+
+    result = await replay(server, queue)
+    bot.close()
+    await task
+    return result
+
+async def run_old(server):
+    queues = QueueManager()
+    queue = queues.add('ogc', twitch_channel='ogc')
+    ready = threading.Event()
+    state = {}
+
+    def twitch_thread():
+        async def main():
+            state['loop'] = asyncio.get_running_loop()
+            state['bot'] = TwitchBot(queues, server.bot_settings())
+            ready.set()
+            await state['bot'].run()
+        asyncio.run(main())
+
+    thread = threading.Thread(target=twitch_thread)
+    thread.start()
+    ready.wait()
+    await server.joined.wait()
+
+    result = await replay(server, queue)
+    state['loop'].call_soon_threadsafe(state['bot'].close)
+    await asyncio.get_running_loop().run_in_executor(None, thread.join)
+    return result
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+async def main():
+    for name, runtime in (('old (thread + lock)', run_old), ('new (single loop)', run_new)):
+        server = FakeTwitchServer()
+        await server.start()
+        latencies, lags, expected = await runtime(server)
+        await server.stop()
+
+        print(f"\n{name}")
+        print(f"  twitch replies: {len(latencies)}/{expected}, latency p50 {percentile(latencies, 0.5):.2f}ms "
+                f"p99 {percentile(latencies, 0.99):.2f}ms mean {statistics.mean(latencies) * 1000:.2f}ms")
+        print(f"  discord commands: {len(lags)}, lag p50 {percentile(lags, 0.5):.2f}ms "
+                f"p99 {percentile(lags, 0.99):.2f}ms")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+# Benchmark timing how long main.py takes to start: checking the settings alone, and getting the
+# Twitch bot connected to a local IRC server and ready for commands
+# Run from the repository root with: python -m benchmarks.startup
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_irc import FakeTwitchServer
+
+RUNS = 5
+
+# Start main.py and return the seconds until it prints a line containing marker, and the line
+async def time_until(args, marker):
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, 'main.py', '--non-interactive', *args,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    try:
+        while True:
+            line = (await process.stdout.readline()).decode()
+            if not line:
+                raise RuntimeError(f"main.py exited before printing {marker!r}")
+            if marker in line:
+                return time.perf_counter() - start, line.strip()
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+
+async def main():
+    server = FakeTwitchServer()
+    await server.start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings = server.bot_settings()
+        for key in ('admin_badges', 'supporter_badges'):
+            settings[key] = sorted(settings[key])
+        path = os.path.join(directory, 'settings.json')
+        with open(path, 'w') as f:
+            json.dump({'twitch': settings, 'journal_dir': os.path.join(directory, 'state')}, f)
+
+        check = [(await time_until(['--config', path, '--check'], 'Settings loaded'))[0] for _ in range(RUNS)]
+        ready = []
+        for _ in range(RUNS):
+            elapsed, line = await time_until(['--config', path, '--only', 'twitch'], 'ready')
+            ready.append(elapsed)
+
+    await server.stop()
+    print(f"check settings:    median {statistics.median(check) * 1000:.0f}ms over {RUNS} runs")
+    print(f"twitch bot ready:  median {statistics.median(ready) * 1000:.0f}ms over {RUNS} runs")
+    print(f"last run reported: {line}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+# Microbenchmark of Twitch chat message handling up to the point a command is run, comparing eager
+# tag parsing and substring badge checks against lazy parsing with an early exit for non-commands
+# Run from the repository root with: python -m benchmarks.twitch_tags [captured chat log]
+# A captured log has one raw IRC line per line. Without one, a log with typical chat is generated
+import random
+import sys
+import time
+
+from twitch_bot import subscriber_tier
+from twitch_irc import parse_line, parse_tags
+
+ADMIN_BADGES = {'broadcaster', 'moderator'}
+SUPPORTER_BADGES = ADMIN_BADGES | {'subscriber'}
+
+def generate_log(count):
+    rng = random.Random(0)
+    badge_sets = ['', 'subscriber/3012,premium/1', 'moderator/1,subscriber/24', 'vip/1',
+            'sub-gifter/5,subscriber/2006', 'broadcaster/1,subscriber/0', 'glhf-pledge/1']
+    texts = ['PogChamp', 'what a move', 'gg', 'is that a ladder?', 'LUL nice', 'hello everyone',
+            'which opening is this?', 'the corner is dead now']
+    commands = ['!join', '!pos', '!queue', '!leave']
+
+    lines = []
+    for i in range(count):
+        user = f"viewer{rng.randrange(3000)}"
+        text = rng.choice(commands) if rng.random() < 0.05 else rng.choice(texts)
+        tags = f"@badge-info=subscriber/14;badges={rng.choice(badge_sets)};client-nonce=2b5e1a;color=#1E90FF;" \
+                f"display-name={user};emotes=;first-msg=0;flags=;id=7c1b4ad2-{i:08d};mod=0;returning-chatter=0;" \
+                f"room-id=1234;subscriber=1;tmi-sent-ts=1650000000000;turbo=0;user-id={i};user-type="
+        lines.append(f"{tags} :{user}!{user}@{user}.tmi.twitch.tv PRIVMSG #ogc :{text}")
+    return lines
+
+# How messages used to be handled: every message gets its tags turned into a dict, and commands
+# check badges with substring tests
+def old_handle(line):
+    raw_tags, _, rest = line[1:].partition(' ')
+    tag_list = [{'key': key, 'value': value} for key, value in parse_tags(raw_tags).items()]
+    text = rest.split(' :', 1)[1]
+
+    tags = {kvpair['key']: kvpair['value'] for kvpair in tag_list}
+    if 'badges' not in tags or tags['badges'] is None:
+        tags['badges'] = ''
+
+    if text[:1] == '!':
+        badges = tags['badges'].split(',')
+        tier = ''
+        is_admin = False
+        for b in ADMIN_BADGES:
+            if b in tags['badges']:
+                is_admin = True
+                break
+        for b in badges:
+            if 'subscriber' in b:
+                version = b[b.index('/') + 1:]
+                tier = version[0] if len(version) > 3 else '1'
+                break
+        return is_admin, tier, tags['display-name']
+
+ADMIN = frozenset(ADMIN_BADGES)
+SUPPORTER = frozenset(SUPPORTER_BADGES)
+
+# How TwitchBot handles messages now
+def new_handle(line):
+    msg = parse_line(line)
+    if msg.text[:1] != '!':
+        return
+
+    badges = msg.badges
+    is_admin = not ADMIN.isdisjoint(badges)
+    is_supporter = not SUPPORTER.isdisjoint(badges)
+    return is_admin, is_supporter, subscriber_tier(badges), msg.tags.get('display-name')
+
+def time_handler(handler, lines, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            handler(line)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'r', encoding='utf-8') as f:
+            lines = [line.rstrip('\r\n') for line in f if ' PRIVMSG ' in line]
+    else:
+        lines = generate_log(50_000)
+
+    old = time_handler(old_handle, lines)
+    new = time_handler(new_handle, lines)
+    print(f"{len(lines)} chat lines")
+    print(f"eager tags: {old * 1e6 / len(lines):.2f}us per line ({len(lines) / old:,.0f} lines/s)")
+    print(f"lazy tags:  {new * 1e6 / len(lines):.2f}us per line ({len(lines) / new:,.0f} lines/s)")
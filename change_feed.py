@@ -0,0 +1,220 @@
+from typing import Callable, Optional
+import asyncio
+import json
+import os
+
+from metrics import metrics
+
+# Live feed of queue changes, for stream overlays and dashboards.
+#
+# Every change to a queue is numbered with the version it creates, and described as a small delta
+# an overlay can apply to its copy of the queue:
+#   ["push", index, name, tier]    a player joined at a 0-based index
+#   ["pop"]                        the first player was taken off the queue
+#   ["remove", index]              the player at an index left
+#   ["promote", from, to]          a player was moved from one index to another
+#   ["rename", index, name]        the player at an index changed their name
+#   ["clear"]                      the queue was emptied
+#
+# The queue's writers put each delta in a fixed size ring, already encoded, and ask the server to
+# wake up. That's all they do, so they never wait on clients. The server streams deltas to each
+# client as Server-Sent Events, at GET /queues/<name>/events. It wakes at most once per
+# BATCH_INTERVAL, and writes every delta since the last time to each client that is caught up, in
+# one pass over them. A client gets the whole queue as a "snapshot" event when it connects. A
+# client whose send buffer has grown past MAX_CLIENT_BUFFER is left out of the pass and catches up
+# on its own once its buffer drains, from the ring if it still has what the client missed, or
+# from a new snapshot if not. So a slow client only holds itself up, and one that stops reading
+# for too long is disconnected. Clients that reconnect with a Last-Event-ID header carry on from
+# there if they can.
+#
+# Versions start again from the journal every time the bot starts, so event ids are
+# "<epoch>:<version>", where the epoch is picked at random when the feed server starts. A client
+# reconnecting with an id from before a restart is sent a snapshot rather than deltas for a queue
+# it never saw.
+
+# Deltas kept for clients that fall behind
+DEFAULT_HISTORY = 1024
+
+# Time to gather deltas for before waking clients
+BATCH_INTERVAL = 0.05
+
+# Bytes waiting to be sent to one client before it has to catch up, and how long it can take
+MAX_CLIENT_BUFFER = 256 * 1024
+SEND_TIMEOUT = 30
+
+# How often an idle connection is sent a comment, so proxies keep it open and dead clients are noticed
+KEEPALIVE_INTERVAL = 15
+
+def _frame(epoch: str, seq: int, data, event: Optional[str] = None) -> bytes:
+    head = f"event: {event}\n" if event is not None else ''
+    return f"{head}id: {epoch}:{seq}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode('utf-8')
+
+class ChangeFeed():
+    # Start a feed for a queue at the given version, with event ids in the given epoch
+    def __init__(self, version: int = 0, history: int = DEFAULT_HISTORY, epoch: str = ''):
+        self._ring = [None] * history # (seq, frame), at seq % history
+        self.last = version # number of the newest delta
+        self.epoch = epoch
+        self._batch = (0, 0, b'') # the last since() result, shared by every client that is caught up
+
+        # Called after a delta is published, unless a call is already pending. Set by the server
+        self.on_publish: Optional[Callable[[], None]] = None
+        self.wake_pending = False
+
+    # Publish the delta that made the given version. Called by the queue with its lock held, so
+    # deltas are published in order
+    def publish(self, seq: int, delta: tuple):
+        self._ring[seq % len(self._ring)] = (seq, _frame(self.epoch, seq, delta))
+        self.last = seq
+        if self.on_publish is not None and not self.wake_pending:
+            self.wake_pending = True
+            self.on_publish()
+
+    # Get every delta after seq up to end (by default the newest), as frames ready to send.
+    # Returns None if some of them have left the ring
+    def since(self, seq: int, end: Optional[int] = None) -> Optional[bytes]:
+        end = self.last if end is None else end
+        if end - seq > len(self._ring):
+            return None
+
+        frames = []
+        for s in range(seq + 1, end + 1):
+            entry = self._ring[s % len(self._ring)]
+            if entry is None or entry[0] != s:
+                return None
+            frames.append(entry[1])
+        return b''.join(frames)
+
+# A connection following a queue's feed
+class _Client():
+    __slots__ = ('writer', 'cursor', 'behind')
+
+    def __init__(self, writer, cursor: Optional[int]):
+        self.writer = writer
+        self.cursor = cursor # the last delta sent, if the client isn't caught up
+        self.behind = None # future done when the client has to catch up on its own
+
+class FeedServer():
+    # Give every queue in the QueueManager a feed
+    def __init__(self, queues, history: int = DEFAULT_HISTORY):
+        self.queues = queues
+        self._sent = {} # queue name -> last delta sent to the clients that are caught up
+        self._live = {} # queue name -> clients that are caught up
+        self._wakeups = {} # queue name -> future done when deltas have been sent
+        self.clients = 0
+        self.epoch = os.urandom(4).hex()
+
+        for name, queue in queues.queues.items():
+            queue.feed = ChangeFeed(queue.version, history, self.epoch)
+            self._sent[name] = queue.version
+            self._live[name] = set()
+
+        if metrics.enabled:
+            metrics.gauge('queue_feed_clients', 'Clients connected to the change feed', lambda: self.clients)
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 9200):
+        loop = asyncio.get_running_loop()
+        for name, queue in self.queues.queues.items():
+            self._wakeups[name] = loop.create_future()
+            # Deltas can be published from other threads, so the wakeup is passed to the loop
+            queue.feed.on_publish = lambda name=name: loop.call_soon_threadsafe(
+                    loop.call_later, BATCH_INTERVAL, self._wake, name)
+
+        server = await asyncio.start_server(self._handle, host, port)
+        print(f"Serving the queue change feed on http://{host}:{port}/queues/<name>/events")
+        async with server:
+            await server.serve_forever()
+
+    # Send the deltas published since the last wakeup to every client that is caught up
+    def _wake(self, name: str):
+        feed = self.queues.get(name).feed
+        feed.wake_pending = False
+        sent = self._sent[name]
+        last = feed.last
+        data = feed.since(sent, last)
+
+        live = self._live[name]
+        for client in list(live):
+            transport = client.writer.transport
+            if data is None or transport.is_closing() or transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+                live.discard(client)
+                client.cursor = sent
+                client.behind.set_result(None)
+            elif data:
+                transport.write(data)
+
+        self._sent[name] = last
+        wakeup = self._wakeups[name]
+        self._wakeups[name] = wakeup.get_loop().create_future()
+        wakeup.set_result(None)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+            parts = request[1].strip('/').split('/') if len(request) >= 2 else []
+            queue = self.queues.get(parts[1]) if len(parts) == 3 and parts[0] == 'queues' and parts[2] == 'events' else None
+            if request[:1] != ['GET'] or queue is None:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                await writer.drain()
+                return
+
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                    b'Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\n')
+            writer.transport.set_write_buffer_limits(high=MAX_CLIENT_BUFFER)
+
+            # Event ids from another epoch are from before a restart, so the client needs a snapshot
+            cursor = None
+            epoch, _, seq = headers.get('last-event-id', '').rpartition(':')
+            if epoch == queue.feed.epoch and seq.isdigit() and int(seq) <= queue.feed.last:
+                cursor = int(seq)
+
+            # Clients send nothing after the request, so reading only finishes once they disconnect
+            closed = asyncio.ensure_future(reader.read())
+            client = _Client(writer, cursor)
+            self.clients += 1
+            try:
+                await self._follow(parts[1], queue, client, closed)
+            finally:
+                self.clients -= 1
+                self._live[parts[1]].discard(client)
+                closed.cancel()
+        except (ConnectionError, asyncio.TimeoutError, asyncio.CancelledError):
+            pass # the client went away or stopped reading, or the server is shutting down
+        finally:
+            writer.close()
+
+    # Bring a client up to date, then leave it to _wake until it falls behind or disconnects
+    async def _follow(self, name: str, queue, client: _Client, closed):
+        writer = client.writer
+        while not closed.done():
+            sent = self._sent[name]
+            data = queue.feed.since(client.cursor, sent) if client.cursor is not None else None
+            if client.cursor == sent:
+                client.behind = asyncio.get_running_loop().create_future()
+                self._live[name].add(client)
+                done, _ = await asyncio.wait((client.behind, closed), timeout=KEEPALIVE_INTERVAL,
+                        return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self._live[name].discard(client)
+                    client.cursor = self._sent[name]
+                    writer.write(b': keepalive\n\n')
+            elif client.cursor is not None and client.cursor > sent:
+                # The snapshot is newer than the last deltas sent, so wait for the next ones
+                await asyncio.wait((self._wakeups[name], closed), return_when=asyncio.FIRST_COMPLETED)
+                continue
+            elif data is None:
+                snapshot = queue.snapshot()
+                client.cursor = snapshot.version
+                writer.write(_frame(queue.feed.epoch, snapshot.version, snapshot.slice(0, len(snapshot)), 'snapshot'))
+            else:
+                client.cursor = sent
+                writer.write(data)
+            await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
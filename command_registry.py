@@ -0,0 +1,223 @@
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from enum import Enum
+from functools import cached_property
+from typing import Callable, List, Optional
+import asyncio
+import time
+
+from identity import name_identity
+from metrics import metrics
+from queue_server import CALL_TIMEOUT, QueueServerError, QueueUnavailable
+
+# Platform neutral command handling.
+#
+# Commands are registered by name in a CommandRegistry along with the permission they need and the
+# arguments they take, and dispatch finds them with a single dictionary lookup. Each bot wraps the
+# person running a command in a Caller subclass, which works out the caller's name, permissions
+# and tier only when a command asks for them, and sends replies in the way that suits its platform.
+
+Permission = Enum('Permission', 'EVERYONE ADMIN')
+
+_REQUIRED = object()
+
+class Arg():
+    __slots__ = ('name', 'type', 'default')
+
+    def __init__(self, name: str, type: Callable = str, default=_REQUIRED):
+        self.name = name
+        self.type = type
+        self.default = default
+
+    @property
+    def required(self) -> bool:
+        return self.default is _REQUIRED
+
+class UsageError(Exception):
+    pass
+
+class Command():
+    __slots__ = ('name', 'handler', 'permission', 'args', 'help')
+
+    def __init__(self, name: str, handler: Callable, permission: Permission, args: List[Arg], help: str):
+        self.name = name
+        self.handler = handler
+        self.permission = permission
+        self.args = args
+        self.help = help
+
+    @property
+    def usage(self) -> str:
+        parts = [f"<{arg.name}>" if arg.required else f"[{arg.name}]" for arg in self.args]
+        return ' '.join(['!' + self.name] + parts)
+
+    # Convert the words after the command into its arguments. Extra words are ignored
+    def parse(self, words: List[str]) -> list:
+        values = []
+        for i, arg in enumerate(self.args):
+            if i >= len(words):
+                if arg.required:
+                    raise UsageError(f"Usage: {self.usage}")
+                values.append(arg.default)
+                continue
+
+            try:
+                values.append(arg.type(words[i]))
+            except ValueError:
+                raise UsageError(f"{arg.name.capitalize()} must be a number" if arg.type is int
+                        else f"Invalid {arg.name} {words[i]}")
+        return values
+
+# The person running a command, as seen by the platform they ran it from
+class Caller():
+    platform = '' # where the command was run from, for messages such as "cannot be joined from Discord"
+    supporters = 'supporters' # who counts as a supporter, for messages
+    can_send_files = False # whether reply_file can be used
+
+    def __init__(self, queue, settings: dict):
+        self.queue = queue
+        self.settings = settings
+        self.priority = False # whether replies should skip ahead of other waiting replies
+
+        # When metrics are enabled, when the command was received, and the (command name, received)
+        # pair passed along with replies so the time until they are sent can be recorded
+        self.received = time.perf_counter() if metrics.enabled else 0.0
+        self.origin = None
+
+        # The event loop, when the command is run on the command thread rather than the loop
+        self.loop = None
+
+    # Call fn on the event loop. Commands run on the command thread (see dispatch_threaded) use this
+    # for anything that touches the bot. With wait set, waits for fn and returns its result, raising
+    # TimeoutError if the loop doesn't run it in time, such as when it has stopped
+    def on_loop(self, fn: Callable, *args, wait: bool = False):
+        if self.loop is None:
+            return fn(*args)
+        if not wait:
+            self.loop.call_soon_threadsafe(fn, *args)
+            return None
+
+        future = Future()
+        def run():
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+        self.loop.call_soon_threadsafe(run)
+        try:
+            return future.result(CALL_TIMEOUT)
+        except FutureTimeout:
+            raise TimeoutError('The event loop took too long to respond')
+
+    # Name to put in the queue
+    @cached_property
+    def name(self) -> str:
+        raise NotImplementedError
+
+    # Stable id of the caller's account, which doesn't change with their name. See identity.py
+    @cached_property
+    def identity(self) -> str:
+        return name_identity(self.name)
+
+    # Name to address the caller by in replies
+    @cached_property
+    def mention(self) -> str:
+        return self.name
+
+    @cached_property
+    def is_admin(self) -> bool:
+        raise NotImplementedError
+
+    @cached_property
+    def is_supporter(self) -> bool:
+        raise NotImplementedError
+
+    # Support tier as a string, or '' for none
+    @cached_property
+    def tier(self) -> str:
+        return ''
+
+    # Reason the caller can't join from where they ran the command, or None if they can
+    def join_blocked(self) -> Optional[str]:
+        return None
+
+    def reply(self, message: str):
+        raise NotImplementedError
+
+    # Reply that can be merged with others of the same prefix. See MessageScheduler.submit_grouped
+    def reply_grouped(self, prefix: str, message: str, item: str):
+        self.reply(message)
+
+    # Reply with a message and a file attached. Only for platforms with can_send_files set
+    def reply_file(self, message: str, filename: str, contents: str):
+        raise NotImplementedError
+
+    # Stop the bots
+    def shutdown(self):
+        raise NotImplementedError
+
+    # Reload the settings, returning a message describing what changed
+    def reload_settings(self) -> str:
+        raise NotImplementedError
+
+class CommandRegistry():
+    def __init__(self):
+        self.commands = {}
+        self._thread = None # executor running commands off the event loop, created when first needed
+
+    # Decorator to register a function as the handler of a command. The handler is called with the
+    # Caller followed by the parsed arguments
+    def command(self, name: str, permission: Permission = Permission.EVERYONE, args: List[Arg] = (), help: str = ''):
+        def register(handler):
+            self.commands[name] = Command(name, handler, permission, list(args), help)
+            return handler
+        return register
+
+    def get(self, name: str) -> Optional[Command]:
+        return self.commands.get(name)
+
+    # Run a command. Returns False if there is no command with that name. Admin commands run by
+    # anyone else are ignored
+    def dispatch(self, name: str, caller: Caller, words: List[str]) -> bool:
+        command = self.commands.get(name)
+        if command is None:
+            return False
+
+        if command.permission is Permission.ADMIN:
+            if not caller.is_admin:
+                return True
+            caller.priority = True
+
+        try:
+            args = command.parse(words)
+        except UsageError as e:
+            caller.reply(str(e))
+            return True
+
+        try:
+            if metrics.enabled:
+                metrics.run_handler(command, caller, args)
+            else:
+                command.handler(caller, *args)
+        except QueueUnavailable as e:
+            print(f"Failed to run {name}: {e}")
+            caller.reply("The queue can't be reached right now, try again in a moment")
+        except (QueueServerError, TimeoutError) as e:
+            print(f"Failed to run {name}: {e}")
+            caller.reply(f"Something went wrong running {name}, please let a mod know")
+        return True
+
+    # Run a command on the command thread rather than the event loop, for when the queues are held
+    # by a queue server and every queue call waits on the network. Commands from every bot still
+    # run one at a time in the order they arrive
+    async def dispatch_threaded(self, name: str, caller: Caller, words: List[str]) -> bool:
+        if self._thread is None:
+            self._thread = ThreadPoolExecutor(1, thread_name_prefix='commands')
+        caller.loop = asyncio.get_running_loop()
+        return await caller.loop.run_in_executor(self._thread, self.dispatch, name, caller, words)
+
+    # Stop the command thread once the command it is running finishes, dropping any waiting to
+    # run, so it doesn't hold up the interpreter exiting after the bots stop
+    def close(self):
+        if self._thread is not None:
+            self._thread.shutdown(wait=False, cancel_futures=True)
+            self._thread = None
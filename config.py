@@ -0,0 +1,281 @@
+from typing import List, Optional
+import json
+import os
+
+# Loading and checking the bot's settings without any prompts.
+#
+# Settings are read from a JSON file, and any of them can be set or overridden by environment
+# variables, so the bot can run in a container with its tokens kept out of the file. Every setting
+# is checked against SCHEMA before anything else starts, and all of the problems are reported at
+# once. Defaults are filled in, so the rest of the bot sees every setting.
+#
+# Environment variables are named QUEUE_BOT_ followed by the setting's path in capitals, with
+# sections separated by two underscores, such as QUEUE_BOT_TWITCH__TOKEN or QUEUE_BOT_SUB_ONLY.
+# Values are read as JSON where possible, and as plain strings otherwise.
+
+DEFAULT_PATH = 'settings.json'
+ENV_PREFIX = 'QUEUE_BOT_'
+ENV_PATH = 'QUEUE_BOT_CONFIG' # path of the settings file, rather than a setting
+
+PLATFORMS = ('twitch', 'discord')
+
+class ConfigError(Exception):
+    def __init__(self, errors: List[str]):
+        Exception.__init__(self, 'Invalid settings:\n' + '\n'.join('  ' + error for error in errors))
+        self.errors = errors
+
+REQUIRED = object()
+number = (int, float)
+
+def _is(value, types) -> bool:
+    return isinstance(value, types) and (types is bool or not isinstance(value, bool))
+
+def _names(types) -> str:
+    return ' or '.join(t.__name__ for t in (types if isinstance(types, tuple) else (types,)))
+
+# Further checks of a setting's value, once its type is right. Each returns what is wrong with the
+# value, or None if nothing is
+
+def list_of(types):
+    def check(value):
+        if not all(_is(item, types) for item in value):
+            return f"should be a list of {_names(types)}"
+    return check
+
+def at_least(minimum):
+    def check(value):
+        if value < minimum:
+            return f"should be at least {minimum}"
+    return check
+
+def port(value):
+    if not 0 < value < 65536:
+        return 'should be a port number, from 1 to 65535'
+
+def message_rate(value):
+    if len(value) != 2 or not all(_is(item, number) and item > 0 for item in value):
+        return 'should be two positive numbers, the messages that can be sent and the seconds they are counted over'
+
+def tier_map(value):
+    if not all(_is(tier, int) for tier in value.values()):
+        return 'should map role names to whole numbers'
+
+def identity_links(value):
+    for link in value:
+        if not isinstance(link, dict) or set(link) != {'twitch', 'discord'} \
+                or not all(_is(user_id, (str, int)) for user_id in link.values()):
+            return 'should be a list of {"twitch": <Twitch user id>, "discord": <Discord user id>}'
+
+# Queue names are used as the names of their journal directories
+def path_name(value):
+    if value.strip() in ('', '.', '..') or any(c in value for c in '/\\\0'):
+        return 'should be a name that can be used for a directory, without slashes'
+
+# Each setting's allowed types, default and, optionally, a further check of its value. A nested
+# dictionary is a section of settings, and a list holding one dictionary is a list of sections
+QUEUE_OPTIONS = {
+    'sub_only': (bool, False),
+    'tier_priority': (bool, False),
+    'tier_aging': (number, None),
+    'max_length': (int, None, at_least(0)),
+    'join_cooldown': (number, 0, at_least(0)),
+    'drop_spam': (bool, True),
+}
+
+SCHEMA = {
+    'twitch': {
+        'bot_name': (str, REQUIRED),
+        'token': (str, REQUIRED),
+        'channel': (str, None),
+        'admin_badges': (list, ['broadcaster', 'moderator'], list_of(str)),
+        'supporter_badges': (list, ['subscriber'], list_of(str)),
+        'can_join': (bool, True),
+        'server': (str, 'irc.chat.twitch.tv'),
+        'port': (int, 6667, port),
+        'message_rate': (list, [20, 30], message_rate),
+    },
+    'discord': {
+        'token': (str, REQUIRED),
+        'admin_roles': (list, ['Admin', 'mod'], list_of(str)),
+        'supporter_roles': (list, ['Twitch Subscriber', 'Patron', 'Youtube Member'], list_of(str)),
+        'tier_map': (dict, {}, tier_map),
+        'join_channels': (list, [], list_of(str)),
+        'can_join': (bool, True),
+    },
+    'queues': [{
+        'name': (str, REQUIRED, path_name),
+        'twitch_channel': (str, None),
+        'discord_guild': (int, None),
+        'discord_channels': (list, [], list_of(str)),
+        'discord_default': (bool, False),
+        **QUEUE_OPTIONS,
+    }],
+    'journal_dir': (str, 'queue_state'),
+    'identity_links': (list, [], identity_links),
+    'metrics': {
+        'enabled': (bool, False),
+        'port': (int, None, port),
+        'host': (str, '127.0.0.1'),
+        'log_interval': (number, None, at_least(1)),
+        'profile_rate': (number, 0.0, at_least(0)),
+        'profile_path': (str, 'commands.prof'),
+    },
+    'feed': {
+        'port': (int, REQUIRED, port),
+        'host': (str, '127.0.0.1'),
+        'history': (int, 1024, at_least(1)),
+    },
+    'queue_server': {
+        'port': (int, REQUIRED, port),
+        'host': (str, '127.0.0.1'),
+        'connections': (int, 2, at_least(1)),
+    },
+    'reload_interval': (number, 2, at_least(0)),
+    **QUEUE_OPTIONS,
+}
+
+# --------------- Loading ---------------
+
+# Read the settings file, if there is one, and apply the environment on top. Returns None if
+# there are no settings at all
+def read(path: Optional[str] = None, environ: Optional[dict] = None) -> Optional[dict]:
+    environ = os.environ if environ is None else environ
+    path = settings_path(path, environ)
+
+    settings = None
+    try:
+        with open(path, 'r') as f:
+            settings = json.load(f)
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        raise ConfigError([f"{path} is not valid JSON: {e}"])
+
+    overrides = _from_environ(environ)
+    if settings is None and not overrides:
+        return None
+    settings = settings or {}
+    if not isinstance(settings, dict):
+        raise ConfigError([f"{path} must hold a JSON object"])
+
+    for keys, value in overrides:
+        section = settings
+        for key in keys[:-1]:
+            section = section.setdefault(key, {})
+        section[keys[-1]] = value
+    return settings
+
+def _from_environ(environ: dict) -> list:
+    overrides = []
+    for name, value in environ.items():
+        if not name.startswith(ENV_PREFIX) or name == ENV_PATH:
+            continue
+        keys = name[len(ENV_PREFIX):].lower().split('__')
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        overrides.append((keys, value))
+    return overrides
+
+# --------------- Checking ---------------
+
+# Check the settings and fill in defaults, raising ConfigError with every problem found. Only the
+# platforms in `platforms` that have a section in the settings are checked; the others are removed.
+# Without a queues list, the queue is named after the Twitch channel, which is kept as
+# queue_channel even when the Twitch bot isn't run, so that every process run from the same
+# settings names the queue the same way
+def validate(settings: dict, platforms=PLATFORMS) -> dict:
+    errors = []
+    twitch = settings.get('twitch')
+    channel = twitch.get('channel') if isinstance(twitch, dict) else None
+    settings = dict(settings)
+    for platform in PLATFORMS:
+        if platform not in platforms:
+            settings.pop(platform, None)
+
+    result = _check(settings, SCHEMA, '', errors)
+    enabled = enabled_platforms(result)
+    if not enabled:
+        errors.append(f"No platform to run. Give settings for one of: {', '.join(platforms)}")
+    if result.get('queues') is None and 'twitch' in enabled and result['twitch'].get('channel') is None:
+        errors.append('twitch.channel is required when there is no queues list')
+    if result.get('queues') == []:
+        errors.append('queues must not be empty')
+    if result.get('queues') is None:
+        result['queue_channel'] = channel if isinstance(channel, str) else None
+
+    if errors:
+        raise ConfigError(errors)
+    return result
+
+def _check(values, schema: dict, path: str, errors: List[str]) -> dict:
+    if not isinstance(values, dict):
+        errors.append(f"{path.rstrip('.')} must be an object")
+        return {}
+
+    for key in values:
+        if key not in schema:
+            errors.append(f"Unknown setting {path}{key}")
+
+    result = {}
+    for key, rule in schema.items():
+        value = values.get(key)
+        if isinstance(rule, dict):
+            # An optional section, only checked if it is there
+            if value is not None:
+                result[key] = _check(value, rule, f"{path}{key}.", errors)
+        elif isinstance(rule, list):
+            if value is None:
+                result[key] = None
+            elif not isinstance(value, list):
+                errors.append(f"{path}{key} must be a list")
+            else:
+                result[key] = [_check(item, rule[0], f"{path}{key}[{i}].", errors) for i, item in enumerate(value)]
+        else:
+            types, default, *check = rule
+            if value is None:
+                if default is REQUIRED:
+                    errors.append(f"{path}{key} is required")
+                # Copy mutable defaults so settings never share them
+                result[key] = default.copy() if isinstance(default, (list, dict)) else default
+            elif not _is(value, types):
+                errors.append(f"{path}{key} should be {_names(types)}, got {json.dumps(value)}")
+            else:
+                problem = check[0](value) if check else None
+                if problem is not None:
+                    errors.append(f"{path}{key} {problem}, got {json.dumps(value)}")
+                result[key] = value
+    return result
+
+# Platforms that have settings, and so will be run
+def enabled_platforms(settings: dict) -> List[str]:
+    return [platform for platform in PLATFORMS if settings.get(platform) is not None]
+
+# --------------- Compiling ---------------
+
+# Convert lists of badges, roles and channels into the frozensets the bots look them up in.
+# Supporters always include admins
+def compile_settings(settings: dict) -> dict:
+    twitch = settings.get('twitch')
+    if twitch is not None:
+        twitch['admin_badges'] = frozenset(twitch['admin_badges'])
+        twitch['supporter_badges'] = twitch['admin_badges'].union(twitch['supporter_badges'])
+
+    discord = settings.get('discord')
+    if discord is not None:
+        discord['admin_roles'] = frozenset(discord['admin_roles'])
+        discord['supporter_roles'] = discord['admin_roles'].union(discord['supporter_roles'])
+        discord['join_channels'] = frozenset(discord['join_channels'])
+    return settings
+
+def settings_path(path: Optional[str] = None, environ: Optional[dict] = None) -> str:
+    environ = os.environ if environ is None else environ
+    return path or environ.get(ENV_PATH, DEFAULT_PATH)
+
+# Read, check and compile the settings in one go
+def load(path: Optional[str] = None, platforms=PLATFORMS, environ: Optional[dict] = None) -> Optional[dict]:
+    settings = read(path, environ)
+    if settings is None:
+        return None
+    return compile_settings(validate(settings, platforms))
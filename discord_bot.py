@@ -1,229 +1,262 @@
 from discord.ext import commands
+from functools import cached_property
+from typing import Optional
+import aiohttp
+import asyncio
+import discord
+import io
+import time
+
+from backoff import Backoff
+from command_registry import Caller
+from metrics import metrics
+from permissions import PermissionCache
+from queue_commands import registry
+from reply_batcher import ReplyBatcher
 
 # Initialize bot
 COMMAND_PREFIX = '!'
 bot = commands.Bot(command_prefix=COMMAND_PREFIX, case_insensitive=True)
 
+# Replies to everyday commands are batched per channel. Admin commands reply straight away. Either
+# kind is kept and retried if Discord can't be reached
+batcher = ReplyBatcher()
 
-# --------------- Forward Variable Declarations ---------------
-settings = {'admin_roles': []}
-
-
-# --------------- Helper Functions ---------------
-
-def is_admin(roles, admin_roles) -> bool:
-    for role in roles:
-        if role.name in admin_roles:
-            break
-    else:
-        # User is not an admin, so they can't use this command
-        return False
-
-    return True
+# Network errors and Discord server errors are worth retrying, anything else won't get better
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, discord.HTTPException):
+        return error.status >= 500
+    return isinstance(error, (OSError, asyncio.TimeoutError, aiohttp.ClientError))
 
-# --------------- Bot Commands -------------------------
-
-# Command to join the queue, if not already in it
-@bot.command(name='join', help='Joins the current queue')
-async def join_queue(ctx):
-    global queue
-    global settings
+batcher.is_transient = is_transient
 
-    if not settings['can_join']:
-        await ctx.send(f"{ctx.message.author.mention} this queue cannot be joined from Discord")
-        return
 
-    if len(settings['join_channels']) > 0 and ctx.channel.name not in settings['join_channels']:
-        await ctx.send(f"{ctx.message.author.mention} you must join the queue from an allowed channel")
+# --------------- Forward Variable Declarations ---------------
+settings = {'admin_roles': []}
+queues = None # QueueManager with the queue of each channel
+on_shutdown = None # coroutine function that stops every bot
+ready_callback = None # function called once the bot is connected
+on_reload = None # function that reloads the settings, returning what changed
+permissions = None # PermissionCache built from the settings
+disconnected_at = None # monotonic time the connection to Discord was lost, until it is back
+
+
+# --------------- Command Adapter ---------------
+
+class DiscordCaller(Caller):
+    platform = 'Discord'
+    supporters = 'Twitch subscribers, Patrons, and YouTube Members'
+    can_send_files = True
+
+    def __init__(self, ctx):
+        guild_id = ctx.guild.id if ctx.guild is not None else None
+        # Direct messages have no channel name, and use the Discord default queue
+        self.channel_name = getattr(ctx.channel, 'name', None)
+        Caller.__init__(self, queues.for_discord(guild_id, self.channel_name), settings)
+        self.ctx = ctx
+        self.replies = [] # (message, priority, origin), sent once the command is done
+        self.files = [] # (message, filename, contents), sent after the replies
+        self.shutdown_requested = False
+
+    @cached_property
+    def name(self) -> str:
+        return self.ctx.message.author.name
+
+    @cached_property
+    def identity(self) -> str:
+        return queues.links.discord(self.ctx.message.author.id)
+
+    @cached_property
+    def mention(self) -> str:
+        return self.ctx.message.author.mention
+
+    # The cache is also used by the member and role events, so it is only read on the event loop
+    @cached_property
+    def member_permissions(self):
+        return self.on_loop(permissions.get, self.ctx.message.author, wait=True)
+
+    @cached_property
+    def is_admin(self) -> bool:
+        return self.member_permissions.is_admin
+
+    @cached_property
+    def is_supporter(self) -> bool:
+        return self.member_permissions.is_supporter
+
+    @cached_property
+    def tier(self) -> str:
+        tier = self.member_permissions.tier
+        return '' if tier == 0 else str(tier)
+
+    def join_blocked(self) -> Optional[str]:
+        join_channels = self.settings['join_channels']
+        if len(join_channels) > 0 and self.channel_name not in join_channels:
+            return 'you must join the queue from an allowed channel'
+        return None
+
+    def reply(self, message: str):
+        self.replies.append((message, self.priority, self.origin))
+
+    def reply_file(self, message: str, filename: str, contents: str):
+        self.files.append((message, filename, contents))
+
+    def shutdown(self):
+        self.shutdown_requested = True
+
+    def reload_settings(self) -> str:
+        if on_reload is None:
+            return 'Settings can only be reloaded by restarting'
+        return self.on_loop(on_reload, wait=True)
+
+# Run a command from the registry and send its replies
+async def run_command(ctx, name: str, words):
+    caller = DiscordCaller(ctx)
+    if caller.queue is None:
+        await batcher.send(ctx.channel, 'There is no queue in this channel')
         return
 
-    roles = [str(role) for role in ctx.message.author.roles] # get a list of the names of all roles the the message author
-
-    # Get highest support tier a person has
-    tier = 0
-    for r in roles:
-        try:
-            cur_tier = settings['tier_map'][r]
-        except:
-            cur_tier = 0
-
-        if cur_tier > tier:
-            tier = cur_tier
-
-    # Check if message author has required roles to join queue
-    allowed = False
-    if queue.user_level.name == 'EVERYONE':
-        allowed = True
-    elif queue.user_level.name == 'SUPPORTER':
-        allowed = len(settings['supporter_roles'].intersection(roles)) > 0
+    if queues.remote:
+        await registry.dispatch_threaded(name, caller, list(words))
     else:
-        allowed = len(settings['admin_roles'].intersection(roles)) > 0
+        registry.dispatch(name, caller, list(words))
 
-    if allowed:
-        pos = queue.push(ctx.message.author.name, '' if tier == 0 else str(tier))
-        if pos > -1:
-            await ctx.send(f"{ctx.message.author.mention} has been added to the queue at position {pos}")
+    for message, priority, origin in caller.replies:
+        if priority:
+            await batcher.send_now(ctx.channel, message, origin)
         else:
-            await ctx.send(f"{ctx.message.author.mention} is already in the queue")
-    else:
-        await ctx.send(f"{ctx.message.author.mention} only Twitch subscribers, Patrons, and YouTube Members can join this queue")
-
-@bot.command(name='pos', help='Get current position in the queue')
-async def get_pos(ctx):
-    global queue
-    global settings
-
-    pos = queue.user_pos(ctx.message.author.name)
-    if pos == -1:
-        await ctx.send(f"{ctx.message.author.mention} is not in the queue")
-    else:
-        await ctx.send(f"{ctx.message.author.mention} is in the queue at position {pos}")
-
-# Command to leave the queue, if in it
-@bot.command(name='leave', help='Leaves the current queue')
-async def leave_queue(ctx):
-    global queue
-    global settings
-
-    if queue.remove(ctx.message.author.name):
-        await ctx.send(f"{ctx.message.author.mention} has been removed from the queue")
-    else:
-        await ctx.send(f"{ctx.message.author.mention} was not in the queue")
-
-# Command to print out the queue contents
-@bot.command(name='queue', help='Prints the current queue')
-async def print_queue(ctx):
-    global queue
-    global settings
-
-    s = str(queue)
-    if s == '':
-        await ctx.send('The queue is empty')
-    else:
-        await ctx.send(f"Current queue: {s}")
-
-# Command to get the next person in the queue. Can only be done by people with the Admin role
-@bot.command(name='next', help='Gets the next player in the queue. Can only be used by admins')
-async def next_player(ctx):
-    global queue
-    global settings
-
-    if not is_admin(ctx.author.roles, settings['admin_roles']):
-        return
-
-    player, tier = queue.pop()
-    if player is None:
-        await ctx.send('The queue is empty')
-    else:
-        tier_msg = f" at tier {tier}" if len(tier) > 0 else ''
-        await ctx.send(f"Up next: {player}{tier_msg}")
-
-# Command to move someone to a different part of the queue. Can only be done by people with the Admin role
-@bot.command(name='promote', help='Moves a player to a different position in the queue. Can only be used by admins')
-async def promote_player(ctx, name: str, position: int = 1):
-    global queue
-    global settings
-
-    if not is_admin(ctx.author.roles, settings['admin_roles']):
-        return
-
-    success = queue.promote(name, position)
-    if success:
-        await ctx.send(f"{name} is now in position {position} in the queue")
-    else:
-        await ctx.send(f"Unable to update queue")
+            await batcher.send(ctx.channel, message, origin)
 
-# Command to clear the queue
-@bot.command(name='clear', help='Clears the queue. Can only be used by admins')
-async def clear_queue(ctx):
-    global queue
-    global settings
-
-    if not is_admin(ctx.author.roles, settings['admin_roles']):
-        return
-
-    queue.clear()
-    await ctx.send('The queue has successfully been cleared')
-
-# Command to list the available commands for everyone
-@bot.command(name='queuecommands', help='List all available commands')
-async def list_commands(ctx):
-    await ctx.send('The commands for this bot can be found at https://github.com/dylanross620/OGC-DiscordBot/blob/master/README.md')
-
-# Command to easily shutdown the bot
-@bot.command(name='shutdown')
-async def close(ctx):
-    global settings
-
-    if not is_admin(ctx.author.roles, settings['admin_roles']):
-        return
+    # Files are too big to keep for retrying, so they are only tried once
+    for message, filename, contents in caller.files:
+        try:
+            await ctx.send(message, file=discord.File(io.BytesIO(contents.encode('utf-8')), filename))
+        except Exception as e:
+            print(f"Failed to send {filename}: {e}")
+
+    if caller.shutdown_requested:
+        await batcher.flush()
+        if on_shutdown is not None:
+            await on_shutdown()
+        else:
+            await ctx.bot.close()
+        print('Discord bot shutdown')
 
-    await ctx.send('Shutting down')
-    await ctx.bot.close()
-    print('Discord bot shutdown')
+# Make a discord.py command that hands its words to the registry
+def make_command(command):
+    async def callback(ctx, *words):
+        await run_command(ctx, command.name, words)
+    return commands.Command(callback, name=command.name, help=command.help)
 
-# Command to set the userlevel of the queue
-@bot.command(name='userlevel')
-async def user_level(ctx, level: str):
-    global queue
-    global settings
+for command in registry.commands.values():
+    bot.add_command(make_command(command))
 
-    if not is_admin(ctx.author.roles, settings['admin_roles']):
-        return
+@bot.event
+async def on_ready():
+    reconnected()
+    if ready_callback is not None:
+        ready_callback()
 
-    if queue.set_user_level(level.upper()):
-        await ctx.send(f"Successfully set user level to {level}")
-    else:
-        await ctx.send(f"Invalid user level {level}")
+# discord.py reconnects by itself, and replays the events that were missed if it can resume
+@bot.event
+async def on_disconnect():
+    global disconnected_at
+    if disconnected_at is None:
+        disconnected_at = time.monotonic()
 
-# Command to add a user to the queue regardless of user level
-@bot.command(name='add', help='Add player to queue regardless of current user level')
-async def add(ctx, name: str):
-    global queue
-    global settings
+@bot.event
+async def on_resumed():
+    reconnected()
 
-    if not is_admin(ctx.author.roles, settings['admin_roles']):
+def reconnected():
+    global disconnected_at
+    if disconnected_at is None:
         return
+    downtime = time.monotonic() - disconnected_at
+    disconnected_at = None
+    print(f"Discord bot reconnected after {downtime:.1f}s with {batcher.depth()} replies waiting")
+    if metrics.enabled:
+        metrics.histogram('queue_reconnect_seconds', 'Time from losing the connection to being connected again',
+                platform='discord').observe(downtime)
+
+# Keep cached permissions up to date when members or roles change
+@bot.event
+async def on_member_update(before, after):
+    permissions.member_updated(before, after)
 
-    pos = queue.push(name, '')
-
-    if pos == -1:
-        await ctx.send(f"{name} is already in the queue")
-    else:
-        await ctx.send(f"{name} has been added to the queue at position {pos}")
-
-# Command to remove a player from the queue
-@bot.command(name='remove', help='Remove a player from the queue')
-async def remove(ctx, name: str):
-    global queue
-    global settings
+@bot.event
+async def on_member_remove(member):
+    permissions.invalidate(member)
 
-    if not is_admin(ctx.author.roles, settings['admin_roles']):
-        return
+@bot.event
+async def on_guild_role_update(before, after):
+    if before.name != after.name:
+        permissions.clear()
 
-    if queue.remove(name):
-        await ctx.send(f"{name} has been removed from the queue")
-    else:
-        await ctx.send(f"{name} was not in the queue")
+@bot.event
+async def on_guild_role_delete(role):
+    permissions.clear()
 
 # Error message for unknown commands
 @bot.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.CommandNotFound):
         cmd = ctx.message.content.split(' ')[0]
-        await ctx.send(f"Unknown command: {cmd}")
+        await batcher.send(ctx.channel, f"Unknown command: {cmd}")
     else:
         # The error isn't expected, so propogate it
         raise error
 
+# Swap in new settings while the bot runs, dropping only the cached permissions they affect
+def apply_settings(new_settings):
+    global settings
+    settings = new_settings
+    dropped = permissions.update_settings(new_settings)
+    print(f"Discord settings updated, {dropped} cached permissions dropped")
+
 # -------------- Start ---------------------------------
-def start(game_queue, settings_orig):
-    # Load bot token in from the 'discord_token.env' file
-    global queue
-    queue = game_queue
+# Set up the bot's state without connecting, so its commands can be run
+def setup(queue_manager, settings_orig, shutdown=None, ready=None, reload=None):
+    global queues
+    queues = queue_manager
 
     global settings
     settings = settings_orig
 
+    global on_shutdown
+    on_shutdown = shutdown
+
+    global ready_callback
+    ready_callback = ready
+
+    global on_reload
+    on_reload = reload
+
+    global permissions
+    permissions = PermissionCache(settings)
+
+    if metrics.enabled:
+        batcher.on_sent = metrics.reply_sent
+        metrics.gauge('queue_outbound_backlog', 'Messages waiting to be sent', batcher.depth, platform='discord')
+        metrics.counter('queue_replies_dropped_total',
+                'Replies dropped because too many were waiting or sending failed',
+                lambda: batcher.dropped, platform='discord')
+
+# Run the bot on the current event loop until it is shut down
+async def run(queue_manager, settings_orig, shutdown=None, ready=None, reload=None):
+    setup(queue_manager, settings_orig, shutdown, ready, reload)
+
     print('Discord bot loaded successfully')
-    bot.run(settings['token'])
+
+    # Once logged in, discord.py reconnects with its own backoff, but logging in isn't retried
+    backoff = Backoff()
+    while True:
+        try:
+            await bot.login(settings['token'])
+            break
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            delay = backoff.next()
+            print(f"Failed to log in to Discord, retrying in {delay:.1f} seconds: {e}")
+            await asyncio.sleep(delay)
+    await bot.connect()
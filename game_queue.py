@@ -0,0 +1,713 @@
+from typing import Union, Tuple, Optional, Iterator, Callable, List, TextIO
+from threading import Lock
+from contextlib import nullcontext
+from collections import OrderedDict
+from enum import Enum
+import csv
+import itertools
+import math
+import random
+import sys
+import time
+
+from identity import name_identity, name_key
+from journal import Journal
+
+UserLevel = Enum('UserLevel', 'MOD SUPPORTER EVERYONE')
+
+# --------------- Ordered Index ---------------
+# The queue order is kept in a treap (a randomly balanced binary search tree) where every node
+# knows the size of its subtree. Nodes are ordered by a tuple key, so a node's position can be
+# found by walking down from the root, which makes lookups, inserts and removals O(log n).
+#
+# The treap is persistent: nodes are never changed once they are in a published tree. Inserts and
+# removals copy the O(log n) nodes on the path they change and share the rest, giving a new root
+# while every older root still describes the queue as it was. A reader holding a root can walk it
+# without a lock for as long as it likes.
+
+class _Node():
+    __slots__ = ('key', 'identity', 'name', 'tier', 'joined', 'priority', 'left', 'right', 'size')
+
+    def __init__(self, key: tuple, identity: str, name: str, tier: str, joined: float):
+        self.key = key
+        self.identity = identity
+        self.name = name
+        self.tier = tier
+        self.joined = joined # time.time() the player joined
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.size = 1
+
+    # Copy of the node, to be changed before it is published
+    def copy(self) -> '_Node':
+        t = _Node.__new__(_Node)
+        t.key = self.key
+        t.identity = self.identity
+        t.name = self.name
+        t.tier = self.tier
+        t.joined = self.joined
+        t.priority = self.priority
+        t.left = self.left
+        t.right = self.right
+        t.size = self.size
+        return t
+
+def _size(t: Optional[_Node]) -> int:
+    return t.size if t is not None else 0
+
+def _update(t: _Node):
+    t.size = 1 + _size(t.left) + _size(t.right)
+
+# Split a tree into the nodes with keys less than key and the nodes with keys greater or equal to it
+def _split(t: Optional[_Node], key: tuple) -> Tuple[Optional[_Node], Optional[_Node]]:
+    if t is None:
+        return None, None
+
+    t = t.copy()
+    if t.key < key:
+        t.right, right = _split(t.right, key)
+        _update(t)
+        return t, right
+
+    left, t.left = _split(t.left, key)
+    _update(t)
+    return left, t
+
+# Merge two trees, where every key in a is less than every key in b
+def _merge(a: Optional[_Node], b: Optional[_Node]) -> Optional[_Node]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+
+    if a.priority > b.priority:
+        a = a.copy()
+        a.right = _merge(a.right, b)
+        _update(a)
+        return a
+
+    b = b.copy()
+    b.left = _merge(a, b.left)
+    _update(b)
+    return b
+
+# Insert a node that isn't in any tree yet
+def _insert(t: Optional[_Node], node: _Node) -> _Node:
+    if t is None:
+        return node
+
+    if node.priority > t.priority:
+        node.left, node.right = _split(t, node.key)
+        _update(node)
+        return node
+
+    t = t.copy()
+    if node.key < t.key:
+        t.left = _insert(t.left, node)
+    else:
+        t.right = _insert(t.right, node)
+    t.size += 1
+    return t
+
+# Remove the node with the given key. The key must be in the tree
+def _remove(t: _Node, key: tuple) -> Optional[_Node]:
+    if key < t.key:
+        t = t.copy()
+        t.left = _remove(t.left, key)
+    elif t.key < key:
+        t = t.copy()
+        t.right = _remove(t.right, key)
+    else:
+        return _merge(t.left, t.right)
+
+    t.size -= 1
+    return t
+
+# Build a tree from new nodes already in key order in O(n), by keeping the right spine of the
+# tree built so far on a stack
+def _build(nodes) -> Optional[_Node]:
+    spine = []
+    for node in nodes:
+        last = None
+        while spine and spine[-1].priority < node.priority:
+            last = spine.pop()
+            _update(last)
+        node.left = last
+        if spine:
+            spine[-1].right = node
+        spine.append(node)
+
+    for node in reversed(spine):
+        _update(node)
+    return spine[0] if spine else None
+
+# Get the 0-based position of a key, or -1 if it is not in the tree
+def _rank(t: Optional[_Node], key: tuple) -> int:
+    r = 0
+    while t is not None:
+        if key < t.key:
+            t = t.left
+        elif t.key < key:
+            r += _size(t.left) + 1
+            t = t.right
+        else:
+            return r + _size(t.left)
+    return -1
+
+# Get the node at a 0-based position, or None if the position is out of bounds
+def _at(t: Optional[_Node], i: int) -> Optional[_Node]:
+    while t is not None:
+        left = _size(t.left)
+        if i < left:
+            t = t.left
+        elif i > left:
+            i -= left + 1
+            t = t.right
+        else:
+            return t
+    return None
+
+def _first(t: Optional[_Node]) -> Optional[_Node]:
+    if t is None:
+        return None
+    while t.left is not None:
+        t = t.left
+    return t
+
+# In-order iteration over at most count nodes, starting at a 0-based position. Finding the start
+# is O(log n), and each node after it is O(1) on average
+def _range(t: Optional[_Node], start: int, count: int) -> Iterator[_Node]:
+    # The stack holds the nodes still to visit on the way back up, nearest first
+    stack = []
+    while t is not None:
+        left = _size(t.left)
+        if start < left:
+            stack.append(t)
+            t = t.left
+        elif start > left:
+            start -= left + 1
+            t = t.right
+        else:
+            stack.append(t)
+            break
+
+    while stack and count > 0:
+        t = stack.pop()
+        yield t
+        count -= 1
+        t = t.right
+        while t is not None:
+            stack.append(t)
+            t = t.left
+
+# In-order iteration over every node
+def _iter(t: Optional[_Node]) -> Iterator[_Node]:
+    stack = []
+    while stack or t is not None:
+        while t is not None:
+            stack.append(t)
+            t = t.left
+        t = stack.pop()
+        yield t
+        t = t.right
+
+# The queue as it was at one version. Snapshots never change, so any number of readers can use
+# one at once, and every read from the same snapshot agrees with the others
+class QueueSnapshot():
+    __slots__ = ('version', 'root')
+
+    def __init__(self, version: int, root: Optional[_Node]):
+        self.version = version
+        self.root = root
+
+    def __len__(self) -> int:
+        return _size(self.root)
+
+    # Get the 0-based position of a node, or -1 if that player isn't in this version
+    def position(self, node: _Node) -> int:
+        key = node.key
+        r = 0
+        t = self.root
+        while t is not None:
+            if key < t.key:
+                t = t.left
+            elif t.key < key:
+                r += _size(t.left) + 1
+                t = t.right
+            else:
+                return r + _size(t.left) if t.identity == node.identity else -1
+        return -1
+
+    # Get (name, tier) of the first player, or None if the queue is empty
+    def first(self) -> Optional[Tuple[str, str]]:
+        node = _first(self.root)
+        return (node.name, node.tier) if node is not None else None
+
+    # Get (name, tier) for at most count players, starting at a 0-based position
+    def slice(self, start: int, count: int) -> List[Tuple[str, str]]:
+        return [(node.name, node.tier) for node in _range(self.root, start, count)]
+
+    # Iterate over (position, name, tier) for every player
+    def entries(self) -> Iterator[Tuple[int, str, str]]:
+        for pos, node in enumerate(_iter(self.root), 1):
+            yield pos, node.name, node.tier
+
+# Generate a key that sorts strictly between lo and hi, which must be neighbours in the index
+def _key_between(lo: tuple, hi: tuple) -> tuple:
+    n = len(lo)
+    if len(hi) > n and hi[:n] == lo:
+        # hi extends lo, so go just below hi's next component
+        return lo + (hi[n] - 1,)
+    # Any extension of lo sorts before hi
+    return lo + (0,)
+
+# --------------- Join Cooldowns ---------------
+# Remembers who joined recently, so each player can only try to join once per cooldown. Every
+# cooldown lasts the same time, so they end in the order they started, and ended ones are dropped
+# from the front of the dictionary. At most max_size cooldowns are kept, so in a flood of more
+# players than that, the oldest cooldowns are ended early to keep memory use flat.
+
+class JoinCooldown():
+    def __init__(self, seconds: float, max_size: int = 10_000, clock: Callable[[], float] = time.monotonic):
+        self.seconds = seconds
+        self.max_size = max_size
+        self.clock = clock
+        self._ends = OrderedDict() # name -> time its cooldown ends, earliest first
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    # Start a cooldown for name and return 0, or if it already has one, return the seconds left
+    def start(self, name: str) -> float:
+        now = self.clock()
+        ends = self._ends
+        while ends:
+            first = next(iter(ends))
+            if ends[first] > now:
+                break
+            del ends[first]
+
+        end = ends.get(name)
+        if end is not None:
+            return end - now
+        ends[name] = now + self.seconds
+        if len(ends) > self.max_size:
+            ends.popitem(last=False)
+        return 0
+
+# --------------- Game Queue ---------------
+
+# What push returns when the player is already in the queue, the queue is full, or another
+# player in the queue has the same name
+ALREADY_QUEUED = -1
+QUEUE_FULL = -2
+NAME_TAKEN = -3
+
+# In priority mode, how many seconds of waiting each support tier is worth when no aging is set.
+# This is longer than anyone will wait, so a higher tier always goes ahead of a lower one
+STRICT_TIER_WAIT = 1e10
+
+# How many times a reader looks again when it catches a write part way through, before waiting
+# for the lock instead
+READ_RETRIES = 3
+
+# Support tier as a number, where '' (no tier) is 0
+def _tier_level(tier: str) -> int:
+    try:
+        return int(tier)
+    except ValueError:
+        return 0
+
+class GameQueue():
+    def __init__(self, sub_only, journal: Optional[Journal] = None, threadsafe: bool = True,
+            priority: bool = False, aging: Optional[float] = None, max_length: Optional[int] = None,
+            join_cooldown: float = 0, drop_spam: bool = True):
+        self.print_limit = 10
+
+        # Limits against join floods. Joins past max_length are refused, and each player can only
+        # try to join once per join_cooldown seconds. Both are checked before taking the lock,
+        # and attempts during a cooldown are ignored without a reply if drop_spam is set
+        self.max_length = max_length
+        self.cooldown = JoinCooldown(join_cooldown) if join_cooldown > 0 else None
+        self.drop_spam = drop_spam
+
+        # In priority mode, players are ordered by tier and then join time instead of join time
+        # alone. With aging, each tier only counts as having joined that many seconds earlier, so
+        # lower tiers move up as they wait instead of being passed by every new supporter
+        self.priority = priority
+        self.tier_wait = STRICT_TIER_WAIT if aging is None else aging
+        self._seq = itertools.count()
+
+        self.user_level = UserLevel.SUPPORTER if sub_only else UserLevel.EVERYONE
+
+        # When every caller runs on the same asyncio event loop, no method can be interrupted part
+        # way through, since none of them await, so the lock can be skipped
+        self.lock = Lock() if threadsafe else nullcontext()
+        self.journal = journal
+
+        # ChangeFeed that every change is published to as a delta, if anything is following the queue
+        self.feed = None
+
+        # PlayHistory that every pop is recorded in, for estimating wait times
+        self.history = None
+
+        # Players are found by identity, or by case folded name for players given by name, such
+        # as by admin commands. Both must be unique, so one person can't hold two places.
+        # Writers change these under the lock, then publish the new version as a snapshot.
+        # Readers never take the lock: they read the published snapshot, and check anything they
+        # find in the dictionaries (which are only changed one atomic operation at a time)
+        # against it
+        self._root = None # queue order, as the root of a persistent treap
+        self._nodes = {} # identity -> node
+        self._names = {} # case folded name -> node
+
+        # Every key's first component lies in [_head, _tail), so (_tail,) sorts after all keys
+        # and (_head - 1,) sorts before them
+        self._head = 0
+        self._tail = 0
+
+        # The rendered listing is rebuilt by writers and published as an immutable string along
+        # with the snapshot. The first print_limit names are only rebuilt when one of them
+        # changes. The full listing is built on demand and cached until the next change
+        self.version = 0
+        self._snapshot = QueueSnapshot(0, None)
+        self._listing_head = ''
+        self._listing = ''
+        self._full_listing = (0, '')
+
+        if journal is not None:
+            self._restore()
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    # Method to set the queue's user level using a string, returning whether or not it was done successfully
+    def set_user_level(self, level: str) -> bool:
+        with self.lock:
+            if level == 'MOD':
+                self.user_level = UserLevel.MOD
+            elif level == 'SUPPORTER':
+                self.user_level = UserLevel.SUPPORTER
+            elif level == 'EVERYONE':
+                self.user_level = UserLevel.EVERYONE
+            else:
+                return False
+
+            self._log('level', level)
+            return True
+
+    # Method to find a user's 0-based position in the queue, by identity if given or else by name.
+    # Returns -1 if user not found. Only takes the lock if the player has to be renamed, or a
+    # write to the same player keeps getting in the way
+    def user_pos(self, user: str, identity: Optional[str] = None) -> int:
+        for _ in range(READ_RETRIES):
+            snapshot = self._snapshot
+            node = self._lookup(user, identity)
+            if node is None:
+                return -1
+            if node.identity == identity and node.name != user:
+                break
+            pos = snapshot.position(node)
+            if pos >= 0:
+                return pos
+            # The node was added after the snapshot was taken, so look again
+
+        with self.lock:
+            node = self._find(user, identity)
+            if node is None:
+                return -1
+            return _rank(self._root, node.key)
+
+    # Estimated seconds until the player at a 1-based position is taken off the queue, or None if
+    # there isn't enough history to tell
+    def eta(self, position: int) -> Optional[float]:
+        return self.history.eta(position) if self.history is not None else None
+
+    # The median and 90th percentile wait in seconds of each tier that has been taken off the queue,
+    # as (tier, median, p90) sorted by tier
+    def wait_times(self) -> List[Tuple[str, float, float]]:
+        if self.history is None:
+            return []
+        return [(tier, stats.median.value(), stats.p90.value()) for tier, stats in sorted(self.history.stats.tiers.items())]
+
+    # The current version of the queue, for several reads that have to agree with each other
+    def snapshot(self) -> QueueSnapshot:
+        return self._snapshot
+
+    # Whether the queue is at its maximum length. This doesn't take the lock, so it can be used
+    # to turn joins away cheaply, but push checks again
+    def full(self) -> bool:
+        return self.max_length is not None and len(self._nodes) >= self.max_length
+
+    # Start a join cooldown for a player, returning 0 if they were allowed to join or else the
+    # seconds until they are. Doesn't take the lock
+    def join_cooldown(self, name: str) -> float:
+        if self.cooldown is None:
+            return 0
+        return self.cooldown.start(name)
+
+    # Method to push a name and tier to the end of the queue (or to its place for its tier, in
+    # priority mode), if neither the identity nor the name is already in it. Without an identity,
+    # one is made from the name. Returns the player's position if added, ALREADY_QUEUED if it was
+    # already there, NAME_TAKEN if another player has its name, or QUEUE_FULL if the queue is
+    # full, unless ignore_limit is set
+    def push(self, name: str, tier: str, identity: Optional[str] = None, ignore_limit: bool = False) -> int:
+        with self.lock:
+            if self._find(name, identity) is not None:
+                return ALREADY_QUEUED
+            # Names must be unique too, since admins give players by name
+            if name_key(name) in self._names:
+                return NAME_TAKEN
+            if not ignore_limit and self.full():
+                return QUEUE_FULL
+
+            identity = identity or name_identity(name)
+            key = self._priority_key(tier) if self.priority else self._back_key()
+            node = _Node(key, sys.intern(identity), sys.intern(name), tier, time.time())
+            self._link(node)
+            self._log('push', name, tier, node.key, identity, int(node.joined))
+
+            pos = _rank(self._root, key) + 1 if self.priority else len(self._nodes)
+            self._changed(pos <= self.print_limit, ('push', pos - 1, node.name, tier))
+            return pos
+
+    # Method to get the next name in the queue and remove it. Returns the tuple (name, tier)
+    # if the queue is not empty, otherwise returns None
+    def pop(self) -> Union[Tuple[str, str], Tuple[None, None]]:
+        with self.lock:
+            node = _first(self._root)
+            if node is None:
+                return (None, None)
+
+            self._unlink(node)
+            self._log('pop', node.name, node.identity)
+            self._changed(True, ('pop',))
+            if self.history is not None:
+                self.history.record(node.name, node.tier, node.joined, time.time())
+            return (node.name, node.tier)
+
+    # Method to remove a player from the queue, by identity if given or else by name. Returns
+    # true if the player was in the queue, otherwise returns false
+    def remove(self, name: str, identity: Optional[str] = None) -> bool:
+        with self.lock:
+            node = self._find(name, identity)
+            if node is None:
+                return False
+
+            index = _rank(self._root, node.key)
+            self._unlink(node)
+            self._log('remove', node.name, node.identity)
+            self._changed(index < self.print_limit, ('remove', index))
+            return True
+
+    # Method to get the next name and tier in the queue without removing it. Returns the name
+    # if the queue is not empty, otherwise returns None
+    def next(self) -> Union[Tuple[str, str], None]:
+        return self._snapshot.first()
+
+    # Method to move a name to a different position in the queue. Defaults to position 1 (index 0)
+    # Returns True if the move was successful, otherwise returns False
+    def promote(self, name: str, pos: int = 1) -> bool:
+        with self.lock:
+            if pos > len(self._nodes) or pos < 1:
+                # out of bounds
+                return False
+
+            node = self._names.get(name_key(name))
+            if node is None:
+                return False
+
+            index = _rank(self._root, node.key)
+            self._root = _remove(self._root, node.key)
+
+            # Find the neighbours of the new position among the remaining players
+            i = pos - 1
+            if i == 0:
+                key = self._front_key()
+            elif i == _size(self._root) and not self.priority:
+                key = self._back_key()
+            elif i == _size(self._root):
+                # Just behind the last player, rather than at a time, so whether later joiners go
+                # ahead depends only on their tier and not on the second they join in
+                key = _at(self._root, i - 1).key + (0,)
+            else:
+                key = _key_between(_at(self._root, i - 1).key, _at(self._root, i).key)
+
+            moved = _Node(key, node.identity, node.name, node.tier, node.joined)
+            self._link(moved)
+            self._log('promote', node.name, node.tier, key, node.identity)
+            self._changed(index < self.print_limit or pos <= self.print_limit, ('promote', index, pos - 1))
+            return True
+
+    # Method to clear the queue
+    def clear(self):
+        with self.lock:
+            self._root = None
+            self._nodes.clear()
+            self._names.clear()
+            self._head = 0
+            self._tail = 0
+            self._log('clear')
+            self._changed(True, ('clear',))
+
+    # Method to generate a comma separated list of the current queue. Unless full is set, only the
+    # first print_limit names are listed
+    def listing(self, full: bool = False) -> str:
+        if not full:
+            return self._listing
+
+        snapshot = self._snapshot
+        version, text = self._full_listing
+        if version == snapshot.version:
+            return text
+
+        text = ', '.join(name for _, name, _ in snapshot.entries())
+        self._full_listing = (snapshot.version, text)
+        return text
+
+    def __str__(self) -> str:
+        return self._listing
+
+    # Get (name, tier) for at most count players, starting at a 0-based position
+    def slice(self, start: int, count: int) -> List[Tuple[str, str]]:
+        return self._snapshot.slice(start, count)
+
+    # Get (name, tier) for the players on a 1-based page of print_limit players, and the number
+    # of pages, as of the same moment
+    def page(self, number: int) -> Tuple[List[Tuple[str, str]], int]:
+        snapshot = self._snapshot
+        pages = -(-len(snapshot) // self.print_limit)
+        return snapshot.slice((number - 1) * self.print_limit, self.print_limit), pages
+
+    # Iterate over (position, name, tier) for every player, as the queue was when iteration started
+    def entries(self) -> Iterator[Tuple[int, str, str]]:
+        return self._snapshot.entries()
+
+    # Write every player to a file as CSV, chunk_size rows at a time. Returns how many were written
+    def export(self, f: TextIO, chunk_size: int = 1000) -> int:
+        writer = csv.writer(f)
+        writer.writerow(('position', 'name', 'tier'))
+        entries = self.entries()
+        count = 0
+        while True:
+            chunk = list(itertools.islice(entries, chunk_size))
+            if not chunk:
+                return count
+            writer.writerows(chunk)
+            count += len(chunk)
+
+    # --------------- Helpers (lock must be held) ---------------
+
+    # Publish a new version of the queue, rebuilding the listing's names if any of them changed,
+    # and the delta that made it to the feed
+    def _changed(self, head_changed: bool, delta: Optional[tuple] = None):
+        self.version += 1
+        self._snapshot = QueueSnapshot(self.version, self._root)
+        if self.feed is not None and delta is not None:
+            self.feed.publish(self.version, delta)
+
+        if head_changed:
+            self._listing_head = ', '.join(node.name for node in _range(self._root, 0, self.print_limit))
+
+        if len(self._nodes) > self.print_limit:
+            self._listing = self._listing_head + f",+{len(self._nodes)-self.print_limit} more..."
+        else:
+            self._listing = self._listing_head
+
+    def _log(self, *record):
+        if self.journal is not None:
+            self.journal.append(*record)
+
+    # Rebuild the queue from the journal's recovered state
+    def _restore(self):
+        if self.journal.user_level is not None:
+            self.user_level = UserLevel[self.journal.user_level]
+        else:
+            self._log('level', self.user_level.name)
+
+        # Players from journals written before join times were kept count as joining now
+        now = time.time()
+        nodes = [_Node(key, sys.intern(identity), sys.intern(name), tier, joined if joined is not None else now)
+                for key, identity, name, tier, joined in self.journal.recovered()]
+        for node in nodes:
+            self._nodes[node.identity] = node
+            self._names[name_key(node.name)] = node
+        self._root = _build(nodes)
+
+        if self._nodes:
+            self._head = nodes[0].key[0]
+            self._tail = max(node.key[0] for node in self._nodes.values()) + 1
+        self._changed(True)
+
+    # Find a player by identity, or by name if there is no identity. A player with an identity can
+    # also find an entry that was added by their name alone, but not another account's entry with
+    # the same name. A player found by identity whose name has changed is renamed, so the listing
+    # stays current
+    def _find(self, name: str, identity: Optional[str]) -> Optional[_Node]:
+        node = self._lookup(name, identity)
+        if node is not None and node.identity == identity and node.name != name:
+            node = self._rename(node, name)
+        return node
+
+    # The finding part of _find, which doesn't change anything, so readers can use it without the lock
+    def _lookup(self, name: str, identity: Optional[str]) -> Optional[_Node]:
+        if identity is not None:
+            node = self._nodes.get(identity)
+            if node is not None:
+                return node
+
+        node = self._names.get(name_key(name))
+        if node is not None and identity is not None and node.identity != name_identity(node.name):
+            return None
+        return node
+
+    # Give a player a new name, returning their new node. Nodes can't change once published, so
+    # the player is moved to a new node with the same key
+    def _rename(self, node: _Node, name: str) -> _Node:
+        key = name_key(name)
+        other = self._names.get(key)
+        if other is not None and other is not node:
+            # Someone else in the queue already has the new name, so keep the old one
+            return node
+
+        # The dictionaries are overwritten rather than emptied first, so readers always find the
+        # player under one name or the other
+        renamed = _Node(node.key, node.identity, sys.intern(name), node.tier, node.joined)
+        self._names[key] = renamed
+        self._nodes[node.identity] = renamed
+        if name_key(node.name) != key:
+            del self._names[name_key(node.name)]
+        self._root = _insert(_remove(self._root, node.key), renamed)
+        self._log('rename', node.identity, name)
+        index = _rank(self._root, node.key)
+        self._changed(index < self.print_limit, ('rename', index, renamed.name))
+        return renamed
+
+    def _link(self, node: _Node):
+        self._nodes[node.identity] = node
+        self._names[name_key(node.name)] = node
+        self._root = _insert(self._root, node)
+
+    def _unlink(self, node: _Node):
+        del self._nodes[node.identity]
+        del self._names[name_key(node.name)]
+        self._root = _remove(self._root, node.key)
+
+    def _back_key(self) -> tuple:
+        key = (self._tail,)
+        self._tail += 1
+        return key
+
+    def _front_key(self) -> tuple:
+        self._head -= 1
+        return (self._head,)
+
+    # Key for a player joining in priority mode: their join time, moved earlier by the wait their
+    # tier is worth, with a sequence number to keep keys unique. Manual promotes are keyed around
+    # these, so they keep their place as other players join
+    def _priority_key(self, tier: str) -> tuple:
+        score = time.time() - _tier_level(tier) * self.tier_wait
+        self._head = min(self._head, math.floor(score))
+        self._tail = max(self._tail, math.floor(score) + 1)
+        return (score, next(self._seq))
@@ -0,0 +1,35 @@
+from typing import List
+
+# Identities of players, so one person can't hold two places in a queue.
+#
+# A player's identity is the stable id of the account they joined with, such as 'twitch:1234' or
+# 'discord:5678', so it survives a change of display name. A Twitch account can be linked to a
+# Discord account so that both have the same identity. Players added by name alone get an
+# identity made from their case folded name.
+
+# Form of a name used to compare names, ignoring case
+def name_key(name: str) -> str:
+    return name.casefold()
+
+def name_identity(name: str) -> str:
+    return 'name:' + name.casefold()
+
+class IdentityLinks():
+    # links is a list of {'twitch': Twitch user id, 'discord': Discord user id}
+    def __init__(self, links: List[dict] = ()):
+        self._canonical = {} # Discord identity -> linked Twitch identity
+        for link in links:
+            self.link(link['twitch'], link['discord'])
+
+    def __len__(self) -> int:
+        return len(self._canonical)
+
+    def link(self, twitch_id, discord_id):
+        self._canonical[f"discord:{discord_id}"] = f"twitch:{twitch_id}"
+
+    def twitch(self, user_id) -> str:
+        return f"twitch:{user_id}"
+
+    def discord(self, user_id) -> str:
+        identity = f"discord:{user_id}"
+        return self._canonical.get(identity, identity)
@@ -0,0 +1,310 @@
+from collections import deque
+from threading import Thread, Event, Lock
+from typing import Iterator, Optional
+import json
+import gc
+import os
+
+from identity import name_identity
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # Windows, which has msvcrt's locks instead
+    import msvcrt
+
+# Write-ahead journal for the GameQueue.
+#
+# Every queue operation is appended to an in-memory buffer by the queue itself. A background
+# JournalWriter thread drains the buffer, writes the records to the journal file and fsyncs once
+# per batch (group commit), so callers never wait on the disk. One writer can serve the journals
+# of many queues. The journal also keeps a copy of the queue state built from the records it has
+# written, which lets it write a snapshot and start a fresh journal without ever touching the
+# live queue.
+#
+# Records store the result of an operation (the identity, name and order key of the player), not the
+# request, so replaying a record twice has no extra effect. This is what makes it safe to crash
+# between writing a snapshot and truncating the journal.
+#
+# Journals start with a FORMAT record. Replay only handles records in the current format, so it
+# does no per-record checks. A journal without one was written by an older version. Its records
+# are upgraded as it is loaded, and it is compacted as soon as it is started, so that only happens
+# once.
+#
+# Only one process can have a journal open. Its directory is locked for as long as the journal is
+# open, since two processes appending to and compacting the same journal would corrupt it.
+
+SNAPSHOT_FILE = 'snapshot.json'
+JOURNAL_FILE = 'journal.log'
+LOCK_FILE = 'journal.lock'
+FORMAT = ['format', 2]
+
+# Characters of the journal parsed at a time when recovering
+PARSE_CHUNK = 1 << 18
+
+# Raised when another process has the journal open
+class JournalLocked(RuntimeError):
+    pass
+
+# Lock a journal directory, returning the lock file, which holds the lock until it is closed. The
+# lock goes away with the process, however it exits
+def _lock_directory(directory: str):
+    f = open(os.path.join(directory, LOCK_FILE), 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        raise JournalLocked(f"The journal in {directory} is in use by another process. To run the bots in "
+                "separate processes, give them a queue_server to share the queues through")
+    return f
+
+# Background thread that flushes a set of journals
+class JournalWriter():
+    def __init__(self, flush_interval: float = 0.05):
+        self.flush_interval = flush_interval
+
+        self._journals = []
+        self._lock = Lock() # held while flushing, and while journals are added or removed
+        self._wake = Event()
+        self._stopped = False
+        self._thread = None
+
+    def add(self, journal: 'Journal'):
+        with self._lock:
+            self._journals.append(journal)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='journal-writer', daemon=True)
+                self._thread.start()
+
+    # Stop flushing a journal, after writing out anything still buffered
+    def remove(self, journal: 'Journal'):
+        with self._lock:
+            self._journals.remove(journal)
+            journal.flush()
+
+    # Write out everything still buffered and stop the thread
+    def close(self):
+        if self._thread is None:
+            return
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._flush_all()
+        self._flush_all()
+
+    def _flush_all(self):
+        with self._lock:
+            for journal in self._journals:
+                journal.flush()
+
+class Journal():
+    def __init__(self, directory: str, flush_interval: float = 0.05, compact_every: int = 100_000):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+
+        self._pending = deque()
+        self._writer = None
+        self._own_writer = False
+        self._file = None
+        self._since_compact = 0
+        self._upgraded = False # whether the journal was in an older format, so needs compacting
+        self._lock_file = None
+
+        # State rebuilt from disk. entries maps identity -> (key, name, tier, time joined or None)
+        self.entries = {}
+        self.user_level = None
+        self._load()
+
+    # --------------- Recovery ---------------
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = _lock_directory(self.directory)
+
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            self.user_level = snapshot['user_level']
+            for entry in snapshot['entries']:
+                name, tier, key = entry[:3]
+                # Snapshots from before identities or join times were kept have neither
+                identity = entry[3] if len(entry) > 3 else name_identity(name)
+                joined = entry[4] if len(entry) > 4 else None
+                self.entries[identity] = (tuple(key), name, tier, joined)
+        except FileNotFoundError:
+            pass
+
+        try:
+            with open(self.journal_path, 'r') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = ''
+
+        # Replaying creates millions of small objects, and the cyclic garbage collector would
+        # otherwise run many times over them, so it is paused until recovery is done
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for records in self._parse(data):
+                if self._since_compact == 0 and records and records[0] != FORMAT:
+                    self._upgraded = True
+                if self._upgraded:
+                    records = [self._upgrade(record) for record in records]
+                self._since_compact += len(records)
+                self._replay(records)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    # Parse the journal a chunk of whole lines at a time, so each chunk's records can be replayed
+    # and freed while they are still in the CPU cache, which is much faster than parsing it all in
+    # one go. A crash can leave a partial last line, which is dropped
+    @staticmethod
+    def _parse(data: str) -> Iterator[list]:
+        last = data.rfind('\n')
+        start = 0
+        while start < last:
+            end = data.rfind('\n', start, start + PARSE_CHUNK)
+            if end < start:
+                end = data.find('\n', start + PARSE_CHUNK) # a line longer than a chunk
+            chunk = data[start:end]
+            start = end + 1
+
+            try:
+                yield json.loads('[' + chunk.replace('\n', ',') + ']')
+            except ValueError:
+                # Corruption somewhere in the middle, so keep every record up to the first bad one
+                records = []
+                for line in chunk.split('\n'):
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+                yield records
+                return
+
+    # Bring a record written by an older version up to the current format. Records written before
+    # identities were kept end after the name, and the identity is made from the name. Pushes
+    # written before join times were kept end after the identity
+    @staticmethod
+    def _upgrade(record: list) -> list:
+        op = record[0]
+        if op in ('push', 'promote') and len(record) == 4:
+            record.append(name_identity(record[1]))
+        elif op in ('pop', 'remove') and len(record) == 2:
+            record.append(name_identity(record[1]))
+        if op == 'push' and len(record) == 5:
+            record.append(None)
+        return record
+
+    # Apply records to the recovered state. Keys are left as they were parsed, as lists, and only
+    # made tuples for the players that are left. Promotes keep the join time the player already had
+    def _replay(self, records: list):
+        entries = self.entries
+        for record in records:
+            op = record[0]
+            if op == 'push':
+                entries[record[4]] = (record[3], record[1], record[2], record[5])
+            elif op == 'promote':
+                entry = entries.get(record[4])
+                entries[record[4]] = (record[3], record[1], record[2], entry[3] if entry is not None else None)
+            elif op == 'pop' or op == 'remove':
+                entries.pop(record[2], None)
+            elif op == 'rename':
+                entry = entries.get(record[1])
+                if entry is not None:
+                    entries[record[1]] = (entry[0], record[2], entry[2], entry[3])
+            elif op == 'clear':
+                entries.clear()
+            elif op == 'level':
+                self.user_level = record[1]
+
+    # Get the recovered queue as a list of (key, identity, name, tier, time joined or None) in queue order
+    def recovered(self) -> list:
+        return sorted((tuple(key), identity, name, tier, joined) for identity, (key, name, tier, joined) in self.entries.items())
+
+    # --------------- Writing ---------------
+
+    # Start writing records in the background, with the given writer or a writer of its own
+    def start(self, writer: Optional[JournalWriter] = None):
+        self._file = open(self.journal_path, 'a')
+        if self._upgraded:
+            self._compact()
+        elif self._file.tell() == 0:
+            self._start_file()
+        if writer is None:
+            writer = JournalWriter(self.flush_interval)
+            self._own_writer = True
+        self._writer = writer
+        writer.add(self)
+
+    # Add a record to be written. Never blocks on the disk
+    def append(self, *record):
+        self._pending.append(record)
+
+    # Write out anything still buffered, stop writing and unlock the directory
+    def close(self):
+        if self._writer is not None:
+            self._writer.remove(self)
+            if self._own_writer:
+                self._writer.close()
+            self._writer = None
+            self._file.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    # Write buffered records to disk. Only called from the writer thread, or once it has let go
+    def flush(self):
+        if not self._pending:
+            return
+
+        records = []
+        while self._pending:
+            records.append(self._pending.popleft())
+
+        self._file.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        self._replay(records)
+
+        self._since_compact += len(records)
+        if self._since_compact >= self.compact_every:
+            self._compact()
+
+    # Write a snapshot of the current state and start a fresh journal
+    def _compact(self):
+        snapshot = {'user_level': self.user_level,
+                'entries': [[name, tier, key, identity, joined] for identity, (key, name, tier, joined) in self.entries.items()]}
+
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        self._file.close()
+        self._file = open(self.journal_path, 'w')
+        self._start_file()
+        self._since_compact = 0
+        self._upgraded = False
+
+    def _start_file(self):
+        self._file.write(json.dumps(FORMAT, separators=(',', ':')) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
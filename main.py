@@ -1,167 +1,202 @@
-import discord_bot
-import twitch_bot
-
-from typing import Union, Tuple
-from threading import Lock, Thread
-from enum import Enum
+import time
+START = time.perf_counter() # for timing startup, so taken before anything else is imported
+
+from change_feed import FeedServer
+from journal import JournalLocked
+from metrics import metrics
+from queue_commands import registry
+from queue_manager import QueueManager
+from queue_server import QueueClient, QueueServer, RemoteQueueManager
+from settings_reload import SettingsReloader
+import argparse
+import asyncio
+import config
 import json
+import sys
+
+# Run the enabled bots on the current event loop until one of them is told to shut down. Each
+# bot's module is only imported if it is run, since discord.py takes a while to import
+async def run_bots(queues, settings, ready, path=None, only=config.PLATFORMS):
+    platforms = config.enabled_platforms(settings)
+    twitch = None
+    discord_bot = None
+
+    async def shutdown():
+        if twitch is not None:
+            twitch.close()
+        if discord_bot is not None:
+            await discord_bot.bot.close()
+
+    def apply(platform, section):
+        if platform == 'twitch' and twitch is not None:
+            twitch.apply_settings(section)
+        elif platform == 'discord' and discord_bot is not None:
+            discord_bot.apply_settings(section)
+
+    reloader = SettingsReloader(settings, apply, path, only)
+
+    runs = []
+    if 'twitch' in platforms:
+        import twitch_bot
+        twitch = twitch_bot.TwitchBot(queues, settings['twitch'], shutdown)
+        twitch.on_ready = lambda: ready('Twitch')
+        twitch.on_reload = reloader.reload
+        runs.append(twitch.run())
+    if 'discord' in platforms:
+        import discord_bot
+        runs.append(discord_bot.run(queues, settings['discord'], shutdown, lambda: ready('Discord'),
+                reloader.reload))
+
+    # The settings file is watched in the background for as long as the bots run
+    background = start_services(queues, settings)
+    if settings['reload_interval'] > 0:
+        background.append(asyncio.ensure_future(reloader.watch(settings['reload_interval'])))
 
-UserLevel = Enum('UserLevel', 'MOD SUPPORTER EVERYONE')
-
-class GameQueue():
-    def __init__(self, sub_only):
-        self.print_limit = 10
-
-        self.user_level = UserLevel.SUPPORTER if sub_only else UserLevel.EVERYONE
-        self.queue = []
-        self.lock = Lock()
-
-    # Method to set the queue's user level using a string, returning whether or not it was done successfully
-    def set_user_level(self, level: str) -> bool:
-        with self.lock:
-            if level == 'MOD':
-                self.user_level = UserLevel.MOD
-                return True
-            if level == 'SUPPORTER':
-                self.user_level = UserLevel.SUPPORTER
-                return True
-            if level == 'EVERYONE':
-                self.user_level = UserLevel.EVERYONE
-                return True
-            return False
-
-    # Method to find a user's position in the queue. Returns -1 if user not found
-    def user_pos(self, user: str) -> int:
-        with self.lock:
-            for i, (name, _) in enumerate(self.queue):
-                if name == user:
-                    return i
-
-            return -1
-
-    # Method to push a name and tier to the end of the queue, if it is not already in it.
-    # Returns the length of the queue if added, or -1 if it was already there
-    def push(self, name: str, tier: str) -> int:
-        with self.lock:
-            if name in self.queue:
-                return -1
-
-            self.queue.append((name, tier))
-            return len(self.queue)
-
-    # Method to get the next name in the queue and remove it. Returns the tuple (name, tier)
-    # if the queue is not empty, otherwise returns None
-    def pop(self) -> Union[Tuple[str, str], Tuple[None, None]]:
-        with self.lock:
-            if len(self.queue) == 0:
-                return (None, None)
-
-            return self.queue.pop(0)
-
-    # Method to remove a name from the queue. Returns true if the name was in the queue,
-    # otherwise returns false
-    def remove(self, name: str) -> bool:
-        with self.lock:
-            for i, (n, _) in enumerate(self.queue):
-                if n == name:
-                    self.queue.pop(i)
-                    return True
-
-            return False
-
-    # Method to get the next name and tier in the queue without removing it. Returns the name
-    # if the queue is not empty, otherwise returns None
-    def next(self) -> Union[Tuple[str, str], None]:
-        with self.lock:
-            if len(self.queue) == 0:
-                return None
-            return self.queue[0]
-
-    # Method to move a name to a different position in the queue. Defaults to position 1 (index 0)
-    # Returns True if the move was successful, otherwise returns False
-    def promote(self, name: str, pos: int = 1) -> bool:
-        with self.lock:
-            if pos > len(self.queue):
-                # out of bounds
-                return False
-
-            for i, user in enumerate(self.queue):
-                if user[0] == name:
-                    self.queue.pop(i)
-                    self.queue.insert(pos - 1, user)
-                    return True
-            return False
-
-    # Method to clear the queue
-    def clear(self):
-        with self.lock:
-            self.queue.clear()
-
-    # Method to generate a comma separated list of the current queue
-    def __str__(self) -> str:
-        with self.lock:
-            if len(self.queue) > self.print_limit:
-                return ', '.join([user[0] for user in self.queue[:self.print_limit]]) + f",+{len(self.queue)-self.print_limit} more..."
-            return ', '.join([user[0] for user in self.queue])
-
-if __name__ == '__main__':
-    settings = None
     try:
-        # Try to load existing settings
-        with open('settings.json', 'r') as f:
-            settings = json.load(f)
-            print('Successfully loaded settings\n')
-    except:
-        # Failed to load settings, so prompt user for them and save to file
-        print('No settings file found')
-
-        twitch_settings = {}
-        twitch_settings['bot_name'] = input('Enter name of the bot on twitch: ')
-        twitch_settings['token'] = input('Enter your twitch TMI token: ')
-        twitch_settings['channel'] = input('Enter name of the twitch channel for the bot to run in: ')
-        print('Using default settings for twitch admin and supporter badges')
-        twitch_settings['admin_badges'] = ['broadcaster', 'moderator']
-        twitch_settings['supporter_badges'] = ['subscriber']
-        can_join = input('Should users be able to join the queue from twitch chat [y/n]? ')
-        twitch_settings['can_join'] = can_join.lower()[0] == 'y'
-
-        disc_settings = {}
-        disc_settings['token'] = input('Enter discord bot token: ')
-        print('Using default settings for discord admin and supporter roles')
-        disc_settings['admin_roles'] = ['Admin', 'mod']
-        disc_settings['supporter_roles'] = ['Twitch Subscriber', 'Patron', 'Youtube Member']
-        print('Using default tier map')
-        disc_settings['tier_map'] = {'Twitch Subscriber: Tier 1': 1,
-                'Twitch Subscriber: Tier 2' : 2,
-                'Twitch Subscriber: Tier 3': 3,
-                'Patron': 1,
-                'Patreon Tier 2': 2,
-                'Patreon Tier 3': 3,
-                'YouTube Member: Supporter': 1}
-        can_join = input('Should users be able to join the queue from discord [y/n]? ')
-        print('Allowing queue to be joinable from all channels')
-        disc_settings['join_channels'] = []
-        disc_settings['can_join'] = can_join.lower()[0] == 'y'
-
-        settings = {'twitch': twitch_settings, 'discord': disc_settings}
-        with open('settings.json', 'w') as f:
-            json.dump(settings, f, indent=4)
-            print('Successfully saved settings to settings.json\n')
-
-    assert settings is not None, 'Error initializing settings'
-
-    # Convert admin roles/badges to sets
-    settings['twitch']['admin_badges'] = set(settings['twitch']['admin_badges'])
-    settings['discord']['admin_roles'] = set(settings['discord']['admin_roles'])
-
-    # Make supporter roles/badges include admins
-    settings['twitch']['supporter_badges'] = settings['twitch']['admin_badges'].union(settings['twitch']['supporter_badges'])
-    settings['discord']['supporter_roles'] = settings['discord']['admin_roles'].union(settings['discord']['supporter_roles'])
+        await asyncio.gather(*runs)
+    finally:
+        for task in background:
+            task.cancel()
+        registry.close()
+        metrics.dump_profile()
+
+# Serve the queues to bots in other processes until interrupted
+async def serve_queues(queues, settings):
+    server_config = settings['queue_server']
+    background = start_services(queues, settings)
+    try:
+        await QueueServer(queues).serve(server_config['host'], server_config['port'])
+    finally:
+        for task in background:
+            task.cancel()
+        metrics.dump_profile()
+
+# Serve and log metrics, and serve the change feed if the queues are held by this process, in the
+# background. Returns the tasks
+def start_services(queues, settings) -> list:
+    background = []
+    metrics_config = settings.get('metrics', {})
+    if metrics.enabled and metrics_config.get('port') is not None:
+        background.append(asyncio.ensure_future(
+                metrics.serve(metrics_config.get('host', '127.0.0.1'), metrics_config['port'])))
+    if metrics.enabled and metrics_config.get('log_interval') is not None:
+        background.append(asyncio.ensure_future(metrics.log_every(metrics_config['log_interval'])))
+    feed_config = settings.get('feed')
+    if feed_config is not None and not queues.remote:
+        feed = FeedServer(queues, feed_config['history'])
+        background.append(asyncio.ensure_future(feed.serve(feed_config['host'], feed_config['port'])))
+    return background
+
+# Ask for the settings on the command line and save them to path
+def setup_interactively(path):
+    print('No settings file found')
+
+    twitch_settings = {}
+    twitch_settings['bot_name'] = input('Enter name of the bot on twitch: ')
+    twitch_settings['token'] = input('Enter your twitch TMI token: ')
+    twitch_settings['channel'] = input('Enter name of the twitch channel for the bot to run in: ')
+    print('Using default settings for twitch admin and supporter badges')
+    twitch_settings['admin_badges'] = ['broadcaster', 'moderator']
+    twitch_settings['supporter_badges'] = ['subscriber']
+    can_join = input('Should users be able to join the queue from twitch chat [y/n]? ')
+    twitch_settings['can_join'] = can_join.lower()[0] == 'y'
+
+    disc_settings = {}
+    disc_settings['token'] = input('Enter discord bot token: ')
+    print('Using default settings for discord admin and supporter roles')
+    disc_settings['admin_roles'] = ['Admin', 'mod']
+    disc_settings['supporter_roles'] = ['Twitch Subscriber', 'Patron', 'Youtube Member']
+    print('Using default tier map')
+    disc_settings['tier_map'] = {'Twitch Subscriber: Tier 1': 1,
+            'Twitch Subscriber: Tier 2' : 2,
+            'Twitch Subscriber: Tier 3': 3,
+            'Patron': 1,
+            'Patreon Tier 2': 2,
+            'Patreon Tier 3': 3,
+            'YouTube Member: Supporter': 1}
+    can_join = input('Should users be able to join the queue from discord [y/n]? ')
+    print('Allowing queue to be joinable from all channels')
+    disc_settings['join_channels'] = []
+    disc_settings['can_join'] = can_join.lower()[0] == 'y'
 
     sub_only = input('Is this queue for subscribers/patrons only? [y/n] ')
-    queue = GameQueue(sub_only.lower()[0] == 'y')
 
-    twitch_thread = Thread(target=twitch_bot.start, args=(queue, settings['twitch'],))
-    twitch_thread.start()
+    settings = {'twitch': twitch_settings, 'discord': disc_settings, 'sub_only': sub_only.lower()[0] == 'y'}
+    with open(path, 'w') as f:
+        json.dump(settings, f, indent=4)
+        print(f"Successfully saved settings to {path}\n")
 
-    discord_bot.start(queue, settings['discord']) 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the queue bots')
+    parser.add_argument('--config', help=f"settings file. Defaults to ${config.ENV_PATH} or {config.DEFAULT_PATH}")
+    parser.add_argument('--only', choices=config.PLATFORMS, help='run only one of the bots')
+    parser.add_argument('--non-interactive', action='store_true',
+            help='never prompt for settings, even if there are none')
+    parser.add_argument('--check', action='store_true', help='check the settings and exit')
+    parser.add_argument('--queue-server', action='store_true',
+            help='hold the queues and serve them to bots run in other processes, instead of running the bots')
+    args = parser.parse_args()
+    platforms = [args.only] if args.only else config.PLATFORMS
+
+    try:
+        settings = config.load(args.config, platforms)
+        if settings is None:
+            path = config.settings_path(args.config)
+            if args.non_interactive or args.check or not sys.stdin.isatty():
+                raise config.ConfigError([f"No settings found in {path} "
+                        f"or {config.ENV_PREFIX}* environment variables"])
+            setup_interactively(path)
+            settings = config.load(args.config, platforms)
+    except config.ConfigError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    server_config = settings.get('queue_server')
+    if args.queue_server and server_config is None:
+        print('--queue-server needs a queue_server section in the settings', file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Settings loaded for {', '.join(config.enabled_platforms(settings))}")
+    if args.check:
+        sys.exit(0)
+
+    # Metrics have to be set up before anything they instrument is created
+    metrics.configure(settings.get('metrics'))
+
+    if server_config is not None and not args.queue_server:
+        # The bots run as workers, using the queues held by the queue server
+        client = QueueClient(server_config['host'], server_config['port'], server_config['connections'])
+        queues = RemoteQueueManager(client)
+        queues.load(settings)
+        print(f"Using {len(queues.queues)} queues served on {server_config['host']}:{server_config['port']}")
+    else:
+        # Create every queue, restoring them from the journals left by the last run, if any
+        queues = QueueManager(settings['journal_dir'], threadsafe=False)
+        try:
+            queues.load(settings)
+        except JournalLocked as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        for name, queue in queues.queues.items():
+            print(f"Loaded queue {name} with {len(queue)} players at user level {queue.user_level.name}")
+
+    reported = set()
+    def ready(platform):
+        if platform not in reported:
+            reported.add(platform)
+            print(f"{platform} bot ready {time.perf_counter() - START:.2f}s after starting")
+
+    # All bots share one event loop. The loop is the default one since the discord bot is bound
+    # to it when it is created
+    loop = asyncio.get_event_loop()
+    try:
+        if args.queue_server:
+            # The queue server runs until it is interrupted, since no bot can tell it to shut down
+            try:
+                loop.run_until_complete(serve_queues(queues, settings))
+            except KeyboardInterrupt:
+                print('Stopping the queue server')
+        else:
+            loop.run_until_complete(run_bots(queues, settings, ready, args.config, platforms))
+    finally:
+        queues.close()
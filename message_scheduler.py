@@ -0,0 +1,162 @@
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+import time
+
+# Outbound message scheduler for chat platforms with a per-bot message rate limit.
+#
+# Messages are queued for a target (such as a channel) instead of sent straight away, and drain()
+# hands back the messages that can be sent now without going over the limit, which is shared by
+# every target. Admin replies go in a priority lane that is always drained first. Per-user replies
+# of the same kind (such as join confirmations) are coalesced while they wait, so a burst of 40
+# joins becomes one or two messages instead of 40.
+#
+# Messages can carry an origin, which is handed to on_sent once the message is drained, so callers
+# can time replies from end to end.
+#
+# Messages wait in the scheduler for as long as the bot can't send them, such as while it is
+# reconnecting. With max_depth set, the oldest normal messages are dropped to make room once that
+# many are waiting, since they are the least likely to still be useful.
+#
+# The scheduler is not thread safe; submit and drain must be called from the same thread.
+
+class TokenBucket():
+    def __init__(self, rate: int, per: float, now: float):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.last = now
+
+    # Take a token if one is available, returning whether one was taken
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.fill_rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+# A set of replies waiting to be sent as one message
+class _Group():
+    __slots__ = ('prefix', 'items', 'origins')
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.items = [] # (full message, short item)
+        self.origins = [] # origins of the items that have one
+
+    # Build the messages to send, splitting the items over several messages if needed
+    def render(self, max_length: int) -> List[str]:
+        if len(self.items) == 1:
+            return [self.items[0][0]]
+
+        messages = []
+        current = self.prefix
+        for _, item in self.items:
+            if current != self.prefix:
+                if len(current) + 2 + len(item) > max_length:
+                    messages.append(current)
+                    current = self.prefix
+                else:
+                    current += ', '
+            current += item
+        messages.append(current)
+        return messages
+
+class MessageScheduler():
+    def __init__(self, rate: int = 20, per: float = 30.0, max_length: int = 500,
+            max_depth: Optional[int] = None, clock: Callable[[], float] = time.monotonic):
+        self.max_length = max_length
+        self.max_depth = max_depth
+        self.clock = clock
+        self.bucket = TokenBucket(rate, per, clock())
+
+        # Lanes hold (time queued, target, message or group, origin)
+        self.priority = deque()
+        self.normal = deque()
+        self._groups = {} # (target, prefix) -> group still waiting in the normal lane
+
+        # Called with the origin of each message as it is drained
+        self.on_sent: Optional[Callable] = None
+
+        # Stats
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.latency_avg = 0.0
+        self.latency_max = 0.0
+
+    # Number of messages waiting to be sent
+    def depth(self) -> int:
+        return len(self.priority) + len(self.normal)
+
+    # Queue a message. Priority messages are sent before any normal message
+    def submit(self, target: str, message: str, priority: bool = False, origin=None):
+        self._make_room()
+        lane = self.priority if priority else self.normal
+        lane.append((self.clock(), target, message, origin))
+
+    # Queue a reply that can be merged with other waiting replies to the same target with the same
+    # prefix. If it is sent on its own, message is sent, otherwise item is added to a list after
+    # the prefix
+    def submit_grouped(self, target: str, prefix: str, message: str, item: str, origin=None):
+        group = self._groups.get((target, prefix))
+        if group is None:
+            self._make_room()
+            group = _Group(prefix)
+            self._groups[(target, prefix)] = group
+            self.normal.append((self.clock(), target, group, None))
+        else:
+            self.coalesced += 1
+        group.items.append((message, item))
+        if origin is not None:
+            group.origins.append(origin)
+
+    # Get the (target, message) pairs that can be sent now without going over the rate limit
+    def drain(self) -> List[Tuple[str, str]]:
+        now = self.clock()
+        out = []
+        while (self.priority or self.normal) and self.bucket.take(now):
+            lane = self.priority if self.priority else self.normal
+            queued_at, target, message, origin = lane.popleft()
+
+            origins = (origin,) if origin is not None else ()
+            if isinstance(message, _Group):
+                del self._groups[(target, message.prefix)]
+                origins = message.origins
+                messages = message.render(self.max_length)
+                message = messages[0]
+                # Anything that didn't fit in this message waits at the front of the lane
+                for rest in reversed(messages[1:]):
+                    lane.appendleft((queued_at, target, rest, None))
+
+            out.append((target, message))
+            self._record_latency(now - queued_at)
+            if self.on_sent is not None:
+                for origin in origins:
+                    self.on_sent(origin)
+        return out
+
+    # Drop the oldest message if the scheduler is full, preferring a normal one
+    def _make_room(self):
+        if self.max_depth is None or self.depth() < self.max_depth:
+            return
+        lane = self.normal if self.normal else self.priority
+        _, target, message, _ = lane.popleft()
+        if isinstance(message, _Group):
+            del self._groups[(target, message.prefix)]
+            self.dropped += len(message.items)
+        else:
+            self.dropped += 1
+
+    def _record_latency(self, latency: float):
+        self.sent += 1
+        self.latency_avg += (latency - self.latency_avg) * 0.1
+        self.latency_max = max(self.latency_max, latency)
+
+    def stats(self) -> dict:
+        return {'depth': self.depth(),
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'latency_avg': self.latency_avg,
+                'latency_max': self.latency_max}
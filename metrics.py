@@ -0,0 +1,224 @@
+from bisect import bisect_left
+from typing import Callable, Optional
+import asyncio
+import cProfile
+import random
+import time
+
+# Built-in instrumentation for the bots.
+#
+# Everything is recorded in the module's Metrics instance, `metrics`, which is disabled until
+# configure is called with metrics turned on in the settings. Instrumented code checks
+# metrics.enabled before doing any work, and the queue lock is only wrapped in a TimedLock when
+# metrics are on, so a disabled instance costs one attribute lookup per command.
+#
+# The recorded values can be served as Prometheus text from a local HTTP endpoint, printed
+# periodically, or both. A fraction of command handler calls can also be run under cProfile.
+
+# Upper bounds of the histogram buckets, in seconds
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+        0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram():
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last count is for values above every bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Estimate a quantile as the upper bound of the bucket it falls in
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+# Wrapper around a lock (or nullcontext) that records how long it was waited for and held
+class TimedLock():
+    __slots__ = ('lock', 'wait', 'hold', 'acquired')
+
+    def __init__(self, lock, wait: Histogram, hold: Histogram):
+        self.lock = lock
+        self.wait = wait
+        self.hold = hold
+        self.acquired = 0.0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.__enter__()
+        # Only the holder writes acquired, so it is safe to keep on the wrapper
+        self.acquired = time.perf_counter()
+        self.wait.observe(self.acquired - start)
+
+    def __exit__(self, *exc):
+        self.hold.observe(time.perf_counter() - self.acquired)
+        return self.lock.__exit__(*exc)
+
+def _format_labels(labels: tuple, extra: str = '') -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+class Metrics():
+    def __init__(self):
+        self.enabled = False
+
+        self._help = {} # metric name -> (type, help text)
+        self._histograms = {} # (name, labels) -> histogram
+        self._gauges = {} # (name, labels) -> function returning the current value, for gauges and counters
+
+        # Sampling profiler for command handlers
+        self.profile_rate = 0.0
+        self.profile_path = None
+        self._profiler = None
+
+    # Turn metrics on or off from the 'metrics' settings. Must be called before the queues and
+    # bots are created, since they only instrument themselves when metrics are enabled
+    def configure(self, settings: Optional[dict]):
+        settings = settings or {}
+        self.enabled = settings.get('enabled', False)
+        self.profile_rate = settings.get('profile_rate', 0.0) if self.enabled else 0.0
+        self.profile_path = settings.get('profile_path', 'commands.prof')
+        self._profiler = cProfile.Profile() if self.profile_rate > 0 else None
+
+    # Get the histogram with the given name and labels, creating it if needed
+    def histogram(self, name: str, help: str, **labels) -> Histogram:
+        key = (name, tuple(labels.items()))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            self._help.setdefault(name, ('histogram', help))
+            histogram = Histogram()
+            self._histograms[key] = histogram
+        return histogram
+
+    # Register a function that reports a value whenever metrics are collected
+    def gauge(self, name: str, help: str, fn: Callable[[], float], **labels):
+        self._help.setdefault(name, ('gauge', help))
+        self._gauges[(name, tuple(labels.items()))] = fn
+
+    # Register a function that reports a total that only goes up, such as a count of dropped messages
+    def counter(self, name: str, help: str, fn: Callable[[], float], **labels):
+        self._help.setdefault(name, ('counter', help))
+        self._gauges[(name, tuple(labels.items()))] = fn
+
+    def timed_lock(self, lock, queue: str) -> TimedLock:
+        return TimedLock(lock,
+                self.histogram('queue_lock_wait_seconds', 'Time spent waiting for a queue lock', queue=queue),
+                self.histogram('queue_lock_hold_seconds', 'Time a queue lock was held', queue=queue))
+
+    # --------------- Command Hooks ---------------
+
+    # Run a command handler, recording how long it took from when the command was received.
+    # Replies sent by the handler carry the command's origin so reply_sent can time them
+    def run_handler(self, command, caller, args: list):
+        caller.origin = (command.name, caller.received)
+        if self._profiler is not None and random.random() < self.profile_rate:
+            self._profiler.enable()
+            try:
+                command.handler(caller, *args)
+            finally:
+                self._profiler.disable()
+        else:
+            command.handler(caller, *args)
+
+        self.histogram('queue_command_handle_seconds', 'Time from receiving a command to handling it',
+                command=command.name).observe(time.perf_counter() - caller.received)
+
+    # Called by the outbound queues once a reply to a command has been sent
+    def reply_sent(self, origin: tuple):
+        name, received = origin
+        self.histogram('queue_command_reply_seconds', 'Time from receiving a command to sending its reply',
+                command=name).observe(time.perf_counter() - received)
+
+    # --------------- Output ---------------
+
+    # Render every metric in the Prometheus text format
+    def render(self) -> str:
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, help = self._help[name]
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), fn in sorted(self._gauges.items()):
+            describe(name)
+            lines.append(f"{name}{_format_labels(labels)} {fn()}")
+
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            describe(name)
+            total = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                total += count
+                bucket = _format_labels(labels, f'le="{bound}"')
+                lines.append(f"{name}_bucket{bucket} {total}")
+            bucket = _format_labels(labels, 'le="+Inf"')
+            lines.append(f"{name}_bucket{bucket} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    # Short human readable summary, for the log
+    def summary(self) -> str:
+        lines = []
+        for (name, labels), fn in sorted(self._gauges.items()):
+            lines.append(f"  {name}{_format_labels(labels)}: {fn()}")
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            if histogram.count == 0:
+                continue
+            lines.append(f"  {name}{_format_labels(labels)}: {histogram.count} samples, "
+                    f"mean {histogram.sum / histogram.count * 1000:.3f}ms, "
+                    f"p50 <= {histogram.quantile(0.5) * 1000:.3f}ms, p99 <= {histogram.quantile(0.99) * 1000:.3f}ms")
+        return '\n'.join(lines)
+
+    # Write out the profile of the sampled command handlers, if profiling
+    def dump_profile(self):
+        if self._profiler is not None:
+            self._profiler.dump_stats(self.profile_path)
+
+    # Serve the metrics over HTTP on the current event loop. Every request gets the metrics,
+    # whatever its path
+    async def serve(self, host: str = '127.0.0.1', port: int = 9100):
+        async def handle(reader, writer):
+            try:
+                # Read up to the end of the request headers
+                while (await reader.readline()).strip():
+                    pass
+                body = self.render().encode()
+                writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                        + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+    # Print a summary every interval seconds
+    async def log_every(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            print('Metrics:\n' + self.summary())
+            self.dump_profile()
+
+metrics = Metrics()
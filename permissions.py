@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from typing import NamedTuple
+
+# Cache of each Discord member's permissions, computed from their roles.
+#
+# Entries are keyed by guild and member id and kept in least recently used order. Each entry
+# remembers the ids of the roles it was computed from, and is only used while the member still has
+# exactly those roles. The role ids come with every message, so checking them is cheap, and a
+# member who loses a role loses what it gave them on their next command even if the bot never
+# hears about the change. Member update events, when the bot gets them, drop entries early.
+# Renaming or deleting a role drops every entry. When the role settings change, only the entries
+# of members with a role whose meaning changed are dropped.
+
+class Permissions(NamedTuple):
+    is_admin: bool
+    is_supporter: bool
+    tier: int
+
+# Users messaging the bot directly aren't guild members, so have no roles
+def role_fingerprint(member) -> frozenset:
+    return frozenset(role.id for role in getattr(member, 'roles', ()))
+
+def _member_key(member) -> tuple:
+    guild = getattr(member, 'guild', None)
+    return (guild.id if guild is not None else None, member.id)
+
+class PermissionCache():
+    def __init__(self, settings: dict, max_size: int = 4096):
+        self.max_size = max_size
+        self._set_roles(settings)
+
+        self._entries = OrderedDict() # member key -> (role fingerprint, role names, permissions)
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, member) -> Permissions:
+        key = _member_key(member)
+        fingerprint = role_fingerprint(member)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == fingerprint:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[2]
+
+        self.misses += 1
+        names = frozenset(role.name for role in getattr(member, 'roles', ()))
+        permissions = self.compute(names)
+        self._entries[key] = (fingerprint, names, permissions)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return permissions
+
+    # Work out a member's permissions from the names of their roles
+    def compute(self, names: frozenset) -> Permissions:
+        tier = max((self.tier_map.get(name, 0) for name in names), default=0)
+        return Permissions(not self.admin_roles.isdisjoint(names),
+                not self.supporter_roles.isdisjoint(names),
+                tier)
+
+    # Drop a member's entry if their roles changed
+    def member_updated(self, before, after):
+        key = _member_key(after)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] != role_fingerprint(after):
+            del self._entries[key]
+
+    # Switch to new role settings, dropping the entries of members with a role that was added to
+    # or removed from the admin or supporter roles, or whose tier changed. Returns how many
+    # entries were dropped
+    def update_settings(self, settings: dict) -> int:
+        old_admin, old_supporter, old_tiers = self.admin_roles, self.supporter_roles, self.tier_map
+        self._set_roles(settings)
+
+        changed = (old_admin ^ self.admin_roles) | (old_supporter ^ self.supporter_roles)
+        changed |= {name for name in old_tiers.keys() | self.tier_map.keys()
+                if old_tiers.get(name, 0) != self.tier_map.get(name, 0)}
+        if not changed:
+            return 0
+
+        stale = [key for key, (_, names, _) in self._entries.items() if not changed.isdisjoint(names)]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+    def _set_roles(self, settings: dict):
+        self.admin_roles = frozenset(settings['admin_roles'])
+        self.supporter_roles = frozenset(settings['supporter_roles'])
+        self.tier_map = dict(settings['tier_map'])
+
+    def invalidate(self, member):
+        self._entries.pop(_member_key(member), None)
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,304 @@
+from collections import deque
+from typing import Dict, Iterator, Optional, Tuple
+import argparse
+import bisect
+import mmap
+import os
+import struct
+import time
+
+# History of the players taken off a queue, and estimates of how long players wait.
+#
+# Every pop is recorded as (joined_at, served_at, session, tier, name) in an append-only file of
+# fixed size records, where session counts the times the bot has started. Records are buffered in
+# memory and written by the journal writer thread, so a pop never waits on the disk. Since every
+# record is the same size, record i is at a known offset, and the file is read through mmap a
+# chunk at a time. When the bot starts it only reads the newest records, to warm up its estimates,
+# and HistoryReader answers queries about the last few sessions by binary searching for where they
+# start, so neither reads the whole file.
+#
+# WaitStats keeps estimates that are updated with each pop in O(1): per tier, a moving average of
+# the wait and estimates of its median and 90th percentile, and a moving average of the time
+# between pops, which gives a player's ETA from their position.
+
+HISTORY_FILE = 'history.bin'
+MAGIC = b'QHIST001'
+RECORD = struct.Struct('<ddI8s64s') # joined_at, served_at, session, tier, name
+SESSION = struct.Struct('<I')
+SESSION_OFFSET = 16
+
+# Records read at a time
+CHUNK = 4096
+
+# Newest records read when the bot starts, to warm up the estimates
+WARM_UP = 500
+
+# Weight of each new sample in the moving averages
+WAIT_ALPHA = 0.1
+INTERVAL_ALPHA = 0.2
+
+# Gaps between pops longer than this are breaks, not time spent playing
+MAX_INTERVAL = 30 * 60
+
+# Gaps between pops seen before an ETA is given
+MIN_INTERVALS = 3
+
+# --------------- Estimates ---------------
+
+# Streaming estimate of one quantile using the P² algorithm (Jain and Chlamtac, 1985), which
+# keeps five markers whose heights are adjusted as samples arrive, instead of the samples
+class P2Quantile():
+    def __init__(self, p: float):
+        self.p = p
+        self.heights = [] # the samples themselves until there are five
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float):
+        q = self.heights
+        if len(q) < 5:
+            bisect.insort(q, x)
+            return
+
+        # Find the cell the sample falls in, stretching the ends to fit it
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x) - 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards where they should be
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self) -> Optional[float]:
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:
+            return q[round(self.p * (len(q) - 1))]
+        return q[2]
+
+class TierStats():
+    __slots__ = ('count', 'average', 'median', 'p90')
+
+    def __init__(self):
+        self.count = 0
+        self.average = 0.0 # moving average of the wait, in seconds
+        self.median = P2Quantile(0.5)
+        self.p90 = P2Quantile(0.9)
+
+    def add(self, wait: float):
+        self.count += 1
+        self.average = wait if self.count == 1 else self.average + (wait - self.average) * WAIT_ALPHA
+        self.median.add(wait)
+        self.p90.add(wait)
+
+class WaitStats():
+    def __init__(self):
+        self.tiers: Dict[str, TierStats] = {}
+        self.interval = 0.0 # moving average of the time between pops, in seconds
+        self.intervals = 0
+        self.last_served = None
+
+    def add(self, tier: str, joined_at: float, served_at: float):
+        stats = self.tiers.get(tier)
+        if stats is None:
+            stats = self.tiers[tier] = TierStats()
+        stats.add(max(0.0, served_at - joined_at))
+
+        if self.last_served is not None and 0 <= served_at - self.last_served <= MAX_INTERVAL:
+            gap = served_at - self.last_served
+            self.intervals += 1
+            self.interval = gap if self.intervals == 1 else self.interval + (gap - self.interval) * INTERVAL_ALPHA
+        self.last_served = served_at
+
+    # Estimated seconds until the player at a 1-based position is taken off the queue, or None if
+    # there haven't been enough pops to tell
+    def eta(self, position: int, now: float) -> Optional[float]:
+        if self.intervals < MIN_INTERVALS:
+            return None
+        # Time already spent on the current player counts towards the wait, unless it's a break
+        since = now - self.last_served
+        if since > MAX_INTERVAL:
+            since = 0.0
+        return max(0.0, position * self.interval - since)
+
+# --------------- Reading ---------------
+
+def _unpack(record: tuple) -> Tuple[str, str, float, float, int]:
+    joined_at, served_at, session, tier, name = record
+    return (name.rstrip(b'\0').decode('utf-8', 'ignore'), tier.rstrip(b'\0').decode('utf-8', 'ignore'),
+            joined_at, served_at, session)
+
+# Read-only view of a history file. Records are (name, tier, joined_at, served_at, session)
+class HistoryReader():
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._count = max(0, (size - len(MAGIC)) // RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else None
+        if self._map is None or self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a play history file")
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self) -> 'HistoryReader':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    # Iterate over the records from index start up to stop, a chunk at a time
+    def records(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple[str, str, float, float, int]]:
+        stop = self._count if stop is None else min(stop, self._count)
+        view = memoryview(self._map)
+        try:
+            for chunk in range(start, stop, CHUNK):
+                end = min(chunk + CHUNK, stop)
+                data = view[len(MAGIC) + chunk * RECORD.size:len(MAGIC) + end * RECORD.size]
+                for record in RECORD.iter_unpack(data):
+                    yield _unpack(record)
+                data.release()
+        finally:
+            view.release()
+
+    def session(self, i: int) -> int:
+        return SESSION.unpack_from(self._map, len(MAGIC) + i * RECORD.size + SESSION_OFFSET)[0]
+
+    # Index of the first record of the last `sessions` sessions. Sessions only go up through the
+    # file, so this is a binary search over the session of each record
+    def sessions_start(self, sessions: int) -> int:
+        if self._count == 0:
+            return 0
+        first = self.session(self._count - 1) - sessions + 1
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.session(mid) < first:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Number of players and their average wait in seconds for each tier, over the last `sessions`
+    # sessions or the whole history
+    def average_waits(self, sessions: Optional[int] = None) -> Dict[str, Tuple[int, float]]:
+        start = 0 if sessions is None else self.sessions_start(sessions)
+        totals = {}
+        for _, tier, joined_at, served_at, _ in self.records(start):
+            count, total = totals.get(tier, (0, 0.0))
+            totals[tier] = (count + 1, total + max(0.0, served_at - joined_at))
+        return {tier: (count, total / count) for tier, (count, total) in totals.items()}
+
+# --------------- Writing ---------------
+
+class PlayHistory():
+    # Keep the history in a file at path, or with no path, only keep the estimates
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.stats = WaitStats()
+        self.session = 1
+
+        self._pending = deque()
+        self._writer = None
+        self._file = None
+        if path is not None:
+            self._load()
+
+    # Continue the file at path, warming up the estimates from its newest records
+    def _load(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            with open(self.path, 'wb') as f:
+                f.write(MAGIC)
+
+        with HistoryReader(self.path) as reader:
+            count = len(reader)
+            if count > 0:
+                self.session = reader.session(count - 1) + 1
+            for _, tier, joined_at, served_at, _ in reader.records(max(0, count - WARM_UP)):
+                self.stats.add(tier, joined_at, served_at)
+
+        # A crash can leave a partial last record, which is dropped
+        os.truncate(self.path, len(MAGIC) + count * RECORD.size)
+
+    # Start writing records in the background with the journal writer
+    def start(self, writer):
+        if self.path is None:
+            return
+        self._file = open(self.path, 'ab')
+        self._writer = writer
+        writer.add(self)
+
+    # Record a player being taken off the queue. Never blocks on the disk
+    def record(self, name: str, tier: str, joined_at: float, served_at: float):
+        self.stats.add(tier, joined_at, served_at)
+        if self._file is not None:
+            self._pending.append(RECORD.pack(joined_at, served_at, self.session,
+                    tier.encode('utf-8')[:8], name.encode('utf-8')[:64]))
+
+    # Estimated seconds until the player at a 1-based position is taken off the queue
+    def eta(self, position: int) -> Optional[float]:
+        return self.stats.eta(position, time.time())
+
+    # Write buffered records to disk. Only called from the writer thread, or once it has let go.
+    # A lost record only makes the estimates a little less informed, so unlike the journal the
+    # file isn't fsynced
+    def flush(self):
+        records = []
+        while self._pending:
+            records.append(self._pending.popleft())
+        if records:
+            self._file.write(b''.join(records))
+            self._file.flush()
+
+    # Write out anything still buffered and stop writing
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.remove(self)
+        self._writer = None
+        self._file.close()
+
+# Print the average wait of each tier from a history file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show how long players waited in a queue')
+    parser.add_argument('path', help=f"history file, {HISTORY_FILE} in the queue's journal directory")
+    parser.add_argument('--sessions', type=int, help='only count the last this many sessions')
+    args = parser.parse_args()
+
+    with HistoryReader(args.path) as reader:
+        waits = reader.average_waits(args.sessions)
+        print(f"{len(reader)} players served")
+        for tier, (count, average) in sorted(waits.items()):
+            print(f"  {'tier ' + tier if tier else 'no tier'}: {count} players, average wait {average / 60:.1f} minutes")
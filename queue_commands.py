@@ -0,0 +1,211 @@
+from command_registry import Arg, Caller, CommandRegistry, Permission
+from game_queue import ALREADY_QUEUED, NAME_TAKEN, QUEUE_FULL
+import io
+
+# The queue commands, shared by the Twitch and Discord bots
+
+COMMANDS_URL = 'https://github.com/dylanross620/OGC-DiscordBot/blob/master/README.md'
+
+# Longest name an admin can add. Twitch names are at most 25 characters and Discord names 32
+MAX_NAME_LENGTH = 32
+
+registry = CommandRegistry()
+
+# Format a number of seconds for chat, to the nearest minute
+def format_wait(seconds: float) -> str:
+    minutes = round(seconds / 60)
+    if minutes < 1:
+        return 'under a minute'
+    if minutes < 60:
+        return f"{minutes} minute{'' if minutes == 1 else 's'}"
+    return f"{minutes // 60}h {minutes % 60:02d}m"
+
+# Command to join the queue, if not already in it
+@registry.command('join', help='Joins the current queue')
+def join_queue(caller: Caller):
+    if not caller.settings['can_join']:
+        caller.reply(f"{caller.mention} this queue cannot be joined from {caller.platform}")
+        return
+
+    blocked = caller.join_blocked()
+    if blocked is not None:
+        caller.reply(f"{caller.mention} {blocked}")
+        return
+
+    # Check if the caller is allowed to join at the current user level
+    level = caller.queue.user_level.name
+    if level == 'EVERYONE':
+        allowed = True
+    elif level == 'SUPPORTER':
+        allowed = caller.is_supporter
+    else:
+        allowed = caller.is_admin
+
+    if not allowed:
+        who = caller.supporters if level == 'SUPPORTER' else 'mods'
+        caller.reply(f"{caller.mention} only {who} can join this queue")
+        return
+
+    # Turn away floods before taking the queue's lock. The cooldown only starts once the caller
+    # could otherwise join, so being told to join from somewhere else doesn't hold up a retry
+    wait = caller.queue.join_cooldown(caller.identity)
+    if wait > 0:
+        if not caller.queue.drop_spam:
+            caller.reply(f"{caller.mention} please wait {wait:.0f}s before joining again")
+        return
+    if caller.queue.full():
+        caller.reply(f"{caller.mention} the queue is full")
+        return
+
+    pos = caller.queue.push(caller.name, caller.tier, caller.identity)
+    if pos == ALREADY_QUEUED:
+        caller.reply(f"{caller.mention} is already in the queue")
+    elif pos == NAME_TAKEN:
+        caller.reply(f"{caller.mention} the name {caller.name} is already used by another player in the queue")
+    elif pos == QUEUE_FULL:
+        caller.reply(f"{caller.mention} the queue is full")
+    else:
+        caller.reply_grouped('added: ', f"{caller.mention} has been added to the queue at position {pos}",
+                f"{caller.mention} ({pos})")
+
+@registry.command('pos', help='Get current position in the queue, and roughly how long until your turn')
+def get_pos(caller: Caller):
+    pos = caller.queue.user_pos(caller.name, caller.identity)
+    if pos == -1:
+        caller.reply(f"{caller.mention} is not in the queue")
+        return
+
+    # Positions are shown counting from 1, like the positions players are given when they join
+    pos += 1
+    eta = caller.queue.eta(pos)
+    if eta is None:
+        caller.reply_grouped('positions: ', f"{caller.mention} is in the queue at position {pos}",
+                f"{caller.mention} ({pos})")
+    else:
+        caller.reply_grouped('positions: ', f"{caller.mention} is in the queue at position {pos}, "
+                f"about {format_wait(eta)} to go", f"{caller.mention} ({pos}, ~{format_wait(eta)})")
+
+# Command to show how long players of each tier have usually waited
+@registry.command('waits', help='Shows how long players of each tier usually wait')
+def wait_times(caller: Caller):
+    tiers = caller.queue.wait_times()
+    if not tiers:
+        caller.reply('Nobody has been taken off the queue yet')
+        return
+    waits = ', '.join(f"{'tier ' + tier if tier else 'no tier'} {format_wait(median)} "
+            f"(9 in 10 under {format_wait(p90)})" for tier, median, p90 in tiers)
+    caller.reply(f"Usual waits: {waits}")
+
+# Command to leave the queue, if in it
+@registry.command('leave', help='Leaves the current queue')
+def leave_queue(caller: Caller):
+    if caller.queue.remove(caller.name, caller.identity):
+        caller.reply_grouped('removed: ', f"{caller.mention} has been removed from the queue", caller.mention)
+    else:
+        caller.reply(f"{caller.mention} is not in the queue")
+
+# Command to print out the queue contents, a page at a time after the first page
+@registry.command('queue', args=[Arg('page', int, 1)], help='Prints the current queue, or a page of it')
+def print_queue(caller: Caller, page: int):
+    if page == 1:
+        s = str(caller.queue)
+        if s == '':
+            caller.reply('The queue is empty')
+        else:
+            caller.reply(f"Current queue: {s}")
+        return
+
+    if page < 1:
+        caller.reply('Page must be at least 1')
+        return
+    players, pages = caller.queue.page(page)
+    if not players:
+        caller.reply(f"The queue only has {pages} page{'' if pages == 1 else 's'}")
+        return
+    start = (page - 1) * caller.queue.print_limit
+    names = ', '.join(f"{start + i}. {name}" for i, (name, _) in enumerate(players, 1))
+    caller.reply(f"Queue page {page} of {pages}: {names}")
+
+# Command to list the available commands for everyone
+@registry.command('queuecommands', help='List all available commands')
+def list_commands(caller: Caller):
+    caller.reply(f"The commands for this bot can be found at {COMMANDS_URL}")
+
+# --------------- Admin Commands ---------------
+
+# Command to get the next person in the queue
+@registry.command('next', Permission.ADMIN, help='Gets the next player in the queue. Can only be used by admins')
+def next_player(caller: Caller):
+    player, tier = caller.queue.pop()
+    if player is None:
+        caller.reply('The queue is empty')
+    else:
+        tier_msg = f" at tier {tier}" if len(tier) > 0 else ''
+        caller.reply(f"Up next: {player}{tier_msg}")
+
+# Command to move someone to a different part of the queue
+@registry.command('promote', Permission.ADMIN, [Arg('name'), Arg('position', int, 1)],
+        help='Moves a player to a different position in the queue. Can only be used by admins')
+def promote_player(caller: Caller, name: str, position: int):
+    if caller.queue.promote(name, position):
+        caller.reply(f"{name} is now at position {position} in the queue")
+    else:
+        caller.reply('Unable to update queue. Make sure user and position were valid')
+
+# Command to clear the queue
+@registry.command('clear', Permission.ADMIN, help='Clears the queue. Can only be used by admins')
+def clear_queue(caller: Caller):
+    caller.queue.clear()
+    caller.reply('The queue has successfully been cleared')
+
+# Command to set the userlevel of the queue
+@registry.command('userlevel', Permission.ADMIN, [Arg('level')],
+        help='Sets who can join the queue: mod, supporter or everyone. Can only be used by admins')
+def user_level(caller: Caller, level: str):
+    if caller.queue.set_user_level(level.upper()):
+        caller.reply(f"Successfully set user level to {level}")
+    else:
+        caller.reply(f"Invalid user level {level}")
+
+# Command to add a user to the queue regardless of user level
+@registry.command('add', Permission.ADMIN, [Arg('name')],
+        help='Add player to queue regardless of current user level. Can only be used by admins')
+def add(caller: Caller, name: str):
+    if len(name) > MAX_NAME_LENGTH:
+        caller.reply(f"Names can be at most {MAX_NAME_LENGTH} characters")
+        return
+
+    pos = caller.queue.push(name, '', ignore_limit=True) # Default to no tier
+    if pos == ALREADY_QUEUED:
+        caller.reply(f"{name} is already in the queue")
+    else:
+        caller.reply(f"{name} has been added to the queue at position {pos}")
+
+# Command to remove a player from the queue
+@registry.command('remove', Permission.ADMIN, [Arg('name')], help='Remove a player from the queue. Can only be used by admins')
+def remove(caller: Caller, name: str):
+    if caller.queue.remove(name):
+        caller.reply(f"{name} has been removed from the queue")
+    else:
+        caller.reply(f"{name} was not in the queue")
+
+# Command to get every player in the queue as a CSV file, for platforms that can send files
+@registry.command('export', Permission.ADMIN, help='Sends the whole queue as a CSV file. Can only be used by admins')
+def export_queue(caller: Caller):
+    if not caller.can_send_files:
+        caller.reply(f"The queue can't be exported from {caller.platform}")
+        return
+    f = io.StringIO()
+    count = caller.queue.export(f)
+    caller.reply_file(f"The queue has {count} players", 'queue.csv', f.getvalue())
+
+# Command to reload the settings file without restarting
+@registry.command('reload', Permission.ADMIN, help='Reloads the settings file. Can only be used by admins')
+def reload_settings(caller: Caller):
+    caller.reply(caller.reload_settings())
+
+# Command to easily shutdown the bots
+@registry.command('shutdown', Permission.ADMIN, help='Shuts down the bot. Can only be used by admins')
+def shutdown(caller: Caller):
+    caller.reply('Shutting down')
+    caller.shutdown()
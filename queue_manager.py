@@ -0,0 +1,127 @@
+from typing import List, Optional
+import os
+
+from game_queue import GameQueue
+from identity import IdentityLinks
+from journal import Journal, JournalWriter
+from metrics import metrics
+from play_history import HISTORY_FILE, PlayHistory
+
+# The named queues hosted by this process, and which Twitch channel and Discord channels each one
+# belongs to. Every queue has its own lock and journal, so activity in one never waits on another,
+# and the journals share one writer thread so an idle queue costs little more than its objects.
+
+DEFAULT_QUEUE = 'queue'
+
+# Settings of a queue that are passed straight to GameQueue
+def _queue_options(config: dict) -> dict:
+    return {'priority': config.get('tier_priority', False),
+            'aging': config.get('tier_aging'),
+            'max_length': config.get('max_length'),
+            'join_cooldown': config.get('join_cooldown', 0),
+            'drop_spam': config.get('drop_spam', True)}
+
+class QueueManager():
+    remote = False # whether the queues are held by a queue server in another process
+
+    def __init__(self, journal_dir: Optional[str] = None, threadsafe: bool = True):
+        self.journal_dir = journal_dir
+        self.threadsafe = threadsafe
+
+        self.queues = {} # name -> queue
+        self._twitch = {} # '#channel' -> queue
+        self._discord = {} # (guild id or None, channel name or None) -> queue
+        self._writer = JournalWriter() if journal_dir is not None else None
+
+        # Twitch and Discord accounts that belong to the same person, for every queue
+        self.links = IdentityLinks()
+
+    # Create the queues described by the settings. Older settings files without a 'queues' list
+    # get a single queue for the Twitch channel that every Discord channel uses, or when there is no
+    # Twitch channel, a single queue named DEFAULT_QUEUE
+    def load(self, settings: dict):
+        self.links = IdentityLinks(settings.get('identity_links', []))
+
+        configs = settings.get('queues')
+        if configs is None:
+            twitch = settings.get('twitch')
+            channel = settings.get('queue_channel', twitch['channel'] if twitch is not None else None)
+            channel = channel.lower() if channel is not None else None
+            self.add(channel or DEFAULT_QUEUE, settings.get('sub_only', False), twitch_channel=channel,
+                    discord_default=True, journal_path=self.journal_dir, **_queue_options(settings))
+            return
+
+        for config in configs:
+            self.add(config['name'], config.get('sub_only', False),
+                    twitch_channel=config.get('twitch_channel'),
+                    discord_guild=config.get('discord_guild'),
+                    discord_channels=config.get('discord_channels', []),
+                    discord_default=config.get('discord_default', False) or len(configs) == 1,
+                    **_queue_options(config))
+
+    # Add a queue. It can be joined from a Twitch channel, and from Discord channels in a guild (or
+    # in any guild, if the guild is None). With no channels, it is used for the whole guild, and a
+    # Discord default queue is used where nothing else matches. Any other options are passed to
+    # GameQueue
+    def add(self, name: str, sub_only: bool = False, twitch_channel: Optional[str] = None,
+            discord_guild: Optional[int] = None, discord_channels: List[str] = (),
+            discord_default: bool = False, journal_path: Optional[str] = None, **options) -> GameQueue:
+        if name in self.queues:
+            raise ValueError(f"Duplicate queue name {name}")
+
+        queue = self._create(name, sub_only, journal_path, options)
+        self.queues[name] = queue
+
+        if twitch_channel is not None:
+            self._twitch['#' + twitch_channel.lower().lstrip('#')] = queue
+        for channel in discord_channels:
+            self._discord[(discord_guild, channel)] = queue
+        if discord_guild is not None and not discord_channels:
+            self._discord[(discord_guild, None)] = queue
+        if discord_default:
+            self._discord[(None, None)] = queue
+        return queue
+
+    # Create a queue with its journal and history
+    def _create(self, name: str, sub_only: bool, journal_path: Optional[str], options: dict) -> GameQueue:
+        journal = None
+        if self.journal_dir is not None:
+            journal = Journal(journal_path or os.path.join(self.journal_dir, name))
+
+        queue = GameQueue(sub_only, journal, self.threadsafe, **options)
+        queue.history = PlayHistory(os.path.join(journal.directory, HISTORY_FILE) if journal is not None else None)
+        if journal is not None:
+            journal.start(self._writer)
+            queue.history.start(self._writer)
+
+        if metrics.enabled:
+            queue.lock = metrics.timed_lock(queue.lock, name)
+            metrics.gauge('queue_length', 'Players in the queue', queue.__len__, queue=name)
+        return queue
+
+    def get(self, name: str) -> Optional[GameQueue]:
+        return self.queues.get(name)
+
+    def twitch_channels(self) -> List[str]:
+        return list(self._twitch)
+
+    def for_twitch(self, channel: str) -> Optional[GameQueue]:
+        return self._twitch.get(channel)
+
+    # Find the queue for a Discord channel, trying the most specific match first
+    def for_discord(self, guild_id: Optional[int], channel_name: Optional[str]) -> Optional[GameQueue]:
+        for key in ((guild_id, channel_name), (None, channel_name), (guild_id, None), (None, None)):
+            queue = self._discord.get(key)
+            if queue is not None:
+                return queue
+        return None
+
+    # Write out every journal and stop the journal writer
+    def close(self):
+        for queue in self.queues.values():
+            if queue.journal is not None:
+                queue.journal.close()
+            if queue.history is not None:
+                queue.history.close()
+        if self._writer is not None:
+            self._writer.close()
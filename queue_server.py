@@ -0,0 +1,328 @@
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from threading import Lock, Thread
+from typing import List, Optional, Tuple, Union
+import asyncio
+import io
+import itertools
+import json
+import socket
+import time
+
+from backoff import Backoff
+from game_queue import GameQueue, UserLevel
+from queue_manager import QueueManager
+
+# Queue server, so the bots can run in separate processes, or on separate hosts, from the queues.
+#
+# One process holds the queues, with their journals, history and change feed, and serves them
+# over TCP with QueueServer. Bot processes use a RemoteQueueManager, whose queues are RemoteQueue
+# proxies with the same methods as GameQueue, so the commands run unchanged. Each call waits for
+# its answer, so the bots run commands on a thread of their own rather than the event loop (see
+# CommandRegistry.dispatch_threaded). Without a queue server, the bots use the queues in their own
+# process as before.
+#
+# Requests and responses are lines of JSON: [id, queue name, method, args] is answered with
+# [id, result], or [id, None, error]. Requests on a connection are run in order, but a client
+# doesn't have to wait for one response before sending the next request (pipelining): the server
+# runs everything it has read and sends the responses back in one write. QueueClient keeps a pool
+# of connections that are shared by every thread using it, matching responses to requests by id.
+
+# Seconds a call waits for its response before the queue counts as unavailable
+CALL_TIMEOUT = 2.0
+
+# Seconds to wait for a connection to the server
+CONNECT_TIMEOUT = 1.0
+
+# Raised by a RemoteQueue when the queue server can't be reached
+class QueueUnavailable(ConnectionError):
+    pass
+
+# Raised by a RemoteQueue when the call failed on the server
+class QueueServerError(RuntimeError):
+    pass
+
+# --------------- Server ---------------
+
+def _export(queue: GameQueue) -> Tuple[int, str]:
+    f = io.StringIO()
+    count = queue.export(f)
+    return count, f.getvalue()
+
+def _settings(queue: GameQueue) -> dict:
+    return {'print_limit': queue.print_limit, 'drop_spam': queue.drop_spam, 'max_length': queue.max_length}
+
+# Everything a client can call, as functions of the queue and the call's arguments
+METHODS = {name: getattr(GameQueue, name) for name in ('push', 'pop', 'remove', 'next', 'promote', 'clear',
+        'user_pos', 'full', 'join_cooldown', 'set_user_level', 'listing', 'slice', 'page', 'eta', 'wait_times')}
+METHODS['len'] = len
+METHODS['user_level'] = lambda queue: queue.user_level.name
+METHODS['settings'] = _settings
+METHODS['export'] = _export
+
+class QueueServer():
+    def __init__(self, queues: QueueManager):
+        self.queues = queues
+        self.clients = 0
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 9300):
+        server = await asyncio.start_server(self._handle, host, port)
+        print(f"Serving {len(self.queues.queues)} queues on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        writer.transport.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.clients += 1
+        buffer = b''
+        try:
+            while True:
+                data = await reader.read(1 << 16)
+                if not data:
+                    break
+                lines = (buffer + data).split(b'\n')
+                buffer = lines.pop()
+                writer.write(b''.join(self._run(line) for line in lines))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass # the client went away, or the server is shutting down
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    # Run one request, returning its response line
+    def _run(self, line: bytes) -> bytes:
+        request_id = None
+        try:
+            request_id, name, method, args = json.loads(line)
+            queue = self.queues.get(name)
+            if queue is None:
+                raise KeyError(f"there is no queue named {name}")
+            handler = METHODS.get(method)
+            if handler is None:
+                raise KeyError(f"there is no method {method}")
+            response = [request_id, handler(queue, *args)]
+        except Exception as e:
+            response = [request_id, None, f"{type(e).__name__}: {e}"]
+        return json.dumps(response, separators=(',', ':')).encode('utf-8') + b'\n'
+
+# --------------- Client ---------------
+
+# One connection to the server. Any thread can send on it, and a thread of its own reads the
+# responses and hands each one to the future waiting for it
+class _Connection():
+    def __init__(self, host: str, port: int):
+        self.sock = socket.create_connection((host, port), CONNECT_TIMEOUT)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.closed = False
+        self._send_lock = Lock()
+        self._pending = {} # request id -> future
+        Thread(target=self._read, name='queue-client', daemon=True).start()
+
+    def send(self, request_id: int, data: bytes, future: Future):
+        with self._send_lock:
+            if self.closed:
+                raise QueueUnavailable('The connection to the queue server was lost')
+            self._pending[request_id] = future
+            try:
+                self.sock.sendall(data)
+            except OSError as e:
+                del self._pending[request_id]
+                raise QueueUnavailable(f"Failed to send to the queue server: {e}")
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _read(self):
+        buffer = b''
+        try:
+            while True:
+                data = self.sock.recv(1 << 16)
+                if not data:
+                    break
+                lines = (buffer + data).split(b'\n')
+                buffer = lines.pop()
+                for line in lines:
+                    response = json.loads(line)
+                    future = self._pending.pop(response[0], None)
+                    if future is None:
+                        continue
+                    if len(response) > 2:
+                        future.set_exception(QueueServerError(response[2]))
+                    else:
+                        future.set_result(response[1])
+        except OSError:
+            pass
+        finally:
+            with self._send_lock:
+                self.closed = True
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(QueueUnavailable('The connection to the queue server was lost'))
+            self.sock.close()
+
+class QueueClient():
+    def __init__(self, host: str = '127.0.0.1', port: int = 9300, connections: int = 2):
+        self.host = host
+        self.port = port
+
+        self._pool: List[Optional[_Connection]] = [None] * connections
+        self._next = itertools.count()
+        self._ids = itertools.count()
+
+        # After failing to connect, calls fail straight away until the backoff has passed, rather
+        # than every caller waiting to connect to a server that is down
+        self._lock = Lock()
+        self.backoff = Backoff(0.5, 30)
+        self._retry_at = 0.0
+
+    # Send a request without waiting for its response. Requests can be sent one after another
+    # and their responses waited for later
+    def submit(self, queue: str, method: str, *args) -> Future:
+        request_id = next(self._ids)
+        data = json.dumps([request_id, queue, method, args], separators=(',', ':')).encode('utf-8') + b'\n'
+        future = Future()
+        self._connection(next(self._next) % len(self._pool)).send(request_id, data, future)
+        return future
+
+    # Call a method of a queue on the server and wait for the result
+    def call(self, queue: str, method: str, *args):
+        try:
+            return self.submit(queue, method, *args).result(CALL_TIMEOUT)
+        except FutureTimeout:
+            raise QueueUnavailable('The queue server took too long to respond')
+
+    def close(self):
+        with self._lock:
+            for connection in self._pool:
+                if connection is not None:
+                    connection.close()
+            self._pool = [None] * len(self._pool)
+
+    def _connection(self, i: int) -> _Connection:
+        connection = self._pool[i]
+        if connection is not None and not connection.closed:
+            return connection
+
+        with self._lock:
+            connection = self._pool[i]
+            if connection is not None and not connection.closed:
+                return connection
+            if time.monotonic() < self._retry_at:
+                raise QueueUnavailable('The queue server is unavailable')
+            try:
+                connection = _Connection(self.host, self.port)
+            except OSError as e:
+                self._retry_at = time.monotonic() + self.backoff.next()
+                raise QueueUnavailable(f"Failed to connect to the queue server: {e}")
+            self.backoff.reset()
+            self._pool[i] = connection
+            return connection
+
+# A queue held by the queue server, with the methods of GameQueue that the commands use
+class RemoteQueue():
+    def __init__(self, client: QueueClient, name: str):
+        self.client = client
+        self.name = name
+        self._settings = None # settings of the queue, which only change when the server restarts
+
+    def _call(self, method: str, *args):
+        return self.client.call(self.name, method, *args)
+
+    def _setting(self, name: str):
+        if self._settings is None:
+            self._settings = self._call('settings')
+        return self._settings[name]
+
+    @property
+    def print_limit(self) -> int:
+        return self._setting('print_limit')
+
+    @property
+    def drop_spam(self) -> bool:
+        return self._setting('drop_spam')
+
+    @property
+    def max_length(self) -> Optional[int]:
+        return self._setting('max_length')
+
+    @property
+    def user_level(self) -> UserLevel:
+        return UserLevel[self._call('user_level')]
+
+    def __len__(self) -> int:
+        return self._call('len')
+
+    def __str__(self) -> str:
+        return self._call('listing')
+
+    def set_user_level(self, level: str) -> bool:
+        return self._call('set_user_level', level)
+
+    def user_pos(self, user: str, identity: Optional[str] = None) -> int:
+        return self._call('user_pos', user, identity)
+
+    def full(self) -> bool:
+        return self._call('full')
+
+    def join_cooldown(self, name: str) -> float:
+        return self._call('join_cooldown', name)
+
+    def push(self, name: str, tier: str, identity: Optional[str] = None, ignore_limit: bool = False) -> int:
+        return self._call('push', name, tier, identity, ignore_limit)
+
+    def pop(self) -> Union[Tuple[str, str], Tuple[None, None]]:
+        return tuple(self._call('pop'))
+
+    def remove(self, name: str, identity: Optional[str] = None) -> bool:
+        return self._call('remove', name, identity)
+
+    def next(self) -> Union[Tuple[str, str], None]:
+        player = self._call('next')
+        return tuple(player) if player is not None else None
+
+    def promote(self, name: str, pos: int = 1) -> bool:
+        return self._call('promote', name, pos)
+
+    def clear(self):
+        self._call('clear')
+
+    def listing(self, full: bool = False) -> str:
+        return self._call('listing', full)
+
+    def slice(self, start: int, count: int) -> List[Tuple[str, str]]:
+        return [tuple(player) for player in self._call('slice', start, count)]
+
+    def page(self, number: int) -> Tuple[List[Tuple[str, str]], int]:
+        players, pages = self._call('page', number)
+        return [tuple(player) for player in players], pages
+
+    def eta(self, position: int) -> Optional[float]:
+        return self._call('eta', position)
+
+    def wait_times(self) -> List[Tuple[str, float, float]]:
+        return [tuple(tier) for tier in self._call('wait_times')]
+
+    # The server writes the CSV, so the queue is exported as it was at one moment
+    def export(self, f, chunk_size: int = 1000) -> int:
+        count, text = self._call('export')
+        f.write(text)
+        return count
+
+# The queues of the settings, held by a queue server. Channels are matched to queues from the
+# settings, in the same way as by QueueManager
+class RemoteQueueManager(QueueManager):
+    remote = True
+
+    def __init__(self, client: QueueClient):
+        QueueManager.__init__(self)
+        self.client = client
+
+    def _create(self, name: str, sub_only: bool, journal_path: Optional[str], options: dict) -> RemoteQueue:
+        return RemoteQueue(self.client, name)
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,192 @@
+from collections import deque
+from typing import Callable, List, Optional
+import asyncio
+
+from backoff import Backoff
+
+# Per-channel reply aggregator for the Discord bot.
+#
+# Replies are collected for a short window and then sent to their channel as a single message,
+# one reply per line, so a rush of commands costs one API call per window instead of one per
+# reply. A batch is sent early once it reaches max_replies or would go over max_length.
+# Replies that need to go out straight away (admin commands) should be sent directly instead.
+# Replies can carry an origin, which is handed to on_sent once the reply's message has been sent.
+#
+# Messages that fail to send with an error that is_transient accepts (such as while the bot is
+# reconnecting) go into a bounded outbox instead of being lost. The outbox is retried with
+# backoff, then sent in order at most one message every flush_interval seconds once sending works
+# again. While anything is in the outbox, new messages queue behind it so replies stay in order.
+# Once the outbox holds max_outbox messages, the oldest are dropped. Replies in messages that fail
+# with any other error are dropped too, and all dropped replies are counted in dropped.
+
+# Errors that are worth retrying a send after, for any platform
+def is_transient(error: Exception) -> bool:
+    return isinstance(error, (OSError, asyncio.TimeoutError))
+
+class _Batch():
+    __slots__ = ('channel', 'lines', 'length', 'timer', 'origins')
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.lines = []
+        self.length = 0
+        self.timer = None
+        self.origins = []
+
+# Split lines into messages of at most max_length characters, only breaking lines that are
+# too long to fit in a message on their own
+def split_message(lines: List[str], max_length: int) -> List[str]:
+    messages = []
+    current = ''
+    for line in lines:
+        while len(line) > max_length:
+            if current:
+                messages.append(current)
+                current = ''
+            messages.append(line[:max_length])
+            line = line[max_length:]
+
+        if not current:
+            current = line
+        elif len(current) + 1 + len(line) <= max_length:
+            current += '\n' + line
+        else:
+            messages.append(current)
+            current = line
+
+    if current:
+        messages.append(current)
+    return messages
+
+class ReplyBatcher():
+    def __init__(self, window: float = 0.25, max_length: int = 2000, max_replies: int = 50,
+            max_outbox: int = 1000, flush_interval: float = 0.2):
+        self.window = window
+        self.max_length = max_length
+        self.max_replies = max_replies
+        self.max_outbox = max_outbox
+        self.flush_interval = flush_interval
+
+        self._batches = {} # channel id -> batch waiting to be sent
+        self._outbox = deque() # (channel, message, origins) that failed to send
+        self._retrying = None # task sending the outbox
+        self.backoff = Backoff(1.0, 30.0)
+
+        # Called with the origin of each reply once it has been sent
+        self.on_sent: Optional[Callable] = None
+        # Decides whether a failed send should be retried
+        self.is_transient: Callable[[Exception], bool] = is_transient
+
+        # Stats
+        self.replies = 0
+        self.api_calls = 0
+        self.dropped = 0
+
+    # Number of replies waiting to be sent
+    def depth(self) -> int:
+        return sum(len(batch.lines) for batch in self._batches.values()) + \
+                sum(message.count('\n') + 1 for _, message, _ in self._outbox)
+
+    # Queue a reply to a channel. Returns without waiting for it to be sent
+    async def send(self, channel, message: str, origin=None):
+        self.replies += 1
+
+        batch = self._batches.get(channel.id)
+        if batch is None:
+            batch = _Batch(channel)
+            self._batches[channel.id] = batch
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._send_later, channel.id)
+
+        batch.lines.append(message)
+        batch.length += len(message) + 1
+        if origin is not None:
+            batch.origins.append(origin)
+        if len(batch.lines) >= self.max_replies or batch.length >= self.max_length:
+            batch.timer.cancel()
+            await self._send_batch(channel.id)
+
+    # Send a reply straight away, without batching. It still waits behind the outbox
+    async def send_now(self, channel, message: str, origin=None):
+        self.replies += 1
+        await self._send(channel, message, [origin] if origin is not None else [])
+
+    # Send every waiting batch now. Messages that are in the outbox stay there
+    async def flush(self):
+        for channel_id in list(self._batches):
+            self._batches[channel_id].timer.cancel()
+            await self._send_batch(channel_id)
+
+    def _send_later(self, channel_id):
+        asyncio.ensure_future(self._send_batch(channel_id))
+
+    async def _send_batch(self, channel_id):
+        batch = self._batches.pop(channel_id, None)
+        if batch is None:
+            return
+
+        messages = split_message(batch.lines, self.max_length)
+        for i, message in enumerate(messages):
+            # The origins are reported with the last message of the batch
+            await self._send(batch.channel, message, batch.origins if i == len(messages) - 1 else [])
+
+    async def _send(self, channel, message: str, origins: list):
+        if self._outbox:
+            self._add_to_outbox(channel, message, origins)
+            return
+
+        self.api_calls += 1
+        try:
+            await channel.send(message)
+        except Exception as e:
+            if self.is_transient(e):
+                print(f"Failed to send reply, will retry: {e}")
+                self._add_to_outbox(channel, message, origins)
+            else:
+                print(f"Failed to send reply: {e}")
+                self._drop(message)
+            return
+        self._sent(origins)
+
+    def _sent(self, origins: list):
+        if self.on_sent is not None:
+            for origin in origins:
+                self.on_sent(origin)
+
+    def _add_to_outbox(self, channel, message: str, origins: list):
+        if len(self._outbox) >= self.max_outbox:
+            _, dropped, _ = self._outbox.popleft()
+            self._drop(dropped)
+        self._outbox.append((channel, message, origins))
+        if self._retrying is None:
+            self._retrying = asyncio.ensure_future(self._send_outbox())
+
+    # Count the replies in a message that won't be sent, one per line
+    def _drop(self, message: str):
+        self.dropped += message.count('\n') + 1
+
+    # Send the outbox in order, backing off while sending fails
+    async def _send_outbox(self):
+        try:
+            await asyncio.sleep(self.backoff.next())
+            while self._outbox:
+                entry = self._outbox[0]
+                channel, message, origins = entry
+                self.api_calls += 1
+                try:
+                    await channel.send(message)
+                except Exception as e:
+                    if self.is_transient(e):
+                        await asyncio.sleep(self.backoff.next())
+                        continue
+                    print(f"Failed to send reply: {e}")
+                    self._drop(message)
+                else:
+                    self.backoff.reset()
+                    self._sent(origins)
+
+                # The message may have been dropped while it was being sent
+                if self._outbox and self._outbox[0] is entry:
+                    self._outbox.popleft()
+                await asyncio.sleep(self.flush_interval)
+        finally:
+            self._retrying = None
@@ -0,0 +1,95 @@
+from typing import Callable, List, Optional
+import asyncio
+import os
+
+import config
+
+# Reloading the settings while the bots run.
+#
+# The settings file is checked for changes every few seconds, and admins can reload it with a
+# command. A new copy of the settings is loaded, checked and compiled before anything is touched,
+# then handed to the bots to swap in with a single assignment each, so a command sees either the
+# old settings or the new ones and never waits on the reload. Settings that need the bots to
+# reconnect or the queues to be rebuilt are left as they were, and a restart is asked for.
+
+# Settings that can change without a restart
+RELOADABLE = {
+    'twitch': ('admin_badges', 'supporter_badges', 'can_join'),
+    'discord': ('admin_roles', 'supporter_roles', 'tier_map', 'join_channels', 'can_join'),
+}
+
+class SettingsReloader():
+    # apply is called with the new settings of each platform that changed, as (platform, settings)
+    def __init__(self, settings: dict, apply: Callable[[str, dict], None], path: Optional[str] = None,
+            platforms=config.PLATFORMS):
+        self.settings = settings
+        self.apply = apply
+        self.path = config.settings_path(path)
+        self.platforms = platforms
+        self._mtime = self._modified()
+
+    # Load the settings again and swap in any that changed. Returns a message describing what
+    # happened, for the log or an admin
+    def reload(self) -> str:
+        try:
+            new = config.load(self.path, self.platforms)
+        except config.ConfigError as e:
+            print(e)
+            return f"Settings not reloaded, {len(e.errors)} problem(s) found. See the log for details"
+        if new is None:
+            return f"Settings not reloaded, {self.path} is missing"
+
+        changed = []
+        restart = []
+        for key in sorted(new.keys() | self.settings.keys()):
+            if key not in RELOADABLE:
+                if new.get(key) != self.settings.get(key):
+                    restart.append(key)
+                continue
+
+            old_section = self.settings.get(key)
+            new_section = new.get(key)
+            if old_section is None or new_section is None:
+                if old_section is not new_section:
+                    restart.append(key)
+                continue
+
+            # Start from the running settings so that only reloadable settings ever change
+            section = dict(old_section)
+            for name in sorted(old_section.keys() | new_section.keys()):
+                if old_section.get(name) == new_section.get(name):
+                    continue
+                if name in RELOADABLE[key]:
+                    section[name] = new_section[name]
+                    changed.append(f"{key}.{name}")
+                else:
+                    restart.append(f"{key}.{name}")
+
+            if section != old_section:
+                self.settings[key] = section
+                self.apply(key, section)
+
+        return _describe(changed, restart)
+
+    # Reload whenever the settings file changes, checking every interval seconds
+    async def watch(self, interval: float = 2.0):
+        while True:
+            await asyncio.sleep(interval)
+            mtime = self._modified()
+            if mtime != self._mtime:
+                self._mtime = mtime
+                print(self.reload())
+
+    def _modified(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+def _describe(changed: List[str], restart: List[str]) -> str:
+    parts = []
+    if changed:
+        parts.append('Reloaded ' + ', '.join(changed))
+    if restart:
+        parts.append('Restart to apply ' + ', '.join(restart))
+    return '. '.join(parts) if parts else 'No settings changed'
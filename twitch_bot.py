@@ -1,188 +1,203 @@
-import irc.bot
-
-class TwitchBot(irc.bot.SingleServerIRCBot):
-    def __init__(self, queue, settings):
-        self.queue = queue
-        self.settings = settings
+from functools import cached_property
+import asyncio
+import time
+
+from command_registry import Caller
+from identity import name_identity
+from message_scheduler import MessageScheduler
+from metrics import metrics
+from queue_commands import registry
+from twitch_irc import IRCClient
+
+# How often queued messages are sent, and how often a backlog is reported, in seconds
+SEND_INTERVAL = 0.1
+BACKLOG_REPORT_INTERVAL = 30
+
+# Most messages kept waiting to be sent, such as while reconnecting. The oldest are dropped beyond this
+MAX_OUTBOX = 1000
+
+# Get the subscription tier from a user's badges as a string, or '' if they aren't subscribed
+def subscriber_tier(badges: dict) -> str:
+    version = badges.get('subscriber')
+    if version is None:
+        return ''
+    if len(version) > 3:
+        # Version in form <tier>00<duration>
+        return version[0]
+    return '1'
+
+class TwitchCaller(Caller):
+    platform = 'Twitch chat'
+    supporters = 'subscribers'
+
+    def __init__(self, bot, queue, msg):
+        Caller.__init__(self, queue, bot.settings)
+        self.bot = bot
+        self.msg = msg
+
+    @cached_property
+    def name(self) -> str:
+        return self.msg.tags.get('display-name') or self.msg.nick
+
+    @cached_property
+    def identity(self) -> str:
+        user_id = self.msg.tags.get('user-id')
+        if not user_id:
+            return name_identity(self.name)
+        return self.bot.queues.links.twitch(user_id)
+
+    @cached_property
+    def mention(self) -> str:
+        return '@' + self.name
+
+    @cached_property
+    def is_admin(self) -> bool:
+        return not self.bot.admin_badges.isdisjoint(self.msg.badges)
+
+    @cached_property
+    def is_supporter(self) -> bool:
+        return not self.bot.supporter_badges.isdisjoint(self.msg.badges)
+
+    @cached_property
+    def tier(self) -> str:
+        return subscriber_tier(self.msg.badges)
+
+    def reply(self, message: str):
+        self.on_loop(self.bot.send_message, self.msg.target, message, self.priority, self.origin)
+
+    def reply_grouped(self, prefix: str, message: str, item: str):
+        self.on_loop(self.bot.send_grouped, self.msg.target, prefix, message, item, self.origin)
+
+    def shutdown(self):
+        self.on_loop(self.bot.shutdown)
+
+    def reload_settings(self) -> str:
+        if self.bot.on_reload is None:
+            return 'Settings can only be reloaded by restarting'
+        return self.on_loop(self.bot.on_reload, wait=True)
+
+class TwitchBot(IRCClient):
+    def __init__(self, queues, settings, on_shutdown=None):
+        self.queues = queues # QueueManager with the queue of each channel
+        self.on_shutdown = on_shutdown # coroutine function that stops every bot
+        self.on_ready = None # function called once the bot has joined its channels
+        self.on_reload = None # function that reloads the settings, returning what changed
 
         token = settings['token']
         if token[:6] != 'oauth:':
             token = 'oauth:' + token
-        self.channel = '#' + settings['channel'].lower()
+        self.channels = queues.twitch_channels()
+
+        self.apply_settings(settings)
 
         # Create IRC bot connection
-        server = 'irc.chat.twitch.tv'
-        port = 6667
+        server = settings.get('server', 'irc.chat.twitch.tv')
+        port = settings.get('port', 6667)
         username = settings['bot_name']
         print('Connecting to ' + server + ' on port ' + str(port) + '...')
-        irc.bot.SingleServerIRCBot.__init__(self, [(server, port, token)], username, username)
+        IRCClient.__init__(self, server, port, username, token)
+
+        # Twitch allows 20 messages per 30 seconds for bots that aren't mods in the channel
+        rate, per = settings.get('message_rate', [20, 30])
+        self.scheduler = MessageScheduler(rate, per, max_depth=MAX_OUTBOX)
+        self.last_backlog_report = 0
+
+        if metrics.enabled:
+            self.scheduler.on_sent = metrics.reply_sent
+            metrics.gauge('queue_outbound_backlog', 'Messages waiting to be sent', self.scheduler.depth,
+                    platform='twitch')
+            metrics.counter('queue_replies_dropped_total',
+                    'Replies dropped because too many were waiting or sending failed',
+                    lambda: self.scheduler.dropped, platform='twitch')
+
+    # Swap in new settings. Only the badges and can_join take effect without reconnecting
+    def apply_settings(self, settings):
+        self.admin_badges = frozenset(settings['admin_badges'])
+        self.supporter_badges = frozenset(settings['supporter_badges'])
+        self.settings = settings
 
-    def on_welcome(self, c, e):
-        print('Joining ' + self.channel)
+    # Run the bot until it is shut down, sending queued messages in the background
+    async def run(self):
+        sender = asyncio.ensure_future(self._send_loop())
+        try:
+            await IRCClient.run(self)
+        finally:
+            sender.cancel()
+
+    async def _send_loop(self):
+        while True:
+            await asyncio.sleep(SEND_INTERVAL)
+            self.send_queued()
+
+    def on_welcome(self, msg):
+        print('Joining ' + ', '.join(self.channels))
 
         # You must request specific capabilities before you can use them
-        c.cap('REQ', ':twitch.tv/membership')
-        c.cap('REQ', ':twitch.tv/tags')
-        c.cap('REQ', ':twitch.tv/commands')
-        c.join(self.channel)
-        self.send_message('Bot online.')
+        self.cap_req('twitch.tv/membership')
+        self.cap_req('twitch.tv/tags')
+        self.cap_req('twitch.tv/commands')
+        # Every channel is joined on the one connection
+        self.join(','.join(self.channels))
+        for channel in self.channels:
+            self.send_message(channel, 'Bot online.')
         print('Twitch bot initialized')
-
-    def send_message(self, message):
-        self.connection.privmsg(self.channel, message)
-
-    def on_pubmsg(self, c, e):
-        # Clean up tags before using them
-        tags = {kvpair['key']: kvpair['value'] for kvpair in e.tags}
-        if 'badges' not in tags or tags['badges'] is None:
-            tags['badges'] = ''
-
-        # If a chat message starts with an exclamation point, try to run it as a command
-        if e.arguments[0][:1] == '!':
-            args = e.arguments[0].split(' ')
-            cmd = args[0][1:].lower()
-            if len(args) > 1:
-                args = args[1:]
-            else:
-                args = []
-            self.do_command(e, cmd, args, tags)
-        return
-
-    def do_command(self, e, cmd, args, tags):
-        c = self.connection
-        badges = tags['badges'].split(',')
-
-        tier = ''
-
-        is_admin = False
-        for b in self.settings['admin_badges']:
-            if b in tags['badges']:
-                is_admin = True
-                break
-
-        for b in badges:
-            if 'subscriber' in b:
-                version = b[b.index('/') + 1:]
-                if len(version) > 3:
-                    # Version in form <tier>00<duration>
-                    tier = version[0]
-                else:
-                    tier = '1'
-                break
-
-        can_join = is_admin or self.queue.user_level.name == 'EVERYONE'
-        can_join |= len(tier) > 0 and self.queue.user_level.name == 'SUPPORTER'
-
-        if cmd == 'join':
-            if not self.settings['can_join']:
-                self.send_message(f"@{tags['display-name']} this queue cannot be joined from Twitch chat")
-                return
-
-            if can_join:
-                pos = self.queue.push(tags['display-name'], tier)
-                if pos == -1:
-                    self.send_message(f"@{tags['display-name']} is already in the queue")
-                else:
-                    self.send_message(f"@{tags['display-name']} was successfully added to the queue at position {pos}")
-            else:
-                level_str = 'subscribers' if self.queue.user_level.name == 'SUPPORTER' else 'mods'
-                self.send_message(f"@{tags['display-name']} only {level_str} can join the queue from Twitch chat")
-
-        if cmd == 'pos':
-            pos = self.queue.user_pos(tags['display-name'])
-            if pos == -1:
-                self.send_message(f"@{tags['display-name']} is not in the queue")
-            else:
-                self.send_message(f"@{tags['display-name']} is in the queue at position {pos}")
-
-        elif cmd == 'leave':
-            if self.queue.remove(tags['display-name']):
-                self.send_message(f"@{tags['display-name']} has been removed from the queue")
-            else:
-                self.send_message(f"@{tags['display-name']} is not in the queue")
-
-        elif cmd == 'queue':
-            s = str(self.queue)
-
-            if s == '':
-                self.send_message('The queue is empty')
-            else:
-                self.send_message(f"Current queue: {s}")
-
-        elif cmd == 'shutdown' and is_admin:
-            self.send_message('Shutting down')
-            self.die('')
-
-        elif cmd == 'next' and is_admin:
-            name, tier = self.queue.pop()
-
-            if name is None:
-                self.send_message('The queue is empty')
-            else:
-                tier_msg = f' at tier {tier}' if len(tier) > 0 else ''
-                self.send_message(f"Up next: {name}{tier_msg}")
-
-        elif cmd == 'promote' and is_admin:
-            if len(args) >= 1 and len(args) <= 2:
-                # Set position to 1 if none was specified
-                if len(args) == 1:
-                    position = 1
-                else:
-                    try:
-                        position = int(args[1])
-                    except ValueError:
-                        self.send_message('Position must be a number')
-                        return
-
-                # Pass arguments to queue
-                success = self.queue.promote(args[0], position)
-                if success:
-                    self.send_message(f"{args[0]} is now at position {position} in the queue")
-                else:
-                    self.send_message('Unable to update queue. Make sure user and position were valid')
-            else:
-                self.send_message('Usage: !promote username position(optional)')
-
-        elif cmd == 'clear' and is_admin:
-            self.queue.clear()
-            self.send_message('The queue has successfully been cleared')
-
-        elif cmd == 'userlevel' and is_admin:
-            if len(args) == 0:
-                self.send_message('Command userlevel requires an argument')
-                return
-
-            if self.queue.set_user_level(args[0].upper()):
-                self.send_message(f'Successfully set the user level to {args[0]}')
-            else:
-                self.send_message(f"Invalid user level {args[0]}")
-        
-        # Command for an admin to override userlevel and add a user
-        elif cmd == 'add' and is_admin:
-            if len(args) == 0:
-                self.send_message('Command add requires an argument')
-                return
-
-            pos = self.queue.push(args[0], '') # Default to no tier
-            if pos == -1:
-                self.send_message(f"{args[0]} is already in the queue")
-            else:
-                self.send_message(f"{args[0]} has been added to the queue at position {pos}")
-
-        # Command for an admin to remove a user from the queue
-        elif cmd == 'remove' and is_admin:
-            if len(args) == 0:
-                self.send_message('Command remove requires an argument')
-                return
-
-            if self.queue.remove(args[0]):
-               self.send_message(f"{args[0]} has been removed from the queue")
-            else:
-               self.send_message(f"{args[0]} was not in the queue to be removed")
-
-        elif cmd == 'queuecommands':
-            self.send_message('The command list can be found at https://github.com/dylanross620/OGC-DiscordBot/blob/master/README.md')
-
-def start(queue, settings):
-    bot = TwitchBot(queue, settings)
-    bot.start()
+        if self.on_ready is not None:
+            self.on_ready()
+
+    # Waiting replies are sent once the channels are joined again, at the rate limit
+    def on_reconnected(self, downtime):
+        print(f"Twitch bot reconnected after {downtime:.1f}s with {self.scheduler.depth()} messages waiting")
+        if metrics.enabled:
+            metrics.histogram('queue_reconnect_seconds', 'Time from losing the connection to being connected again',
+                    platform='twitch').observe(downtime)
+
+    # Queue a message to be sent. Priority messages are sent before any other waiting messages.
+    # If the rate limit allows it, the message is sent straight away
+    def send_message(self, channel, message, priority=False, origin=None):
+        self.scheduler.submit(channel, message, priority, origin)
+        self.send_queued()
+
+    # Queue a per-user reply that can be merged with similar replies if they have to wait
+    def send_grouped(self, channel, prefix, message, item, origin=None):
+        self.scheduler.submit_grouped(channel, prefix, message, item, origin)
+        self.send_queued()
+
+    # Send as many queued messages as the rate limit allows
+    def send_queued(self):
+        if not self.is_connected():
+            return
+
+        for channel, message in self.scheduler.drain():
+            self.privmsg(channel, message)
+
+        now = time.monotonic()
+        if self.scheduler.depth() > 0 and now - self.last_backlog_report > BACKLOG_REPORT_INTERVAL:
+            self.last_backlog_report = now
+            stats = self.scheduler.stats()
+            print(f"Twitch outbound backlog: {stats['depth']} messages waiting, "
+                    f"average send latency {stats['latency_avg']:.1f}s, max {stats['latency_max']:.1f}s")
+
+    def on_pubmsg(self, msg):
+        # Most chat messages aren't commands, so skip them before looking at any tags
+        text = msg.text
+        if text[:1] != '!':
+            return
+
+        queue = self.queues.for_twitch(msg.target)
+        if queue is None:
+            return
+
+        args = text.split()
+        name, caller = args[0][1:].lower(), TwitchCaller(self, queue, msg)
+        if self.queues.remote:
+            asyncio.ensure_future(registry.dispatch_threaded(name, caller, args[1:]))
+        else:
+            registry.dispatch(name, caller, args[1:])
+
+    # Stop the bot, and the Discord bot too if they're running together
+    def shutdown(self):
+        if self.on_shutdown is not None:
+            asyncio.ensure_future(self.on_shutdown())
+        else:
+            self.close()
+        print('Twitch bot shutdown')
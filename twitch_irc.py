@@ -0,0 +1,231 @@
+from typing import Optional
+import asyncio
+import time
+
+from backoff import Backoff
+
+# Minimal asyncio IRC client with support for IRCv3 message tags, which is all that Twitch chat needs.
+# Subclasses handle events by overriding on_welcome, on_reconnected and on_pubmsg.
+
+# Reconnect delays after the connection is lost start at RECONNECT_BASE seconds and back off up
+# to RECONNECT_CAP seconds while reconnecting keeps failing
+RECONNECT_BASE = 1.0
+RECONNECT_CAP = 60.0
+
+# Twitch pings every 5 minutes, so a connection that is silent for longer than this is dead
+READ_TIMEOUT = 360
+
+_TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+def _unescape_tag(value: str) -> str:
+    if '\\' not in value:
+        return value
+
+    out = []
+    i = 0
+    while i < len(value):
+        c = value[i]
+        if c == '\\' and i + 1 < len(value):
+            i += 1
+            out.append(_TAG_ESCAPES.get(value[i], value[i]))
+        elif c != '\\':
+            out.append(c)
+        i += 1
+    return ''.join(out)
+
+def parse_tags(raw_tags: str) -> dict:
+    tags = {}
+    for pair in raw_tags.split(';'):
+        key, _, value = pair.partition('=')
+        tags[key] = _unescape_tag(value)
+    return tags
+
+# Parse a Twitch badges tag such as 'moderator/1,subscriber/3012' into a badge name -> version map
+def parse_badges(raw_badges: str) -> dict:
+    badges = {}
+    if raw_badges:
+        for badge in raw_badges.split(','):
+            name, _, version = badge.partition('/')
+            badges[name] = version
+    return badges
+
+# A message from the server. Tags and badges are only parsed the first time they are used, since
+# most chat messages are never looked at past their text
+class Message():
+    __slots__ = ('raw_tags', '_tags', '_badges', 'prefix', 'command', 'params')
+
+    def __init__(self, raw_tags: str, prefix: str, command: str, params: list):
+        self.raw_tags = raw_tags
+        self._tags = None
+        self._badges = None
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+
+    @property
+    def tags(self) -> dict:
+        if self._tags is None:
+            self._tags = parse_tags(self.raw_tags) if self.raw_tags else {}
+        return self._tags
+
+    @property
+    def badges(self) -> dict:
+        if self._badges is None:
+            self._badges = parse_badges(self.tags.get('badges', ''))
+        return self._badges
+
+    # Nickname of the sender
+    @property
+    def nick(self) -> str:
+        return self.prefix.split('!', 1)[0]
+
+    # Target of the message (such as the channel) and its text
+    @property
+    def target(self) -> str:
+        return self.params[0] if self.params else ''
+
+    @property
+    def text(self) -> str:
+        return self.params[-1] if self.params else ''
+
+# Parse a line (without the line ending) in the form [@tags] [:prefix] command params [:trailing]
+def parse_line(line: str) -> Message:
+    raw_tags = ''
+    if line[:1] == '@':
+        raw_tags, _, line = line[1:].partition(' ')
+
+    prefix = ''
+    if line[:1] == ':':
+        prefix, _, line = line[1:].partition(' ')
+
+    line, has_trailing, trailing = line.partition(' :')
+    params = line.split()
+    command = params.pop(0).upper() if params else ''
+    if has_trailing:
+        params.append(trailing)
+
+    return Message(raw_tags, prefix, command, params)
+
+class IRCClient():
+    def __init__(self, host: str, port: int, nickname: str, password: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.nickname = nickname
+        self.password = password
+
+        self._reader = None
+        self._writer = None
+        self._closing = False
+
+        self.backoff = Backoff(RECONNECT_BASE, RECONNECT_CAP)
+        self.disconnected_at = None # monotonic time the connection was lost, until it is back
+        self.last_heard = 0.0 # monotonic time the last line was received
+
+    def is_connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    # --------------- Sending ---------------
+
+    def send_raw(self, line: str):
+        if self.is_connected():
+            self._writer.write(line.encode('utf-8') + b'\r\n')
+
+    def privmsg(self, target: str, text: str):
+        self.send_raw(f"PRIVMSG {target} :{text}")
+
+    def join(self, channel: str):
+        self.send_raw(f"JOIN {channel}")
+
+    def cap_req(self, capability: str):
+        self.send_raw(f"CAP REQ :{capability}")
+
+    # --------------- Events ---------------
+
+    def on_welcome(self, msg: Message):
+        pass
+
+    def on_pubmsg(self, msg: Message):
+        pass
+
+    # Called when the server welcomes the client back after the connection was lost, with how
+    # long the client was disconnected for
+    def on_reconnected(self, downtime: float):
+        pass
+
+    def dispatch(self, msg: Message):
+        if msg.command == 'PING':
+            self.send_raw(f"PONG :{msg.text}")
+        elif msg.command == 'PRIVMSG' and msg.target[:1] == '#':
+            self.on_pubmsg(msg)
+        elif msg.command == '001':
+            self.backoff.reset()
+            if self.disconnected_at is not None:
+                self.on_reconnected(time.monotonic() - self.disconnected_at)
+                self.disconnected_at = None
+            self.on_welcome(msg)
+
+    # --------------- Running ---------------
+
+    # Connect and handle messages until close is called, reconnecting if the connection is lost
+    async def run(self):
+        self._closing = False
+        while not self._closing:
+            watchdog = None
+            try:
+                await self._connect()
+                watchdog = asyncio.ensure_future(self._watchdog())
+                await self._read_loop()
+            except OSError as e:
+                print(f"IRC connection to {self.host} failed: {e}")
+            finally:
+                if watchdog is not None:
+                    watchdog.cancel()
+                self._disconnect()
+
+            if not self._closing:
+                if self.disconnected_at is None:
+                    self.disconnected_at = time.monotonic()
+                delay = self.backoff.next()
+                print(f"Reconnecting to {self.host} in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+
+    def close(self):
+        self._closing = True
+        self._disconnect()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password is not None:
+            self.send_raw(f"PASS {self.password}")
+        self.send_raw(f"NICK {self.nickname}")
+        self.send_raw(f"USER {self.nickname} 0 * :{self.nickname}")
+
+    async def _read_loop(self):
+        reader = self._reader
+        while not self._closing:
+            line = await reader.readline()
+            if not line:
+                # Connection closed by the server, or by the watchdog
+                return
+            self.last_heard = time.monotonic()
+
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            if line:
+                self.dispatch(parse_line(line))
+
+    # Drop the connection if the server goes quiet for too long, since a connection that died
+    # without being closed would otherwise never be noticed
+    async def _watchdog(self):
+        self.last_heard = time.monotonic()
+        while True:
+            await asyncio.sleep(READ_TIMEOUT / 10)
+            if time.monotonic() - self.last_heard > READ_TIMEOUT:
+                print(f"Nothing heard from {self.host} in {READ_TIMEOUT} seconds, reconnecting")
+                self._writer.close()
+                return
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._reader = None